@@ -1,101 +1,382 @@
+import hashlib
+import logging
 import os
 
+import click
 from dotenv import load_dotenv
 from flask import (
     Flask,
     flash,
+    g,
     get_flashed_messages,
     jsonify,
+    make_response,
     redirect,
     render_template,
     request,
     session,
     url_for,
 )
-from spotipy import Spotify
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+from werkzeug.local import LocalProxy
 
 import db
+import metrics
+import votes
 from auth import get_app_spotify_client, handle_callback, spotify_auth
-from spotify import get_album_image_url, get_dashboard_data, get_user, get_user_profile
+from bulk import bulk_command
+from cache import TwoTierCache
+from logs import configure_logging
+from migrate import migrate_command
+from spotify import (
+    PLACEHOLDER_IMAGE,
+    attach_album_images,
+    get_album_image_urls,
+    get_cached_user,
+    get_spotify_client,
+    get_user_profile,
+    parse_spotify_url,
+    resolve_spotify_artwork,
+)
 
 load_dotenv()
+configure_logging()
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET")
+metrics.init_app(app)
+votes.start_flusher()
 
+# Most threads and comments /ajax/artwork resolves in one request.
+ARTWORK_BATCH_SIZE = 100
 
-@app.context_processor
-def user_injection():
-    """Injects the user into the template context."""
-    user = None
-    subscribed_forums = []
-    subscribed_forum_ids = []
-    role = None
-    token_info = session.get("token_info")
-    user_id = session.get("user_id")
+_thread_card_cache = TwoTierCache(
+    "thread_card",
+    maxsize=int(os.getenv("THREAD_CARD_CACHE_SIZE", "5000")),
+    ttl=int(os.getenv("THREAD_CARD_CACHE_TTL", "3600")),
+)
 
-    if token_info is not None and user_id is not None:
-        try:
-            user = get_user(token_info["access_token"])
 
-            subscribed_forums = db.get_user_subforum_subscriptions(user_id)
-            subscribed_forum_ids = [forum["id"] for forum in subscribed_forums]
-            role = db.get_user_role(user_id)
+def get_session_spotify_client():
+    """Returns a Spotify client for the logged in user, or the app's own client."""
+    token_info = session.get("token_info")
+    if token_info is not None:
+        return get_spotify_client(token_info["access_token"])
+    return get_app_spotify_client()
+
+
+def load_current_user():
+    """Returns the logged in user's Spotify profile, looked up at most once per request.
+
+    Returns
+    -------
+        dict
+            The Spotify profile of the user.
+        None
+            If no user is logged in or the profile could not be fetched.
+    """
+    if "current_user" not in g:
+        g.current_user = None
+        token_info = session.get("token_info")
+        user_id = session.get("user_id")
+
+        if token_info is not None and user_id is not None:
+            try:
+                g.current_user = get_cached_user(token_info["access_token"], user_id)
+            except Exception as e:
+                logger.warning("Fel vid hämtning av användarinfo: %s", e)
+
+    return g.current_user
+
+
+def load_sidebar():
+    """Returns the logged in user's subscribed forums and role, once per request.
+
+    Returns
+    -------
+        dict
+            A dictionary with subscribed_forums (list of dict),
+            subscribed_forum_ids (list of int) and role (str or None).
+    """
+    if "sidebar" not in g:
+        g.sidebar = {
+            "subscribed_forums": [],
+            "subscribed_forum_ids": [],
+            "role": None,
+        }
+        user_id = session.get("user_id")
+
+        if session.get("token_info") is not None and user_id is not None:
+            try:
+                sidebar = db.get_user_sidebar_data(user_id)
+                g.sidebar = {
+                    "subscribed_forums": sidebar["subscribed_forums"],
+                    "subscribed_forum_ids": [
+                        forum["id"] for forum in sidebar["subscribed_forums"]
+                    ],
+                    "role": sidebar["role"],
+                }
+            except Exception:
+                logger.exception("Fel vid hämtning av sidopanelen")
+
+    return g.sidebar
 
-        except Exception as e:
-            print(f"Fel vid hämtning av användarinfo: {e}")
 
+@app.context_processor
+def user_injection():
+    """Injects the user into the template context.
+
+    The values are proxies, so Spotify and the database are only queried if
+    the template actually uses them, and at most once per request.
+    """
     return dict(
-        user=user,
-        subscribed_forums=subscribed_forums,
-        subscribed_forum_ids=subscribed_forum_ids,
-        role=role,
+        user=LocalProxy(load_current_user),
+        subscribed_forums=LocalProxy(lambda: load_sidebar()["subscribed_forums"]),
+        subscribed_forum_ids=LocalProxy(lambda: load_sidebar()["subscribed_forum_ids"]),
+        role=LocalProxy(lambda: load_sidebar()["role"]),
     )
 
 
+def _template_digest(name):
+    with open(os.path.join(app.root_path, app.template_folder, name), "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:8]
+
+
+# Part of every card's cache key, so a deploy that changes the card markup
+# does not serve cards rendered by the old template.
+THREAD_CARD_TEMPLATE_VERSION = _template_digest("thread_card.html")
+
+
+def thread_card_cache_key(thread):
+    """Builds the fragment cache key of a thread's card.
+
+    Args
+    -------
+        thread : dict
+            A thread from one of the thread list queries.
+
+    Returns
+    -------
+        str
+            A key that changes whenever anything shown on the card changes.
+    """
+    # Built from the displayed fields rather than updated_at, which is also
+    # bumped by every vote and comment that the card does not show.
+    version = repr(
+        (
+            thread.get("title"),
+            thread.get("description"),
+            thread.get("forum_id"),
+            thread.get("username"),
+            thread.get("spotify_url"),
+            thread.get("album_image"),
+            thread.get("artwork_pending"),
+            thread.get("created_at"),
+            THREAD_CARD_TEMPLATE_VERSION,
+        )
+    )
+    return f"{thread['id']}:{hashlib.sha1(version.encode()).hexdigest()[:16]}"
+
+
+@app.template_global()
+def render_thread_cards(threads):
+    """Renders the cards of a list of threads, reusing cached markup.
+
+    A card looks the same to every visitor, so its HTML is cached across
+    requests and workers, keyed by the thread's ID and version. The whole
+    list is looked up with one cache round trip and only the misses are
+    rendered.
+
+    Args
+    -------
+        threads : list of dict
+            The threads to render.
+
+    Returns
+    -------
+        Markup
+            The cards' HTML.
+    """
+    keys = [thread_card_cache_key(thread) for thread in threads]
+    cards = _thread_card_cache.get_many(keys)
+
+    rendered = {}
+    template = app.jinja_env.get_template("thread_card.html")
+    for key, thread in zip(keys, threads):
+        if key not in cards:
+            cards[key] = rendered[key] = template.render(thread=thread)
+    _thread_card_cache.set_many(rendered)
+
+    return Markup("".join(cards[key] for key in keys))
+
+
+def page_etag(*version):
+    """Builds the ETag of a page for the current visitor.
+
+    Besides the version of the page's own data, the ETag covers what else
+    the rendered page depends on: the URL, the logged in user and their
+    sidebar.
+
+    Args
+    -------
+        *version
+            Values that change whenever the page's data changes.
+
+    Returns
+    -------
+        str
+            The ETag, without quotes.
+    """
+    raw = repr((request.full_path, session.get("user_id"), load_sidebar(), version))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def not_modified(etag, last_modified=None):
+    """Answers a conditional GET before the page is built, if possible.
+
+    Pages with pending flash messages are always rendered, since showing
+    the messages consumes them, and are sent without validators.
+
+    Args
+    -------
+        etag : str
+            The page's ETag from page_etag.
+        last_modified : datetime
+            When the page's data last changed, if known.
+
+    Returns
+    -------
+        flask.Response
+            A 304 Not Modified response if the client's copy is current.
+        None
+            If the page has to be rendered.
+    """
+    if "_flashes" in session:
+        g.skip_validators = True
+        return None
+
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+
+    return with_validators("", etag, last_modified, status=304)
+
+
+def with_validators(body, etag, last_modified=None, status=200):
+    """Wraps a rendered page in a response carrying its ETag and Last-Modified.
+
+    Args
+    -------
+        body : str
+            The rendered page.
+        etag : str
+            The page's ETag from page_etag.
+        last_modified : datetime
+            When the page's data last changed, if known.
+        status : int
+            The response status code.
+
+    Returns
+    -------
+        flask.Response
+            The response, marked private and to be revalidated on every use.
+    """
+    response = make_response(body, status)
+    if g.get("skip_validators"):
+        return response
+
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def load_thread_page(feed, before=None, forum_id=None):
+    """Fetches one page of threads, with any known album artwork, for a thread list.
+
+    Args
+    -------
+        feed : str
+            "subscriptions" for the logged in user's dashboard, "forum" for a
+            subforum or "all" for the most recent threads on the site.
+        before : tuple
+            A (created_at, id) cursor; only threads older than it are fetched.
+        forum_id : int
+            The ID of the subforum when feed is "forum".
+
+    Returns
+    -------
+        tuple
+            The list of threads and the cursor of the next page, or None if
+            this is the last page.
+    """
+    if feed == "subscriptions":
+        threads = db.get_threads_by_user_subscriptions(
+            session["user_id"], before=before
+        )
+        attach_album_images(threads)
+    else:
+        if feed == "forum":
+            threads = db.get_threads_by_forum(forum_id, before=before)
+        else:
+            threads = db.get_all_threads(before=before)
+        logged_in = (
+            session.get("token_info") is not None and session.get("user_id") is not None
+        )
+        attach_album_images(threads, mark_pending=logged_in)
+
+    next_cursor = None
+    if len(threads) == db.THREADS_PAGE_SIZE:
+        next_cursor = db.encode_thread_cursor(threads[-1])
+    return threads, next_cursor
+
+
 @app.route("/")
 def index():
     token_info = session.get("token_info")
     user_id = session.get("user_id")
     show_all = request.args.get("show_all", "false").lower() == "true"
+    before = db.decode_thread_cursor(request.args.get("before"))
     user = None
     auth_url = None
 
-    sp = None
-    threads = []
+    if token_info is not None and user_id is not None:
+        feed = "all" if show_all else "subscriptions"
+    else:
+        feed = "all"
+
+    forum_ids = None
+    if feed == "subscriptions":
+        forum_ids = load_sidebar()["subscribed_forum_ids"]
+    etag = page_etag(*db.get_forums_version(forum_ids))
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
 
     if token_info is not None and user_id is not None:
-        user, threads = get_dashboard_data(token_info, user_id)
-        if show_all:
-            threads = db.get_all_threads()
-            sp = Spotify(auth=token_info["access_token"])
-            for thread in threads:
-                spotify_url = thread.get("spotify_url")
-                if spotify_url is not None:
-                    thread["album_image"] = get_album_image_url(spotify_url, sp)
-                else:
-                    thread["album_image"] = "/static/tunelink.png"
-        else:
-            user, threads = get_dashboard_data(token_info, user_id)
+        user = load_current_user()
     else:
-        threads = db.get_all_threads()
-        sp = get_app_spotify_client()
         auth_url = spotify_auth(session)
 
-        for thread in threads:
-            spotify_url = thread.get("spotify_url")
-            if spotify_url is not None:
-                thread["album_image"] = get_album_image_url(spotify_url, sp)
-            else:
-                thread["album_image"] = "/static/tunelink.png"
+    threads, next_cursor = load_thread_page(feed, before)
 
-    return render_template(
+    page = render_template(
         "dashboard.html",
         threads=threads,
         show_all=show_all,
         user=user,
         auth_url=auth_url if user is None else None,
+        next_cursor=next_cursor,
+        next_page_url=url_for(
+            "index", show_all="true" if show_all else None, before=next_cursor
+        ),
+        next_url=url_for("ajax_threads", feed=feed, before=next_cursor),
     )
+    return with_validators(page, etag)
 
 
 @app.route("/callback")
@@ -112,7 +393,29 @@ def profile():
         return redirect(url_for("index"))
 
     user_profile_dict = get_user_profile(token_info["access_token"], session["user_id"])
+    if user_profile_dict is None:
+        return redirect(
+            url_for("error", error="Kunde inte hämta din profil från Spotify.")
+        )
+    return render_profile(user_profile_dict, is_own_profile=True)
+
+
+@app.route("/profile/<int:user_id>")
+def show_user_profile(user_id):
+    if session.get("token_info") is None:
+        return redirect(url_for("index"))
+    if user_id == session.get("user_id"):
+        return redirect(url_for("profile"))
+
+    # Andras profiler visas från den sparade ögonblicksbilden
+    user_profile_dict = get_user_profile(None, user_id)
+    if user_profile_dict is None:
+        return redirect(url_for("error", error="Profilen existerar inte."))
+    return render_profile(user_profile_dict, is_own_profile=False)
+
 
+def render_profile(user_profile_dict, is_own_profile):
+    """Renders a profile page from the dict returned by get_user_profile."""
     return render_template(
         "profile.html",
         user=user_profile_dict["user"],
@@ -121,6 +424,7 @@ def profile():
         genres=user_profile_dict["top_genres"],
         bio=user_profile_dict["bio"],
         spotify_url=user_profile_dict["spotify_url"],
+        is_own_profile=is_own_profile,
     )
 
 
@@ -156,29 +460,33 @@ def create_bio():
 
 @app.route("/subforum/<name>")
 def show_subforum(name):
-    subforum_data_dict = db.get_subforum_data(name)
-    if subforum_data_dict is None:
+    subforum = db.get_subforum_by_name(name)
+    if subforum is None:
         return redirect(url_for("error", error="Subforumet existerar inte."))
 
     token_info = session.get("token_info")
     if token_info is None:
         return redirect(url_for("index"))
 
-    sp = Spotify(auth=token_info["access_token"])
-    user = get_user(session["token_info"]["access_token"])
+    etag = page_etag(subforum["updated_at"])
+    cached = not_modified(etag, subforum["updated_at"])
+    if cached is not None:
+        return cached
 
-    threads = subforum_data_dict["threads"]
-    for thread in threads:
-        thread["image_url"] = get_album_image_url(thread["spotify_url"], sp)
-    print("DEBUG forum dict:", subforum_data_dict["subforum"])
+    before = db.decode_thread_cursor(request.args.get("before"))
+    threads, next_cursor = load_thread_page("forum", before, subforum["id"])
+    logger.debug("Showing subforum", extra={"forum_id": subforum["id"]})
 
-    return render_template(
+    page = render_template(
         "subforum.html",
         name=name,
-        forum=subforum_data_dict["subforum"],
+        forum=subforum,
         threads=threads,
-        user=user,
+        next_cursor=next_cursor,
+        next_page_url=url_for("show_subforum", name=name, before=next_cursor),
+        next_url=url_for("ajax_threads", feed="forum", forum=name, before=next_cursor),
     )
+    return with_validators(page, etag, subforum["updated_at"])
 
 
 @app.route("/subforum/<name>/create_thread_app", methods=["POST"])
@@ -205,7 +513,10 @@ def create_thread_in_app(name):
     if not description:
         return redirect(url_for("error", error="Inläggsbeskrivning kan inte vara tom."))
 
-    db.create_thread_in_db(subforum_id, creator_id, title, spotify_url, description)
+    artwork = resolve_spotify_artwork(spotify_url, get_session_spotify_client())
+    db.create_thread_in_db(
+        subforum_id, creator_id, title, spotify_url, description, **artwork
+    )
     return redirect(url_for("show_subforum", name=name))
 
 
@@ -250,38 +561,62 @@ def unsubscribe(name):
 
 @app.route("/thread/<int:thread_id>")
 def show_thread(thread_id):
-    thread = db.get_thread_by_id(thread_id)
-    if thread is None:
-        return redirect(url_for("error", error="Tråden existerar inte."))
-
     token_info = session.get("token_info")
     user_id = session.get("user_id")
     if token_info is None or user_id is None:
         return redirect(url_for("index"))
 
-    sp = Spotify(auth=token_info["access_token"])
-    thread["image_url"] = get_album_image_url(thread["spotify_url"], sp)
+    after = db.decode_thread_cursor(request.args.get("after"))
+    thread = None
+    if request.if_none_match or request.if_modified_since:
+        # Versionen räcker för att svara 304 utan att hämta hela sidan
+        updated_at = db.get_thread_version(thread_id)
+    else:
+        thread = db.get_thread_page(thread_id, user_id, after=after)
+        updated_at = thread["updated_at"] if thread is not None else None
+    if updated_at is None:
+        return redirect(url_for("error", error="Tråden existerar inte."))
 
-    comments = db.get_comments_for_thread(thread_id)
+    # Röster som ännu inte skrivits till databasen finns bara i Redis
+    buffered = votes.get_buffered_votes(thread_id, user_id)
+    etag = page_etag(updated_at, buffered)
+    cached = not_modified(etag, updated_at)
+    if cached is not None:
+        return cached
 
-    # 💡 Lägg till image_url för varje kommentar om de har en Spotify-länk
-    for comment in comments:
-        spotify_url = comment.get("spotify_url")
-        if spotify_url:
-            comment["image_url"] = get_album_image_url(spotify_url, sp)
-        else:
-            comment["image_url"] = "/static/tunelink.png"
+    if thread is None:
+        thread = db.get_thread_page(thread_id, user_id, after=after)
+        if thread is None:
+            return redirect(url_for("error", error="Tråden existerar inte."))
+    if buffered is not None:
+        thread["likes"] = buffered["likes"]
+        thread["dislikes"] = buffered["dislikes"]
+        if buffered["vote"] is not None:
+            thread["user_vote"] = buffered["vote"]
+
+    comments = thread["comments"]
+    next_page_url = None
+    if thread["has_more_comments"]:
+        next_page_url = url_for(
+            "show_thread",
+            thread_id=thread_id,
+            after=db.encode_thread_cursor(comments[-1]),
+        )
 
-    likes_and_dislikes = db.get_thread_likes_and_dislikes(thread_id)
+    # Omslagsbilder som saknas hämtas av main.js via /ajax/artwork
+    attach_album_images([thread, *comments], key="image_url")
 
-    return render_template(
+    page = render_template(
         "thread.html",
         thread=thread,
         comments=comments,
-        likes=likes_and_dislikes["likes"],
-        dislikes=likes_and_dislikes["dislikes"],
+        likes=thread["likes"],
+        dislikes=thread["dislikes"],
+        user_vote=thread["user_vote"],
         user_id=user_id,
+        next_page_url=next_page_url,
     )
+    return with_validators(page, etag, updated_at)
 
 
 @app.route("/thread/<int:thread_id>/remove", methods=["POST"])
@@ -291,25 +626,25 @@ def remove_thread(thread_id):
         flash("Du måste vara inloggad för att ta bort en tråd.", "danger")
         return jsonify({"error": "Användaren är inte inloggad."}), 401
 
-    thread = db.get_thread_by_id(thread_id)
+    result = db.remove_thread_from_db(thread_id, user_id)
 
-    if not thread:
+    if result is False:
+        flash("Fel uppstod vid borttagning av tråden.", "danger")
+        return jsonify({"error": "Fel uppstod vid borttagning av tråden."}), 500
+
+    if result is None:
         flash("Tråden du försöker ta bort existerar inte.", "danger")
         return jsonify({"error": "Tråden existerar inte."}), 404
 
-    if thread["creator_id"] != user_id:
+    if not result["removed"]:
         flash("Du har inte rättigheter att ta bort denna tråd.", "danger")
         return (
             jsonify({"error": "Du har inte rättigheter att ta bort denna tråd."}),
             403,
         )
+    votes.forget_thread(thread_id)
 
-    is_thread_removed = db.remove_thread_from_db(thread_id)
-    if not is_thread_removed:
-        flash("Fel uppstod vid borttagning av tråden.", "danger")
-        return jsonify({"error": "Fel uppstod vid borttagning av tråden."}), 500
-
-    return jsonify({"success": True, "subforum_name": thread["subforum_name"]}), 200
+    return jsonify({"success": True, "subforum_name": result["subforum_name"]}), 200
 
 
 @app.route("/thread/<int:thread_id>/vote", methods=["POST"])
@@ -321,33 +656,25 @@ def like_or_dislike_thread(thread_id):
     if like_or_dislike not in [1, -1]:
         return jsonify({"error": "Ogiltig röst."}), 400
 
-    db.register_thread_like_or_dislike(user_id, thread_id, like_or_dislike)
-    total_likes_and_dislikes = db.get_thread_likes_and_dislikes(thread_id)
+    total_likes_and_dislikes = votes.register_vote(user_id, thread_id, like_or_dislike)
+    if total_likes_and_dislikes is None:
+        if db.get_thread_version(thread_id) is None:
+            return jsonify({"error": "Tråden existerar inte."}), 404
+        return jsonify({"error": "Rösten kunde inte registreras."}), 500
 
     return jsonify(total_likes_and_dislikes)
 
 
 @app.route("/error")
 def error():
-    user = get_user(session["token_info"]["access_token"])
-
     error_message = request.args.get("error")
-    return render_template("error.html", error=error_message, user=user)
+    return render_template("error.html", error=error_message)
 
 
 @app.errorhandler(404)
 def page_not_found(err):
-    user = None
-    if "token_info" in session:
-        try:
-            user = get_user(session["token_info"]["access_token"])
-        except Exception as e:
-            print(f"Fel vid hämtning av användarinfo: {e}")
-
     return (
-        render_template(
-            "error.html", error="Sidan du försöker nå, existerar inte.", user=user
-        ),
+        render_template("error.html", error="Sidan du försöker nå, existerar inte."),
         404,
     )
 
@@ -379,7 +706,10 @@ def comment_on_thread(thread_id):
         flash("Du måste skriva något.", "danger")
         return redirect(url_for("show_thread", thread_id=thread_id))
 
-    comments = db.add_comment_to_thread(thread_id, user_id, description, spotify_url)
+    artwork = resolve_spotify_artwork(spotify_url, get_session_spotify_client())
+    comments = db.add_comment_to_thread(
+        thread_id, user_id, description, spotify_url, **artwork
+    )
     flash("Kommentar tillagd.", "success")
     return redirect(url_for("show_thread", comments=comments, thread_id=thread_id))
 
@@ -390,23 +720,226 @@ def logout():
     return redirect(url_for("index"))
 
 
+@app.route("/ajax/search_subforums")
+def ajax_search_subforums():
+    query = request.args.get("q", "").strip()
+    if query is None:
+        return jsonify([])
 
+    results = db.search_subforums_by_name(query)
+    return jsonify(results)
 
 
+@app.route("/ajax/search")
+def ajax_search():
+    """Full-text search over threads and comments, best match first.
 
+    Query parameters are q (the search terms) and after (the cursor from the
+    previous page). The response holds the results and the URL of the next
+    page, or null on the last page.
+    """
+    query = request.args.get("q", "").strip()
+    if len(query) < 2:
+        return jsonify({"results": [], "next_url": None})
 
+    after = db.decode_search_cursor(request.args.get("after"))
+    results = db.search_threads_and_comments(query, after=after)
 
+    next_url = None
+    if len(results) == db.SEARCH_PAGE_SIZE:
+        next_url = url_for(
+            "ajax_search", q=query, after=db.encode_search_cursor(results[-1])
+        )
 
+    return jsonify(
+        {
+            "results": [
+                {
+                    "kind": result["kind"],
+                    "id": result["id"],
+                    "thread_id": result["thread_id"],
+                    "title": result["title"],
+                    "description": result["description"],
+                    "username": result["username"],
+                    "created_at": result["created_at"].isoformat(),
+                    "url": url_for("show_thread", thread_id=result["thread_id"]),
+                }
+                for result in results
+            ],
+            "next_url": next_url,
+        }
+    )
 
 
-@app.route("/ajax/search_subforums")
-def ajax_search_subforums():
-    query = request.args.get("q", "").strip()
-    if query is None:
-        return jsonify([])
+@app.route("/ajax/threads")
+def ajax_threads():
+    """Returns the next page of a thread list for infinite scrolling.
+
+    Query parameters are feed ("all", "subscriptions" or "forum"), forum
+    (the subforum name when feed is "forum") and before (the cursor from the
+    previous page). The response holds the rendered thread cards and the URL
+    of the page after this one, or null on the last page.
+    """
+    feed = request.args.get("feed", "all")
+    forum_name = request.args.get("forum")
+    before = db.decode_thread_cursor(request.args.get("before"))
+    forum_id = None
+
+    if feed not in ("all", "subscriptions", "forum"):
+        return jsonify({"error": "Ogiltigt flöde."}), 400
+
+    if feed != "all" and (
+        session.get("token_info") is None or session.get("user_id") is None
+    ):
+        return jsonify({"error": "Användaren är inte inloggad."}), 401
+
+    if feed == "forum":
+        subforum = db.get_subforum_by_name(forum_name)
+        if subforum is None:
+            return jsonify({"error": "Subforumet existerar inte."}), 404
+        forum_id = subforum["id"]
+
+    threads, next_cursor = load_thread_page(feed, before, forum_id)
+
+    next_url = None
+    if next_cursor is not None:
+        next_url = url_for(
+            "ajax_threads", feed=feed, forum=forum_name, before=next_cursor
+        )
+
+    return jsonify(
+        {
+            "html": render_template("thread_cards.html", threads=threads),
+            "next_url": next_url,
+        }
+    )
+
+
+def store_artwork(table, rows, sp):
+    """Resolves and stores the artwork of threads or comments that have none.
+
+    Args
+    -------
+        table : str
+            "threads" or "t_comments".
+        rows : list of dict
+            Rows from db.get_artwork_rows or db.get_rows_missing_artwork.
+        sp : Spotify
+            Spotipy client object.
+
+    Returns
+    -------
+        dict
+            The IDs of the rows whose artwork could be resolved, mapped to it.
+            Rows that failed because of a temporary error are left out.
+    """
+    images = get_album_image_urls(
+        [row["spotify_url"] for row in rows], sp, default=None
+    )
+    resolved = []
+    for row in rows:
+        album_image = images.get(row["spotify_url"])
+        if album_image is None:
+            continue
+        parsed = parse_spotify_url(row["spotify_url"]) or (None, None)
+        resolved.append(
+            {
+                "id": row["id"],
+                "spotify_type": parsed[0],
+                "spotify_id": parsed[1],
+                "album_image": album_image,
+            }
+        )
+
+    db.update_artwork(table, resolved)
+    return {row["id"]: row["album_image"] for row in resolved}
+
+
+@app.route("/ajax/artwork")
+def ajax_artwork():
+    """Returns the album artwork of threads and comments shown without it.
+
+    Query parameters are threads and comments, comma separated IDs of at
+    most ARTWORK_BATCH_SIZE rows in total. Artwork that is not stored yet is
+    fetched from Spotify and stored, so the next page view has it. The
+    response maps each kind to an object of ID to image URL. Only logged
+    in users may call it, since every request can cost Spotify calls;
+    pages shown to anyone else do not mark artwork as pending.
+    """
+    if session.get("token_info") is None or session.get("user_id") is None:
+        return jsonify({"error": "Användaren är inte inloggad."}), 401
+
+    ids = {}
+    try:
+        for kind in ("threads", "comments"):
+            raw = request.args.get(kind, "")
+            ids[kind] = [int(value) for value in raw.split(",") if value]
+    except ValueError:
+        return jsonify({"error": "Ogiltigt ID."}), 400
+
+    if len(ids["threads"]) + len(ids["comments"]) > ARTWORK_BATCH_SIZE:
+        return jsonify({"error": "För många ID:n."}), 400
+
+    sp = None
+    images = {}
+    for kind, table in (("threads", "threads"), ("comments", "t_comments")):
+        rows = db.get_artwork_rows(table, ids[kind])
+        images[kind] = {row["id"]: row["album_image"] for row in rows}
+
+        missing = [row for row in rows if not row["album_image"] and row["spotify_url"]]
+        if missing:
+            sp = sp or get_session_spotify_client()
+            images[kind].update(store_artwork(table, missing, sp))
+
+        for row in rows:
+            if not images[kind][row["id"]]:
+                images[kind][row["id"]] = PLACEHOLDER_IMAGE
+
+    return jsonify(images)
+
+
+app.cli.add_command(migrate_command)
+app.cli.add_command(bulk_command)
+
+
+@app.cli.command("backfill-artwork")
+@click.option("--batch-size", default=100, show_default=True)
+def backfill_artwork(batch_size):
+    """Stores album artwork for threads and comments that have none yet.
+
+    Rows are processed in batches ordered by ID and each batch is committed
+    on its own, so the command can be stopped at any time and simply be run
+    again to continue. Rows that could not be resolved are left for the next
+    run.
+    """
+    sp = get_app_spotify_client()
+
+    for table in db.ARTWORK_TABLES:
+        last_id = 0
+        updated = 0
+        while True:
+            rows = db.get_rows_missing_artwork(table, last_id, batch_size)
+            if not rows:
+                break
+
+            updated += len(store_artwork(table, rows, sp))
+            last_id = rows[-1]["id"]
+            click.echo(f"{table}: {updated} rows updated, up to id {last_id}")
+
+
+@app.cli.command("set-role")
+@click.argument("user_id", type=int)
+@click.argument("role", type=click.Choice(["user", "admin"]))
+def set_role(user_id, role):
+    """Gives a user the "user" or "admin" role.
+
+    The user's cached sidebar data is invalidated, so the change shows up on
+    their next page view.
+    """
+    if not db.update_user_role(user_id, role):
+        raise click.ClickException(f"No user with id {user_id}")
+    click.echo(f"User {user_id} is now {role}")
 
-    results = db.search_subforums_by_name(query)
-    return jsonify(results)
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -1,12 +1,28 @@
+import logging
 import os
+import threading
 
 from flask import request
 from spotipy import Spotify
-from spotipy.cache_handler import FlaskSessionCacheHandler
+from spotipy.cache_handler import FlaskSessionCacheHandler, MemoryCacheHandler
 from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
 
 from db import controll_user_login
-from spotify import get_user_profile_id_and_display_name
+from spotify import (
+    SPOTIFY_API_PREFIX,
+    get_http_session,
+    get_user_profile_id_and_display_name,
+)
+
+logger = logging.getLogger(__name__)
+
+# The app token counts as expired this many seconds early, so a token is
+# never sent to Spotify just as it runs out.
+APP_TOKEN_REFRESH_MARGIN = 300
+
+_app_client = None
+_app_client_pid = None
+_app_client_lock = threading.Lock()
 
 
 def spotify_auth(session):
@@ -52,6 +68,7 @@ def handle_callback(session):
         scope=os.getenv("SPOTIPY_SCOPE"),
         cache_handler=FlaskSessionCacheHandler(session),
         show_dialog=True,
+        requests_session=get_http_session(),
     )
 
     code = request.args.get("code")
@@ -64,12 +81,56 @@ def handle_callback(session):
     display_name = user_profile_dict["display_name"]
 
     session["user_id"] = controll_user_login(spotify_id, display_name)
+    logger.info("User logged in", extra={"user_id": session["user_id"]})
 
     return None
 
 
+class AppCredentials(SpotifyClientCredentials):
+    """Client credentials whose token is shared by the whole process.
+
+    The token is kept in memory. It is renewed lazily, by the first request
+    made within APP_TOKEN_REFRESH_MARGIN seconds of its expiry; there is no
+    background refresh. When it needs renewing, one thread fetches a new
+    token while the others wait for it instead of each calling the token
+    endpoint.
+    """
+
+    OAUTH_TOKEN_URL = os.getenv(
+        "SPOTIFY_TOKEN_URL", SpotifyClientCredentials.OAUTH_TOKEN_URL
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_token_expired(token_info):
+        return SpotifyClientCredentials.is_token_expired(
+            {"expires_at": token_info["expires_at"] - APP_TOKEN_REFRESH_MARGIN}
+        )
+
+    def get_access_token(self, as_dict=True, check_cache=True):
+        token_info = self.cache_handler.get_cached_token()
+        if check_cache and token_info and not self.is_token_expired(token_info):
+            return token_info if as_dict else token_info["access_token"]
+
+        with self._lock:
+            token_info = self.cache_handler.get_cached_token()
+            if check_cache and token_info and not self.is_token_expired(token_info):
+                return token_info if as_dict else token_info["access_token"]
+
+            logger.info("Renewing the Spotify app token")
+            return super().get_access_token(as_dict=as_dict, check_cache=False)
+
+
 def get_app_spotify_client():
-    """Initializes and returns a Spotify client for the application.
+    """Returns the Spotify client the application uses on its own behalf.
+
+    The client is created once per process and reused, together with its
+    token and the shared HTTP session. It is recreated after a fork, so
+    worker processes never share the parent's client or its connections.
+
     Enivronment variables:
         SPOTIPY_CLIENT_ID: Spotify client ID.
         SPOTIPY_CLIENT_SECRET: Spotify client secret.
@@ -78,8 +139,23 @@ def get_app_spotify_client():
     -------
         spotipy.Spotify: an authenticated Spotify client.
     """
-    auth_manager = SpotifyClientCredentials(
-        client_id=os.getenv("SPOTIPY_CLIENT_ID"),
-        client_secret=os.getenv("SPOTIPY_CLIENT_SECRET"),
-    )
-    return Spotify(auth_manager=auth_manager)
+    global _app_client, _app_client_pid
+
+    if _app_client is not None and _app_client_pid == os.getpid():
+        return _app_client
+
+    with _app_client_lock:
+        if _app_client is None or _app_client_pid != os.getpid():
+            auth_manager = AppCredentials(
+                client_id=os.getenv("SPOTIPY_CLIENT_ID"),
+                client_secret=os.getenv("SPOTIPY_CLIENT_SECRET"),
+                cache_handler=MemoryCacheHandler(),
+                requests_session=get_http_session(),
+            )
+            client = Spotify(
+                auth_manager=auth_manager, requests_session=get_http_session()
+            )
+            client.prefix = SPOTIFY_API_PREFIX
+            _app_client = client
+            _app_client_pid = os.getpid()
+    return _app_client
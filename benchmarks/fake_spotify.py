@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _image(spotify_id):
+    return [{"url": f"https://i.scdn.co/image/{spotify_id}", "height": 640}]
+
+
+def _track(spotify_id):
+    return {
+        "id": spotify_id,
+        "name": f"Track {spotify_id}",
+        "uri": f"spotify:track:{spotify_id}",
+        "artists": [{"name": f"Artist {spotify_id[:4]}"}],
+        "album": {"id": spotify_id, "images": _image(spotify_id)},
+    }
+
+
+def _album(spotify_id):
+    return {
+        "id": spotify_id,
+        "name": f"Album {spotify_id}",
+        "images": _image(spotify_id),
+    }
+
+
+def _artist(rank):
+    genres = ["indie", "rock", "pop", "jazz", "techno", "folk"]
+    return {
+        "name": f"Artist {rank}",
+        "uri": f"spotify:artist:{rank}",
+        "genres": genres[rank % len(genres) : rank % len(genres) + 2],
+    }
+
+
+class FakeSpotify:
+    """Local stand-in for the Spotify Web API and token endpoint.
+
+    Answers the calls the app makes with generated data after a fixed
+    latency, and counts them, so benchmarks can measure how many Spotify
+    calls a page makes and how much Spotify latency it waits for. With
+    rate_limit it answers 429 like Spotify does when it throttles an app.
+
+    Args
+    -------
+        latency : float
+            Seconds every response is delayed by.
+    """
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = 0
+        # (time.monotonic(), path, status) of every call since reset_calls.
+        self.log = []
+        self._rate_limited_calls = 0
+        self._retry_after = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def api_prefix(self):
+        return f"http://127.0.0.1:{self._server.server_port}/v1/"
+
+    @property
+    def token_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/api/token"
+
+    def start(self):
+        """Serves requests on a background thread."""
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        """Stops serving requests."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_calls(self):
+        """Resets the call counter and log and returns the old count."""
+        with self._lock:
+            calls, self.calls = self.calls, 0
+            self.log = []
+        return calls
+
+    def rate_limit(self, calls, retry_after=1):
+        """Answers the next Web API calls with 429 and a Retry-After header.
+
+        Args
+        -------
+            calls : int
+                The number of calls to reject.
+            retry_after : int
+                Seconds sent in the Retry-After header.
+        """
+        with self._lock:
+            self._rate_limited_calls = calls
+            self._retry_after = retry_after
+
+    def respond(self, method, path, query):
+        """Builds the response for one request.
+
+        Returns
+        -------
+            tuple
+                The status code, the response body and any extra headers.
+        """
+        with self._lock:
+            self.calls += 1
+            rate_limited = path.startswith("/v1/") and self._rate_limited_calls > 0
+            if rate_limited:
+                self._rate_limited_calls -= 1
+            status = 429 if rate_limited else 200
+            self.log.append((time.monotonic(), path, status))
+        time.sleep(self.latency)
+
+        if rate_limited:
+            return (
+                429,
+                {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                {"Retry-After": str(self._retry_after)},
+            )
+
+        ids = query.get("ids", [""])[0].split(",")
+        if method == "POST" and path == "/api/token":
+            return (
+                200,
+                {
+                    "access_token": "fake-app-token",
+                    "token_type": "Bearer",
+                    "expires_in": 3600,
+                },
+                {},
+            )
+        if path == "/v1/me":
+            return (
+                200,
+                {"id": "fake-user", "display_name": "Fake User", "images": []},
+                {},
+            )
+        if path == "/v1/me/top/tracks":
+            return 200, {"items": [_track(f"top{rank:018d}") for rank in range(5)]}, {}
+        if path == "/v1/me/top/artists":
+            return 200, {"items": [_artist(rank) for rank in range(5)]}, {}
+        if path == "/v1/tracks":
+            return 200, {"tracks": [_track(spotify_id) for spotify_id in ids]}, {}
+        if path == "/v1/albums":
+            return 200, {"albums": [_album(spotify_id) for spotify_id in ids]}, {}
+        if path.startswith("/v1/tracks/"):
+            return 200, _track(path.rsplit("/", 1)[1]), {}
+        if path.startswith("/v1/albums/"):
+            return 200, _album(path.rsplit("/", 1)[1]), {}
+        return 404, {"error": {"status": 404, "message": "Not found"}}, {}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+
+                path = url.path.rstrip("/")
+                status, body, headers = fake.respond(method, path, parse_qs(url.query))
+                raw = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_GET(self):
+                self._send("GET")
+
+            def do_POST(self):
+                self._send("POST")
+
+        return Handler
@@ -0,0 +1,246 @@
+"""Route-level benchmarks for TuneLink.
+
+Runs the Flask app against the database configured by the DB_* variables
+and an in-process fake Spotify API, seeds synthetic data, and measures
+latency, database queries and Spotify calls per route. Exits with status 1
+when a route goes over its budget, which catches N+1 queries and pages that
+start waiting on Spotify again. With --report-latency only the query and
+Spotify call budgets fail the run, since latency on shared CI runners is
+too noisy to gate on. It also checks that concurrent lookups of
+the same artwork share one Spotify call and back off on a 429.
+
+The database must be empty; the schema is migrated before seeding.
+
+    python -m benchmarks.run [--latency 0.05] [--iterations 20] [--report-latency]
+"""
+
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from dotenv import load_dotenv
+
+from benchmarks.fake_spotify import FakeSpotify
+
+# Per request: (p95 latency in ms, database queries, Spotify calls). Query
+# and Spotify call counts include the first, cold request to each route.
+BUDGETS = {
+    "index": (150, 4, 1),
+    "index_all": (150, 3, 0),
+    "show_subforum": (150, 3, 0),
+    "show_thread": (150, 2, 0),
+    "profile": (150, 4, 3),
+    "vote": (100, 2, 0),
+    "search": (250, 2, 0),
+    "ajax_threads": (150, 2, 0),
+    "ajax_artwork": (150, 3, 1),
+}
+
+SESSION_USER_ID = 2
+
+# Seconds of Retry-After the fake Spotify answers the rate limit check with.
+RATE_LIMIT_RETRY_AFTER = 1
+
+
+def build_routes():
+    """Lists the requests to benchmark as (name, method, path, json body)."""
+    artwork_ids = ",".join(str(thread_id) for thread_id in range(1, 30, 2))
+    return [
+        ("index", "GET", "/", None),
+        ("index_all", "GET", "/?show_all=true", None),
+        ("show_subforum", "GET", "/subforum/forum2", None),
+        ("show_thread", "GET", "/thread/1", None),
+        ("profile", "GET", "/profile", None),
+        ("vote", "POST", "/thread/2/vote", {"vote": 1}),
+        ("search", "GET", "/ajax/search?q=track", None),
+        ("ajax_threads", "GET", "/ajax/threads?feed=subscriptions", None),
+        ("ajax_artwork", "GET", f"/ajax/artwork?threads={artwork_ids}", None),
+    ]
+
+
+class QueryCounter:
+    """Counts the statements executed through db's connection pool."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, query, elapsed):
+        self.count += 1
+
+    def reset(self):
+        count, self.count = self.count, 0
+        return count
+
+
+def measure(client, fake, queries, method, path, body, iterations):
+    """Requests one route repeatedly and collects its costs.
+
+    Returns
+    -------
+        dict
+            p50 and p95 latency in ms over the warm requests, and the most
+            queries and Spotify calls any request made, the cold one
+            included.
+    """
+    latencies = []
+    max_queries = 0
+    max_spotify_calls = 0
+
+    for i in range(iterations + 1):
+        queries.reset()
+        fake.reset_calls()
+
+        started_at = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+
+        if response.status_code >= 400:
+            raise click.ClickException(
+                f"{method} {path} answered {response.status_code}"
+            )
+
+        max_queries = max(max_queries, queries.reset())
+        max_spotify_calls = max(max_spotify_calls, fake.reset_calls())
+        if i > 0:
+            latencies.append(elapsed_ms)
+
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[max(int(len(latencies) * 0.95) - 1, 0)],
+        "queries": max_queries,
+        "spotify_calls": max_spotify_calls,
+    }
+
+
+def check_rate_limit_backoff(fake, lookups=16):
+    """Looks up one uncached artwork concurrently while Spotify answers 429.
+
+    Half the lookups go through get_album_image_url and half through
+    get_album_image_urls. They should share a single call, which gets the
+    429, and one retry made no sooner than the Retry-After period.
+
+    Returns
+    -------
+        list of str
+            What went wrong, empty if the check passed.
+    """
+    import spotify
+
+    sp = spotify.get_spotify_client("fake-user-token")
+    spotify_url = "https://open.spotify.com/track/ratelimitcheck000000000"
+
+    def lookup(i):
+        if i % 2:
+            return spotify.get_album_image_url(spotify_url, sp)
+        return spotify.get_album_image_urls([spotify_url], sp)[spotify_url]
+
+    fake.reset_calls()
+    fake.rate_limit(1, retry_after=RATE_LIMIT_RETRY_AFTER)
+    with ThreadPoolExecutor(max_workers=lookups) as pool:
+        images = list(pool.map(lookup, range(lookups)))
+    log = list(fake.log)
+    fake.reset_calls()
+
+    failures = []
+    statuses = [status for _, _, status in log]
+    if statuses != [429, 200]:
+        failures.append(f"expected one 429 and one retry, Spotify saw {statuses}")
+    elif log[1][0] - log[0][0] < RATE_LIMIT_RETRY_AFTER:
+        failures.append(
+            f"retried after {log[1][0] - log[0][0]:.2f}s, "
+            f"before Retry-After {RATE_LIMIT_RETRY_AFTER}s"
+        )
+    if spotify.PLACEHOLDER_IMAGE in images:
+        failures.append("some lookups fell back to the placeholder")
+    return failures
+
+
+@click.command()
+@click.option("--latency", default=0.05, show_default=True, help="Fake Spotify delay.")
+@click.option("--iterations", default=20, show_default=True)
+@click.option("--threads-per-forum", default=100, show_default=True)
+@click.option(
+    "--check-latency/--report-latency",
+    default=True,
+    show_default=True,
+    help="Fail on the p95 latency budgets, or only report them.",
+)
+def main(latency, iterations, threads_per_forum, check_latency):
+    """Benchmarks the main routes and checks them against their budgets."""
+    load_dotenv()
+
+    fake = FakeSpotify(latency=latency)
+    fake.start()
+
+    # The app reads these when its modules are imported.
+    os.environ["SPOTIFY_API_PREFIX"] = fake.api_prefix
+    os.environ["SPOTIFY_TOKEN_URL"] = fake.token_url
+    os.environ.setdefault("SPOTIPY_CLIENT_ID", "benchmark")
+    os.environ.setdefault("SPOTIPY_CLIENT_SECRET", "benchmark")
+    os.environ.setdefault("SPOTIPY_REDIRECT_URI", "http://127.0.0.1:5000/callback")
+    os.environ.setdefault("FLASK_SECRET", "benchmark")
+
+    import db
+    from app import app
+    from benchmarks.seed import database_is_empty, seed
+    from migrate import run_migrations
+
+    run_migrations()
+    if not database_is_empty():
+        raise click.ClickException("Benchmarks need an empty database.")
+    click.echo("Seeding...")
+    seed(threads_per_forum=threads_per_forum)
+
+    queries = QueryCounter()
+    db.add_query_listener(queries)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["token_info"] = {"access_token": "fake-user-token"}
+        session["user_id"] = SESSION_USER_ID
+
+    over_budget = []
+    click.echo(
+        f"{'route':15} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'spotify':>8}"
+    )
+    for name, method, path, body in build_routes():
+        result = measure(client, fake, queries, method, path, body, iterations)
+        max_p95, max_queries, max_spotify_calls = BUDGETS[name]
+
+        failures = []
+        slow = result["p95"] > max_p95
+        if slow and check_latency:
+            failures.append(f"p95 {result['p95']:.0f} > {max_p95} ms")
+        if result["queries"] > max_queries:
+            failures.append(f"{result['queries']} > {max_queries} queries")
+        if result["spotify_calls"] > max_spotify_calls:
+            failures.append(
+                f"{result['spotify_calls']} > {max_spotify_calls} Spotify calls"
+            )
+        if failures:
+            over_budget.append(f"{name}: {', '.join(failures)}")
+
+        click.echo(
+            f"{name:15} {result['p50']:8.1f} {result['p95']:8.1f} "
+            f"{result['queries']:8} {result['spotify_calls']:8}"
+            f"{'  OVER BUDGET' if failures else '  SLOW' if slow else ''}"
+        )
+
+    db.remove_query_listener(queries)
+
+    failures = check_rate_limit_backoff(fake)
+    click.echo(f"\nrate limit backoff: {'; '.join(failures) or 'ok'}")
+    over_budget.extend(f"rate limit backoff: {failure}" for failure in failures)
+    fake.stop()
+
+    if over_budget:
+        click.echo("\n".join(["", "Over budget:", *over_budget]), err=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
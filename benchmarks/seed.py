@@ -0,0 +1,127 @@
+from db import get_connection
+
+
+def database_is_empty():
+    """Checks that the benchmark database has no users yet.
+
+    Returns
+    -------
+        bool
+            True if the users table is empty.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT NOT EXISTS (SELECT 1 FROM users)")
+            return cur.fetchone()[0]
+
+
+def seed(users=200, forums=20, threads_per_forum=100, comments_per_thread=5):
+    """Fills an empty database with synthetic users, forums, threads and votes.
+
+    Every user subscribes to a quarter of the forums and votes on a tenth of
+    the threads. Every other thread and comment has stored artwork; the rest
+    link to IDs the fake Spotify server knows, so pages exercise both paths.
+    User 1 is an admin.
+
+    Args
+    -------
+        users : int
+            Number of users.
+        forums : int
+            Number of forums.
+        threads_per_forum : int
+            Number of threads in every forum.
+        comments_per_thread : int
+            Number of comments on every thread.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO users (spotify_id, username, bio, role)
+                SELECT
+                    'bench-user-' || n,
+                    'user' || n,
+                    'Bio of user ' || n,
+                    CASE WHEN n = 1 THEN 'admin' ELSE 'user' END
+                FROM generate_series(1, %s) AS n
+                """,
+                (users,),
+            )
+            cur.execute(
+                """
+                INSERT INTO forums (name, description, creator_id)
+                SELECT 'forum' || n, 'Forum number ' || n, 1
+                FROM generate_series(1, %s) AS n
+                """,
+                (forums,),
+            )
+            cur.execute(
+                """
+                INSERT INTO threads (
+                    forum_id, creator_id, title, description, spotify_url,
+                    spotify_type, spotify_id, album_image, created_at
+                )
+                SELECT
+                    forums.id,
+                    1 + (n %% %s),
+                    'Thread ' || n || ' about ' || forums.name,
+                    'Listen to this track, number ' || n,
+                    'https://open.spotify.com/track/' || lpad(n::text, 22, '0'),
+                    'track',
+                    lpad(n::text, 22, '0'),
+                    CASE WHEN n %% 2 = 0
+                        THEN 'https://i.scdn.co/image/' || lpad(n::text, 22, '0')
+                    END,
+                    NOW() - n * INTERVAL '1 minute'
+                FROM forums
+                CROSS JOIN generate_series(1, %s) AS n
+                """,
+                (users, threads_per_forum),
+            )
+            cur.execute(
+                """
+                INSERT INTO t_comments (
+                    thread_id, user_id, description, spotify_url, album_image
+                )
+                SELECT
+                    threads.id,
+                    1 + ((threads.id + n) %% %s),
+                    'Comment ' || n || ' on thread ' || threads.id,
+                    'https://open.spotify.com/album/' || lpad(n::text, 22, '0'),
+                    CASE WHEN n %% 2 = 0
+                        THEN 'https://i.scdn.co/image/' || lpad(n::text, 22, '0')
+                    END
+                FROM threads
+                CROSS JOIN generate_series(1, %s) AS n
+                """,
+                (users, comments_per_thread),
+            )
+            cur.execute(
+                """
+                INSERT INTO subforum_subscriptions (user_id, forum_id)
+                SELECT users.id, forums.id
+                FROM users
+                JOIN forums ON (users.id + forums.id) % 4 = 0
+                """
+            )
+            cur.execute(
+                """
+                INSERT INTO home_feed (user_id, thread_id, forum_id, created_at)
+                SELECT ss.user_id, threads.id, threads.forum_id, threads.created_at
+                FROM subforum_subscriptions ss
+                JOIN threads ON threads.forum_id = ss.forum_id
+                """
+            )
+            cur.execute(
+                """
+                INSERT INTO likes (user_id, thread_id, vote)
+                SELECT
+                    users.id,
+                    threads.id,
+                    CASE WHEN (users.id + threads.id) % 3 = 0 THEN -1 ELSE 1 END
+                FROM users
+                JOIN threads ON (users.id * 7 + threads.id) % 10 = 0
+                """
+            )
+            cur.execute("ANALYZE")
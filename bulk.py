@@ -0,0 +1,566 @@
+import csv
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+from itertools import accumulate
+
+import click
+from dotenv import load_dotenv
+
+from db import FEED_BACKFILL_LIMIT, FEED_FANOUT_LIMIT, get_connection
+
+# Every table that can be exported and imported, in the order they have to
+# be imported in: (table, columns). Counters, search vectors and the home
+# feed are derived from these and rebuilt on import instead.
+TABLES = {
+    "users": (
+        "users",
+        ("id", "spotify_id", "username", "bio", "spotify_url", "role", "created_at"),
+    ),
+    "forums": (
+        "forums",
+        ("id", "name", "description", "creator_id", "created_at", "fanout_on_read"),
+    ),
+    "threads": (
+        "threads",
+        (
+            "id",
+            "forum_id",
+            "creator_id",
+            "title",
+            "spotify_url",
+            "description",
+            "is_pinned",
+            "created_at",
+            "spotify_type",
+            "spotify_id",
+            "album_image",
+        ),
+    ),
+    "comments": (
+        "t_comments",
+        (
+            "id",
+            "thread_id",
+            "user_id",
+            "description",
+            "spotify_url",
+            "created_at",
+            "spotify_type",
+            "spotify_id",
+            "album_image",
+        ),
+    ),
+    "likes": ("likes", ("user_id", "thread_id", "vote")),
+    "subscriptions": ("subforum_subscriptions", ("user_id", "forum_id")),
+}
+
+FORMATS = ("csv", "ndjson")
+
+# Row triggers that would run one UPDATE per imported row. They only bump
+# updated_at, which the import does once per affected row instead.
+_ROW_TRIGGERS = {
+    "threads": "threads_touch_forum",
+    "t_comments": "t_comments_touch_thread",
+}
+
+# NDJSON goes through COPY's CSV format with quote and delimiter characters
+# that JSON never contains unescaped, so every line is passed on verbatim.
+_NDJSON_COPY_OPTIONS = "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'"
+
+
+def _data_file(directory, name, file_format):
+    return os.path.join(directory, f"{name}.{file_format}")
+
+
+def export_tables(directory, names, file_format="csv"):
+    """Streams tables to one file each with COPY ... TO STDOUT.
+
+    All tables are read in one repeatable read transaction, so the files are
+    consistent with each other.
+
+    Args
+    -------
+        directory : str
+            Directory the files are written to, as <name>.csv or <name>.ndjson.
+        names : iterable of str
+            Keys of TABLES to export.
+        file_format : str
+            "csv" (with a header line) or "ndjson" (one JSON object per line).
+
+    Returns
+    -------
+        dict
+            The number of rows written per table.
+    """
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            for name in names:
+                table, columns = TABLES[name]
+                column_list = ", ".join(columns)
+                if file_format == "csv":
+                    sql = (
+                        f"COPY {table} ({column_list}) TO STDOUT "
+                        "WITH (FORMAT csv, HEADER)"
+                    )
+                else:
+                    sql = (
+                        "COPY (SELECT row_to_json(exported) FROM "
+                        f"(SELECT {column_list} FROM {table}) AS exported) "
+                        f"TO STDOUT WITH ({_NDJSON_COPY_OPTIONS})"
+                    )
+                with open(_data_file(directory, name, file_format), "wb") as f:
+                    cur.copy_expert(sql, f)
+                counts[name] = cur.rowcount
+    return counts
+
+
+def _read_columns(f, name, file_format):
+    """Reads the columns a data file provides and positions f at its rows."""
+    first_line = f.readline().decode("utf-8")
+    if file_format == "csv":
+        columns = next(csv.reader([first_line]), [])
+    else:
+        columns = list(json.loads(first_line)) if first_line.strip() else []
+        f.seek(0)
+
+    unknown = set(columns) - set(TABLES[name][1])
+    if not columns or unknown:
+        raise click.ClickException(
+            f"{f.name}: expected columns from {', '.join(TABLES[name][1])}, "
+            f"got {', '.join(columns) or 'none'}"
+        )
+    return columns
+
+
+def _refresh_feeds(cur):
+    """Adds the threads of the forums in bulk_staging to their home feeds.
+
+    Follows the app's rules: forums with more than FEED_FANOUT_LIMIT
+    subscribers switch to fan-out on read, and every subscriber gets the
+    latest FEED_BACKFILL_LIMIT threads of the others, as when subscribing.
+    """
+    cur.execute(
+        """
+        UPDATE forums
+        SET fanout_on_read = TRUE
+        WHERE id IN (SELECT forum_id FROM bulk_staging)
+            AND NOT fanout_on_read
+            AND (
+                SELECT COUNT(*)
+                FROM (
+                    SELECT 1
+                    FROM subforum_subscriptions
+                    WHERE forum_id = forums.id
+                    LIMIT %(fanout_limit)s + 1
+                ) AS subscribers
+            ) > %(fanout_limit)s
+        """,
+        {"fanout_limit": FEED_FANOUT_LIMIT},
+    )
+    cur.execute(
+        """
+        INSERT INTO home_feed (user_id, thread_id, forum_id, created_at)
+        SELECT ss.user_id, latest.id, latest.forum_id, latest.created_at
+        FROM forums
+        CROSS JOIN LATERAL (
+            SELECT id, forum_id, created_at
+            FROM threads
+            WHERE threads.forum_id = forums.id
+            ORDER BY created_at DESC, id DESC
+            LIMIT %(backfill_limit)s
+        ) AS latest
+        JOIN subforum_subscriptions ss ON ss.forum_id = forums.id
+        WHERE forums.id IN (SELECT forum_id FROM bulk_staging)
+            AND NOT forums.fanout_on_read
+        ON CONFLICT DO NOTHING
+        """,
+        {"backfill_limit": FEED_BACKFILL_LIMIT},
+    )
+
+
+def import_table(name, path):
+    """Loads one data file into its table with COPY, in one transaction.
+
+    The file is copied into a temporary staging table and inserted from
+    there, so rows that already exist (same key) are skipped and an import
+    can be repeated. Only the columns present in the file are loaded; the
+    others get their defaults. Derived data is brought up to date once per
+    import instead of once per row: vote counters through the statement
+    level triggers, updated_at of the affected threads and forums, the
+    home feeds and the ID sequence. The table is locked against writes by
+    the app while its row triggers are disabled.
+
+    Args
+    -------
+        name : str
+            Key of TABLES to import.
+        path : str
+            A .csv file with a header line or a .ndjson file.
+
+    Returns
+    -------
+        int
+            The number of rows inserted.
+    """
+    table, _ = TABLES[name]
+    file_format = os.path.splitext(path)[1].lstrip(".")
+    if file_format not in FORMATS:
+        raise click.ClickException(f"{path}: expected a .csv or .ndjson file")
+
+    with get_connection() as conn:
+        with conn.cursor() as cur, open(path, "rb") as f:
+            columns = _read_columns(f, name, file_format)
+            column_list = ", ".join(columns)
+
+            if file_format == "csv":
+                cur.execute(
+                    f"""
+                    CREATE TEMP TABLE bulk_staging ON COMMIT DROP AS
+                    SELECT {column_list} FROM {table} WITH NO DATA
+                    """
+                )
+                cur.copy_expert(
+                    f"COPY bulk_staging ({column_list}) FROM STDIN WITH (FORMAT csv)",
+                    f,
+                )
+            else:
+                cur.execute(
+                    "CREATE TEMP TABLE bulk_documents (doc JSON) ON COMMIT DROP"
+                )
+                cur.copy_expert(
+                    f"COPY bulk_documents FROM STDIN WITH ({_NDJSON_COPY_OPTIONS})", f
+                )
+                cur.execute(
+                    f"""
+                    CREATE TEMP TABLE bulk_staging ON COMMIT DROP AS
+                    SELECT {column_list}
+                    FROM bulk_documents,
+                        json_populate_record(NULL::{table}, bulk_documents.doc)
+                    WHERE bulk_documents.doc IS NOT NULL
+                    """
+                )
+
+            trigger = _ROW_TRIGGERS.get(table)
+            if trigger is not None:
+                cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER {trigger}")
+
+            cur.execute(
+                f"""
+                INSERT INTO {table} ({column_list})
+                SELECT {column_list} FROM bulk_staging
+                ON CONFLICT DO NOTHING
+                """
+            )
+            inserted = cur.rowcount
+
+            if trigger is not None:
+                cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER {trigger}")
+
+            if table == "threads" and "forum_id" in columns:
+                cur.execute(
+                    """
+                    UPDATE forums
+                    SET updated_at = clock_timestamp()
+                    WHERE id IN (SELECT forum_id FROM bulk_staging)
+                    """
+                )
+            if table == "t_comments" and "thread_id" in columns:
+                cur.execute(
+                    """
+                    UPDATE threads
+                    SET updated_at = clock_timestamp()
+                    WHERE id IN (SELECT thread_id FROM bulk_staging)
+                    """
+                )
+            if table in ("threads", "subforum_subscriptions"):
+                _refresh_feeds(cur)
+            if "id" in columns:
+                cur.execute(
+                    f"""
+                    SELECT setval(
+                        pg_get_serial_sequence('{table}', 'id'),
+                        COALESCE(MAX(id), 1),
+                        MAX(id) IS NOT NULL
+                    )
+                    FROM {table}
+                    """
+                )
+            cur.execute(f"ANALYZE {table}")
+    return inserted
+
+
+def _zipf_sampler(rng, ids, exponent):
+    """Returns a function that draws k of ids, the first ones most often.
+
+    The i-th ID is drawn with a weight of 1 / i ** exponent, the long tail
+    of popularity seen in forums, threads and users alike.
+    """
+    cum_weights = list(
+        accumulate(1 / rank**exponent for rank in range(1, len(ids) + 1))
+    )
+
+    def sample(k):
+        return rng.choices(ids, cum_weights=cum_weights, k=k)
+
+    return sample
+
+
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat(sep=" ")
+
+
+def _chunks(total, size=100_000):
+    for start in range(0, total, size):
+        yield min(size, total - start)
+
+
+def generate_dataset(
+    directory,
+    users=20_000,
+    forums=500,
+    threads=200_000,
+    comments=1_000_000,
+    votes=2_000_000,
+    subscriptions=100_000,
+    days=365,
+    seed=0,
+):
+    """Writes a synthetic data set as CSV files that bulk import can load.
+
+    Activity is skewed the way it is in production: a few forums get most
+    of the threads and subscribers, a few threads go viral and get most of
+    the comments and votes, and a small share of users does most of the
+    posting. Forum 1 is the hottest forum and user 1 is an admin. IDs start
+    at 1, so the files are meant for an empty database. Votes and
+    subscriptions are drawn independently, so pairs drawn twice are skipped
+    on import and slightly fewer rows than requested are loaded.
+
+    Args
+    -------
+        directory : str
+            Directory the CSV files are written to.
+        users, forums, threads, comments, votes, subscriptions : int
+            Number of rows to generate for each table.
+        days : int
+            Threads are spread over this many days up to now.
+        seed : int
+            Seed for the random generator, so data sets can be reproduced.
+
+    Returns
+    -------
+        dict
+            The number of rows written per table.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    now = time.time()
+    started_at = now - days * 86400
+
+    user_ids = list(range(1, users + 1))
+    rng.shuffle(user_ids)
+    pick_active_user = _zipf_sampler(rng, user_ids, 1.0)
+    pick_hot_forum = _zipf_sampler(rng, list(range(1, forums + 1)), 1.1)
+
+    def write(name, rows):
+        with open(_data_file(directory, name, "csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(TABLES[name][1])
+            writer.writerows(rows)
+
+    write(
+        "users",
+        (
+            (
+                n,
+                f"synthetic-user-{n}",
+                f"user{n}",
+                f"Bio of user {n}",
+                None,
+                "admin" if n == 1 else "user",
+                _timestamp(started_at - rng.random() * 86400 * 30),
+            )
+            for n in range(1, users + 1)
+        ),
+    )
+    write(
+        "forums",
+        (
+            (
+                n,
+                f"forum{n}",
+                f"Forum number {n}",
+                creator_id,
+                _timestamp(started_at),
+                False,
+            )
+            for n, creator_id in enumerate(pick_active_user(forums), start=1)
+        ),
+    )
+
+    thread_times = [0.0] * (threads + 1)
+
+    def thread_rows():
+        thread_id = 0
+        for k in _chunks(threads):
+            for forum_id, creator_id in zip(pick_hot_forum(k), pick_active_user(k)):
+                thread_id += 1
+                created_at = started_at + rng.random() * (now - started_at)
+                thread_times[thread_id] = created_at
+                spotify_id = f"{thread_id:022d}"
+                yield (
+                    thread_id,
+                    forum_id,
+                    creator_id,
+                    f"Thread {thread_id} in forum{forum_id}",
+                    f"https://open.spotify.com/track/{spotify_id}",
+                    f"Listen to track number {thread_id}",
+                    False,
+                    _timestamp(created_at),
+                    "track",
+                    spotify_id,
+                    f"https://i.scdn.co/image/{spotify_id}",
+                )
+
+    write("threads", thread_rows())
+
+    thread_ids = list(range(1, threads + 1))
+    rng.shuffle(thread_ids)
+    pick_viral_thread = _zipf_sampler(rng, thread_ids, 1.2)
+
+    def comment_rows():
+        comment_id = 0
+        for k in _chunks(comments):
+            for thread_id, user_id in zip(pick_viral_thread(k), pick_active_user(k)):
+                comment_id += 1
+                created_at = min(
+                    thread_times[thread_id] + rng.expovariate(1 / 86400), now
+                )
+                yield (
+                    comment_id,
+                    thread_id,
+                    user_id,
+                    f"Comment {comment_id} on thread {thread_id}",
+                    None,
+                    _timestamp(created_at),
+                    None,
+                    None,
+                    None,
+                )
+
+    write("comments", comment_rows())
+
+    def like_rows():
+        for k in _chunks(votes):
+            for thread_id in pick_viral_thread(k):
+                # Readers vote, not just the users who post.
+                user_id = rng.randint(1, users)
+                yield (user_id, thread_id, 1 if rng.random() < 0.8 else -1)
+
+    write("likes", like_rows())
+
+    def subscription_rows():
+        for k in _chunks(subscriptions):
+            for forum_id in pick_hot_forum(k):
+                yield (rng.randint(1, users), forum_id)
+
+    write("subscriptions", subscription_rows())
+
+    return {
+        "users": users,
+        "forums": forums,
+        "threads": threads,
+        "comments": comments,
+        "likes": votes,
+        "subscriptions": subscriptions,
+    }
+
+
+@click.group("bulk")
+def bulk_command():
+    """Imports, exports and generates data in bulk with COPY."""
+
+
+@bulk_command.command("export")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option(
+    "--table",
+    "names",
+    multiple=True,
+    type=click.Choice(list(TABLES)),
+    help="Repeatable.",
+)
+@click.option(
+    "--format",
+    "file_format",
+    default="csv",
+    show_default=True,
+    type=click.Choice(FORMATS),
+)
+def export_command(directory, names, file_format):
+    """Writes every table (or only --table) to DIRECTORY."""
+    counts = export_tables(directory, names or list(TABLES), file_format)
+    for name, count in counts.items():
+        click.echo(f"{name}: {count} rows exported")
+
+
+@bulk_command.command("import")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "--table",
+    "names",
+    multiple=True,
+    type=click.Choice(list(TABLES)),
+    help="Repeatable.",
+)
+def import_command(directory, names):
+    """Loads the .csv or .ndjson files in DIRECTORY, in dependency order.
+
+    Each table is imported in its own transaction, so an import that fails
+    part way can be fixed and re-run; rows already loaded are skipped.
+    """
+    found = False
+    for name in TABLES:
+        if names and name not in names:
+            continue
+        for file_format in FORMATS:
+            path = _data_file(directory, name, file_format)
+            if not os.path.exists(path):
+                continue
+            found = True
+            started_at = time.perf_counter()
+            inserted = import_table(name, path)
+            elapsed = time.perf_counter() - started_at
+            click.echo(f"{name}: {inserted} rows imported in {elapsed:.1f}s")
+
+    if not found:
+        raise click.ClickException(f"No data files found in {directory}")
+
+
+@bulk_command.command("generate")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--users", default=20_000, show_default=True)
+@click.option("--forums", default=500, show_default=True)
+@click.option("--threads", default=200_000, show_default=True)
+@click.option("--comments", default=1_000_000, show_default=True)
+@click.option("--votes", default=2_000_000, show_default=True)
+@click.option("--subscriptions", default=100_000, show_default=True)
+@click.option("--days", default=365, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+def generate_command(directory, **sizes):
+    """Writes a skewed synthetic data set to DIRECTORY for bulk import."""
+    started_at = time.perf_counter()
+    counts = generate_dataset(directory, **sizes)
+    for name, count in counts.items():
+        click.echo(f"{name}: {count} rows")
+    click.echo(f"Generated in {time.perf_counter() - started_at:.1f}s")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    bulk_command()
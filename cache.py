@@ -0,0 +1,285 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
+_redis_lock = threading.Lock()
+_redis_down_until = 0.0
+
+REDIS_RETRY_INTERVAL = 30
+
+
+def get_redis():
+    """Returns the shared Redis client, or None if Redis is not configured.
+
+    Enivronment variables:
+        REDIS_URL: Redis connection URL, e.g. redis://localhost:6379/0.
+
+    Returns
+    -------
+        redis.Redis
+            A Redis client shared by the whole process.
+        None
+            If REDIS_URL is not set or Redis recently failed to respond.
+    """
+    global _redis_client
+
+    if time.monotonic() < _redis_down_until:
+        return None
+
+    if _redis_client is None:
+        url = os.getenv("REDIS_URL")
+        if not url:
+            return None
+        with _redis_lock:
+            if _redis_client is None:
+                _redis_client = redis.Redis.from_url(
+                    url, socket_timeout=0.25, socket_connect_timeout=0.25
+                )
+    return _redis_client
+
+
+def mark_redis_down(error):
+    """Stops using Redis for a while after it failed to respond.
+
+    Args
+    -------
+        error : Exception
+            The error raised by the Redis client.
+    """
+    global _redis_down_until
+
+    logger.warning("Redis unavailable, using local cache only: %s", error)
+    _redis_down_until = time.monotonic() + REDIS_RETRY_INTERVAL
+
+
+class TTLCache:
+    """Thread-safe, bounded in-process LRU cache whose entries expire.
+
+    Args
+    -------
+        maxsize : int
+            Maximum number of entries. The least recently used entry is
+            evicted when the cache is full.
+        ttl : float
+            Default number of seconds an entry is kept.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, or default if missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Stores value under key for ttl seconds (defaults to the cache ttl)."""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Removes key from the cache if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TwoTierCache:
+    """Cache with an in-process LRU tier in front of an optional Redis tier.
+
+    Reads check the local tier first and fall back to Redis, so workers share
+    each other's hits. Values stored in Redis must be JSON serializable.
+    Without REDIS_URL the cache behaves like a plain TTLCache.
+
+    Args
+    -------
+        namespace : str
+            Prefix for the Redis keys of this cache.
+        maxsize : int
+            Maximum number of entries in the local tier.
+        ttl : float
+            Default number of seconds an entry is kept in Redis.
+        local_ttl : float
+            Number of seconds an entry is kept in the local tier while Redis
+            is available. Defaults to ttl; keep it short (or 0) for data that
+            is invalidated explicitly, since other processes' local tiers are
+            not notified.
+        local_only_ttl : float
+            Number of seconds an entry is kept in the local tier while Redis
+            is not configured or unavailable. Defaults to ttl; for data that
+            is invalidated explicitly it bounds how long other processes
+            serve an entry after it was invalidated.
+    """
+
+    def __init__(
+        self, namespace, maxsize=1024, ttl=300, local_ttl=None, local_only_ttl=None
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local_ttl = ttl if local_ttl is None else local_ttl
+        self.local_only_ttl = ttl if local_only_ttl is None else local_only_ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=self.local_ttl)
+
+    def _local_ttl(self, ttl, client):
+        return min(ttl, self.local_only_ttl if client is None else self.local_ttl)
+
+    def _redis_key(self, key):
+        return f"tunelink:{self.namespace}:{key}"
+
+    def get(self, key, default=None):
+        """Returns the cached value for key from the nearest tier, or default."""
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        client = get_redis()
+        if client is None:
+            return default
+
+        try:
+            raw = client.get(self._redis_key(key))
+        except redis.RedisError as e:
+            mark_redis_down(e)
+            return default
+
+        if raw is None:
+            return default
+
+        value = json.loads(raw)
+        if self.local_ttl > 0:
+            self.local.set(key, value)
+        return value
+
+    def get_many(self, keys):
+        """Looks up several keys at once, using a single Redis round trip.
+
+        Args
+        -------
+            keys : iterable of str
+                The keys to look up.
+
+        Returns
+        -------
+            dict
+                The keys that were found, mapped to their cached values.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is not None:
+                found[key] = value
+            else:
+                missing.append(key)
+
+        client = get_redis()
+        if not missing or client is None:
+            return found
+
+        try:
+            raw_values = client.mget([self._redis_key(key) for key in missing])
+        except redis.RedisError as e:
+            mark_redis_down(e)
+            return found
+
+        for key, raw in zip(missing, raw_values):
+            if raw is not None:
+                value = json.loads(raw)
+                if self.local_ttl > 0:
+                    self.local.set(key, value)
+                found[key] = value
+        return found
+
+    def set(self, key, value, ttl=None):
+        """Stores value under key in both tiers."""
+        ttl = self.ttl if ttl is None else ttl
+        client = get_redis()
+
+        local_ttl = self._local_ttl(ttl, client)
+        if local_ttl > 0:
+            self.local.set(key, value, local_ttl)
+
+        if client is None:
+            return
+
+        try:
+            client.set(self._redis_key(key), json.dumps(value), ex=max(int(ttl), 1))
+        except redis.RedisError as e:
+            mark_redis_down(e)
+
+    def set_many(self, items, ttl=None):
+        """Stores several values in both tiers, using a single Redis round trip.
+
+        Args
+        -------
+            items : dict
+                The keys to store, mapped to their values.
+            ttl : float
+                Number of seconds to keep the values (defaults to the cache ttl).
+        """
+        if not items:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        client = get_redis()
+
+        local_ttl = self._local_ttl(ttl, client)
+        if local_ttl > 0:
+            for key, value in items.items():
+                self.local.set(key, value, local_ttl)
+
+        if client is None:
+            return
+
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, value in items.items():
+                pipe.set(self._redis_key(key), json.dumps(value), ex=max(int(ttl), 1))
+            pipe.execute()
+        except redis.RedisError as e:
+            mark_redis_down(e)
+
+    def delete(self, key):
+        """Removes key from both tiers."""
+        self.local.delete(key)
+
+        client = get_redis()
+        if client is None:
+            return
+
+        try:
+            client.delete(self._redis_key(key))
+        except redis.RedisError as e:
+            mark_redis_down(e)
@@ -1,24 +1,344 @@
+import base64
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
 
 import psycopg2
+from psycopg2.extras import Json, execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
+from cache import TwoTierCache
+from search_index import ForumNameIndex
 
-def get_connection():
-    """Establishes a connection to the PostgreSQL database.
+logger = logging.getLogger(__name__)
+
+_sidebar_cache = TwoTierCache(
+    "sidebar",
+    maxsize=int(os.getenv("SIDEBAR_CACHE_SIZE", "10000")),
+    ttl=int(os.getenv("SIDEBAR_CACHE_TTL", "300")),
+    local_ttl=0,
+    local_only_ttl=int(os.getenv("SIDEBAR_LOCAL_CACHE_TTL", "5")),
+)
+
+
+class ConnectionPool:
+    """Thread-safe pool of PostgreSQL connections.
+
+    Wraps psycopg2's ThreadedConnectionPool so that callers block (up to a
+    timeout) when every connection is checked out instead of failing straight
+    away, and so that broken or long idle connections are health checked
+    before they are handed out again.
+
+    Args
+    -------
+        minconn : int
+            Number of connections opened when the pool is created.
+        maxconn : int
+            Maximum number of connections the pool will open.
+        healthcheck_interval : float
+            Connections idle for longer than this many seconds are pinged
+            with "SELECT 1" before being handed out.
+        timeout : float
+            Seconds to wait for a free connection before raising PoolError.
+        **connect_kwargs
+            Keyword arguments passed on to psycopg2.connect.
+    """
+
+    def __init__(
+        self, minconn, maxconn, healthcheck_interval, timeout, **connect_kwargs
+    ):
+        self.maxconn = maxconn
+        self.healthcheck_interval = healthcheck_interval
+        self.timeout = timeout
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+
+    def getconn(self):
+        """Checks out a healthy connection, waiting for one if the pool is exhausted.
+
+        Returns
+        -------
+            psycopg2.extensions.connection
+                A connection that must be handed back with putconn.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError("Timed out waiting for a database connection")
+
+        try:
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    return conn
+                self._discard(conn)
+            raise PoolError("Could not obtain a healthy database connection")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        """Returns a connection to the pool.
+
+        Args
+        -------
+            conn : psycopg2.extensions.connection
+                The connection to return.
+            close : bool
+                Closes the connection instead of keeping it for reuse.
+        """
+        try:
+            if close or conn.closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        """Closes every connection held by the pool."""
+        self._last_used.clear()
+        self._pool.closeall()
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and (
+            time.monotonic() - last_used < self.healthcheck_interval
+        ):
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+
+
+_query_listeners = []
+
+
+def add_query_listener(listener):
+    """Registers a function that is called after every executed statement.
+
+    Args
+    -------
+        listener : callable
+            Called with the SQL text and the number of seconds it took,
+            on the thread that executed it.
+    """
+    _query_listeners.append(listener)
+
+
+def remove_query_listener(listener):
+    """Unregisters a function added with add_query_listener."""
+    _query_listeners.remove(listener)
+
+
+class _ObservedCursor(psycopg2.extensions.cursor):
+    """Cursor that reports every executed statement to the query listeners."""
+
+    def execute(self, query, vars=None):
+        if not _query_listeners:
+            return super().execute(query, vars)
+
+        started_at = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            for listener in list(_query_listeners):
+                listener(query, elapsed)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Returns the process-wide connection pool, creating it on first use.
+
+    The pool is recreated after a fork so that worker processes never share
+    sockets with their parent.
+
+    Enivronment variables:
+        DB_POOL_MIN: Connections opened up front (default 1).
+        DB_POOL_MAX: Maximum number of connections (default 10).
+        DB_POOL_TIMEOUT: Seconds to wait for a free connection (default 10).
+        DB_POOL_HEALTHCHECK_INTERVAL: Idle seconds before a connection is
+            pinged on checkout (default 30).
 
     Returns
     -------
-        psycopg2.connect
+        ConnectionPool
+            The connection pool for the current process.
+    """
+    global _pool, _pool_pid
+
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(
+                minconn=int(os.getenv("DB_POOL_MIN", "1")),
+                maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+                healthcheck_interval=float(
+                    os.getenv("DB_POOL_HEALTHCHECK_INTERVAL", "30")
+                ),
+                timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+                dbname=os.getenv("DB_NAME"),
+                user=os.getenv("DB_USERNAME"),
+                password=os.getenv("DB_USER_PASSWORD"),
+                host=os.getenv("DB_HOST"),
+                port=os.getenv("DB_PORT"),
+                cursor_factory=_ObservedCursor,
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+@contextmanager
+def get_connection():
+    """Checks out a pooled connection to the PostgreSQL database.
+
+    The transaction is committed when the block exits normally and rolled
+    back if it raises. The connection is returned to the pool either way.
+
+    Yields
+    -------
+        psycopg2.extensions.connection
             A connection object to the PostgreSQL database.
 
     """
-    return psycopg2.connect(
-        dbname=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USERNAME"),
-        password=os.getenv("DB_USER_PASSWORD"),
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-    )
+    pool = _get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+THREADS_PAGE_SIZE = int(os.getenv("THREADS_PAGE_SIZE", "15"))
+COMMENTS_PAGE_SIZE = int(os.getenv("COMMENTS_PAGE_SIZE", "50"))
+
+# Forums with more subscribers than this are not copied into each home feed.
+FEED_FANOUT_LIMIT = int(os.getenv("FEED_FANOUT_LIMIT", "10000"))
+# Number of a forum's most recent threads added to a feed on subscribe.
+FEED_BACKFILL_LIMIT = int(os.getenv("FEED_BACKFILL_LIMIT", "1000"))
+
+# Threads are paginated by (created_at, id) so that each page is an index range
+# scan, however deep into the history it is. psycopg2 interpolates the
+# parameters client side, so the first page's "NULL IS NULL" is folded away.
+KEYSET_CONDITION = """(
+    %(before_created_at)s IS NULL
+    OR (threads.created_at, threads.id) < (%(before_created_at)s, %(before_id)s)
+)"""
+
+
+def keyset_params(before, limit):
+    """Builds the query parameters for KEYSET_CONDITION and LIMIT.
+
+    Args
+    -------
+        before : tuple
+            A (created_at, id) cursor, or None for the first page.
+        limit : int
+            The page size.
+
+    Returns
+    -------
+        dict
+            Parameters for a query using KEYSET_CONDITION and %(limit)s.
+    """
+    before_created_at, before_id = before if before is not None else (None, None)
+    return {
+        "before_created_at": before_created_at,
+        "before_id": before_id,
+        "limit": limit,
+    }
+
+
+def encode_thread_cursor(thread):
+    """Encodes the position of a thread as an opaque pagination cursor.
+
+    Args
+    -------
+        thread : dict
+            A thread with created_at and id, usually the last one of a page.
+
+    Returns
+    -------
+        str
+            A URL-safe cursor to pass back as the "before" parameter.
+    """
+    raw = f"{thread['created_at'].isoformat()}|{thread['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_thread_cursor(cursor):
+    """Decodes a cursor made by encode_thread_cursor.
+
+    Args
+    -------
+        cursor : str
+            The cursor, or None.
+
+    Returns
+    -------
+        tuple
+            A (created_at, id) tuple.
+        None
+            If no cursor was given or it is malformed.
+    """
+    if not cursor:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, thread_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(thread_id)
+    except ValueError:
+        return None
+
+
+@contextmanager
+def get_cursor():
+    """Checks out a pooled connection and yields a cursor on it.
+
+    Behaves like get_connection, closing the cursor before the connection is
+    returned to the pool.
+
+    Yields
+    -------
+        psycopg2.extensions.cursor
+            A cursor on a pooled connection.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
 
 
 def get_subforum_by_name(name):
@@ -37,12 +357,9 @@ def get_subforum_by_name(name):
             If the subforum does not exist.
 
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, description FROM forums WHERE name = %s", (name,))
-    forum = cur.fetchone()
-    cur.close()
-    conn.close()
+    with get_cursor() as cur:
+        cur.execute("SELECT id, name, description FROM forums WHERE name = %s", (name,))
+        forum = cur.fetchone()
 
     if forum is not None:
         forum_id, forum_name, *optional_description = forum
@@ -70,19 +387,25 @@ def get_threads_by_name(name):
             If the thread does not exist.
     """
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, description FROM forums WHERE name = %s", (name,))
-    forum = cur.fetchone()
-    cur.close()
-    conn.close()
+    with get_cursor() as cur:
+        cur.execute("SELECT id, name, description FROM forums WHERE name = %s", (name,))
+        forum = cur.fetchone()
     if forum is not None:
         return {"id": forum[0], "name": forum[1], "description": forum[2]}
     else:
         return None
 
 
-def create_thread_in_db(forum_id, creator_id, title, spotify_url, description):
+def create_thread_in_db(
+    forum_id,
+    creator_id,
+    title,
+    spotify_url,
+    description,
+    spotify_type=None,
+    spotify_id=None,
+    album_image=None,
+):
     """Function that creates a thread and inserts it into the database table "threads". Function name ends with _db to avoid confusion with the function in app.py.
 
     Args
@@ -97,43 +420,119 @@ def create_thread_in_db(forum_id, creator_id, title, spotify_url, description):
             Spotify URL of the thread.
         description : str
             Description to the thread.
+        spotify_type : str
+            "track" or "album", parsed from the Spotify URL.
+        spotify_id : str
+            The track or album ID, parsed from the Spotify URL.
+        album_image : str
+            The resolved album image URL, or None to leave it for the backfill.
     Returns
     -------
         None
     """
 
-    conn = get_connection()
-    cur = conn.cursor()
-
     try:
-        cur.execute(
-            """
-            INSERT INTO threads (
-                forum_id,
-                creator_id,
-                title,
-                spotify_url,
-                description
+        with get_cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO threads (
+                    forum_id,
+                    creator_id,
+                    title,
+                    spotify_url,
+                    description,
+                    spotify_type,
+                    spotify_id,
+                    album_image
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id, created_at
+                """,
+                (
+                    forum_id,
+                    creator_id,
+                    title,
+                    spotify_url,
+                    description,
+                    spotify_type,
+                    spotify_id,
+                    album_image,
+                ),
             )
-            VALUES (%s, %s, %s, %s, %s)
-            """,
-            (forum_id, creator_id, title, spotify_url, description),
+            thread_id, created_at = cur.fetchone()
+            fan_out_thread(cur, thread_id, forum_id, created_at)
+    except Exception:
+        logger.exception("Error trying to create thread in db at create_thread_db")
+
+
+def fan_out_thread(cur, thread_id, forum_id, created_at):
+    """Copies a new thread into the home feed of every subscriber of its forum.
+
+    Runs on the caller's cursor so the thread and its feed entries are
+    committed together. A forum with more than FEED_FANOUT_LIMIT subscribers
+    is switched to fan-out on read instead, and its threads are read from
+    the threads table when a feed is loaded.
+
+    Args
+    -------
+        cur : psycopg2.extensions.cursor
+            The cursor the thread was inserted with.
+        thread_id : int
+            The ID of the new thread.
+        forum_id : int
+            The ID of the forum the thread was posted in.
+        created_at : datetime
+            The thread's creation time, which orders the feed.
+
+    Returns
+    -------
+        None
+    """
+    cur.execute("SELECT fanout_on_read FROM forums WHERE id = %s", (forum_id,))
+    row = cur.fetchone()
+    if row is None or row[0]:
+        return
+
+    cur.execute(
+        """
+        SELECT COUNT(*)
+        FROM (
+            SELECT 1 FROM subforum_subscriptions WHERE forum_id = %s LIMIT %s
+        ) AS subscribers
+        """,
+        (forum_id, FEED_FANOUT_LIMIT + 1),
+    )
+    if cur.fetchone()[0] > FEED_FANOUT_LIMIT:
+        cur.execute(
+            "UPDATE forums SET fanout_on_read = TRUE WHERE id = %s", (forum_id,)
         )
-        conn.commit()
-        cur.close()
-        conn.close()
-    except Exception as e:
-        print("Error trying to create thread in db at create_thread_db: " + str(e))
-    finally:
-        cur.close()
-        conn.close()
+        return
+
+    cur.execute(
+        """
+        INSERT INTO home_feed (user_id, thread_id, forum_id, created_at)
+        SELECT user_id, %s, %s, %s
+        FROM subforum_subscriptions
+        WHERE forum_id = %s
+        ON CONFLICT DO NOTHING
+        """,
+        (thread_id, forum_id, created_at, forum_id),
+    )
 
 
-def get_all_threads():
-    """Retrives the 15 most recent threads from the database.
+def get_all_threads(limit=THREADS_PAGE_SIZE, before=None):
+    """Retrives the most recent threads from the database, one page at a time.
 
     The threads are ordered by their creation date in descending order.
 
+    Args
+    -------
+        limit : int
+            The maximum number of threads to return.
+        before : tuple
+            A (created_at, id) cursor from decode_thread_cursor. Only threads
+            older than the cursor are returned.
+
     Returns
     -------
         list of dict
@@ -141,104 +540,115 @@ def get_all_threads():
             Spotify URL, creation date, and the username of the creator.
         Returns an empty list if no threads are found or an error occurs.
     """
-    conn = get_connection()
-    cur = conn.cursor()
     try:
-        cur.execute(
-            """
-            SELECT
-                threads.id,
-                threads.title,
-                threads.description,
-                threads.spotify_url,
-                threads.created_at,
-                users.username
-            FROM threads
-            JOIN users ON threads.creator_id = users.id
-            ORDER BY threads.created_at DESC
-            LIMIT 15
-            """
-        )
-        rows = cur.fetchall()
-        return [
-            {
-                "id": row[0],
-                "title": row[1],
-                "description": row[2],
-                "spotify_url": row[3],
-                "created_at": row[4],
-                "username": row[5],
-            }
-            for row in rows
-        ]
-    except Exception as e:
+        with get_cursor() as cur:
+            cur.execute(
+                """
+                SELECT
+                    threads.id,
+                    threads.title,
+                    threads.description,
+                    threads.spotify_url,
+                    threads.created_at,
+                    users.username,
+                    threads.album_image,
+                    threads.updated_at
+                FROM threads
+                JOIN users ON threads.creator_id = users.id
+                WHERE """
+                + KEYSET_CONDITION
+                + """
+                ORDER BY threads.created_at DESC, threads.id DESC
+                LIMIT %(limit)s
+                """,
+                keyset_params(before, limit),
+            )
+            rows = cur.fetchall()
+            return [
+                {
+                    "id": row[0],
+                    "title": row[1],
+                    "description": row[2],
+                    "spotify_url": row[3],
+                    "created_at": row[4],
+                    "username": row[5],
+                    "album_image": row[6],
+                    "updated_at": row[7],
+                }
+                for row in rows
+            ]
+    except Exception:
+        logger.exception("Error fetching threads in get_all_threads")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
-def get_threads_by_forum(forum_id):
-    """Fetches all threads associated with a specific forum based on the forum ID.
+def get_threads_by_forum(forum_id, limit=THREADS_PAGE_SIZE, before=None):
+    """Fetches one page of threads associated with a specific forum based on the forum ID.
 
     Args
     -------
         forum_id : int
             The ID of the forum.
+        limit : int
+            The maximum number of threads to return.
+        before : tuple
+            A (created_at, id) cursor from decode_thread_cursor. Only threads
+            older than the cursor are returned.
     Returns
     -------
         list
             A list of dictionaries, each containing the thread's information.
     """
-    conn = get_connection()
-
     threads = []
     try:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT
-                threads.id,
-                threads.forum_id,
-                threads.creator_id,
-                threads.title,
-                threads.spotify_url,
-                threads.description,
-                threads.is_pinned,
-                threads.created_at,
-                threads.updated_at,
-                users.username
-            FROM threads
-            JOIN users ON threads.creator_id = users.id
-            WHERE threads.forum_id = %s
-            ORDER BY threads.created_at DESC
-            """,
-            (forum_id,),
-        )
-        rows = cur.fetchall()
-
-        for row in rows:
-            thread = {
-                "id": row[0],
-                "forum_id": row[1],
-                "creator_id": row[2],
-                "title": row[3],
-                "spotify_url": row[4],
-                "description": row[5],
-                "is_pinned": row[6],
-                "created_at": row[7],
-                "updated_at": row[8],
-                "username": row[9],
-            }
-            threads.append(thread)
-
-        return threads
-    except Exception as e:
-        print(f"Error fetching threads in get_threads_by_forum: {e}")
+        with get_cursor() as cur:
+            cur.execute(
+                """
+                SELECT
+                    threads.id,
+                    threads.forum_id,
+                    threads.creator_id,
+                    threads.title,
+                    threads.spotify_url,
+                    threads.description,
+                    threads.is_pinned,
+                    threads.created_at,
+                    threads.updated_at,
+                    users.username,
+                    threads.album_image
+                FROM threads
+                JOIN users ON threads.creator_id = users.id
+                WHERE threads.forum_id = %(forum_id)s
+                    AND """
+                + KEYSET_CONDITION
+                + """
+                ORDER BY threads.created_at DESC, threads.id DESC
+                LIMIT %(limit)s
+                """,
+                {"forum_id": forum_id, **keyset_params(before, limit)},
+            )
+            rows = cur.fetchall()
+
+            for row in rows:
+                thread = {
+                    "id": row[0],
+                    "forum_id": row[1],
+                    "creator_id": row[2],
+                    "title": row[3],
+                    "spotify_url": row[4],
+                    "description": row[5],
+                    "is_pinned": row[6],
+                    "created_at": row[7],
+                    "updated_at": row[8],
+                    "username": row[9],
+                    "album_image": row[10],
+                }
+                threads.append(thread)
+
+            return threads
+    except Exception:
+        logger.exception("Error fetching threads in get_threads_by_forum")
         return []
-    finally:
-        conn.close()
-        cur.close()
 
 
 def get_user_profile_db(user_id):
@@ -254,12 +664,9 @@ def get_user_profile_db(user_id):
         dict
             A dictionary containing the user's bio and Spotify URL.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT bio, spotify_url FROM users WHERE id = %s", (user_id,))
-    results = cur.fetchone()
-    cur.close()
-    conn.close()
+    with get_cursor() as cur:
+        cur.execute("SELECT bio, spotify_url FROM users WHERE id = %s", (user_id,))
+        results = cur.fetchone()
 
     bio = results[0] if len(results) > 0 else ""
     spotify_url = results[1] if len(results) > 0 else ""
@@ -267,6 +674,94 @@ def get_user_profile_db(user_id):
     return {"bio": bio, "spotify_url": spotify_url}
 
 
+def get_profile_snapshot(user_id):
+    """Fetches the stored Spotify profile snapshot of a user.
+
+    Args
+    -------
+        user_id : int
+            The ID of the user.
+
+    Returns
+    -------
+        dict
+            A dictionary containing spotify_user, top_tracks, top_artists,
+            genre_histogram and age, the number of seconds since the
+            snapshot was taken.
+        None
+            If no snapshot has been taken yet.
+    """
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            SELECT
+                spotify_user,
+                top_tracks,
+                top_artists,
+                genre_histogram,
+                EXTRACT(EPOCH FROM NOW() - refreshed_at)
+            FROM profile_snapshots
+            WHERE user_id = %s
+            """,
+            (user_id,),
+        )
+        row = cur.fetchone()
+
+    if row is None:
+        return None
+    return {
+        "spotify_user": row[0],
+        "top_tracks": row[1],
+        "top_artists": row[2],
+        "genre_histogram": row[3],
+        "age": float(row[4]),
+    }
+
+
+def save_profile_snapshot(user_id, spotify_user, top_tracks, top_artists, histogram):
+    """Stores a fresh Spotify profile snapshot of a user, replacing the old one.
+
+    Args
+    -------
+        user_id : int
+            The ID of the user.
+        spotify_user : dict
+            The user's display_name and images.
+        top_tracks : list
+            The user's top tracks.
+        top_artists : list
+            The user's top artists.
+        histogram : dict
+            The user's genres mapped to their weight.
+
+    Returns
+    -------
+        None
+    """
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO profile_snapshots (
+                user_id, spotify_user, top_tracks, top_artists, genre_histogram
+            )
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET
+                spotify_user = EXCLUDED.spotify_user,
+                top_tracks = EXCLUDED.top_tracks,
+                top_artists = EXCLUDED.top_artists,
+                genre_histogram = EXCLUDED.genre_histogram,
+                refreshed_at = NOW()
+            """,
+            (
+                user_id,
+                Json(spotify_user),
+                Json(top_tracks),
+                Json(top_artists),
+                Json(histogram),
+            ),
+        )
+
+
 def controll_user_login(spotify_id, display_name):
     """Checks if a user exists in the database and creates a new user if not.
 
@@ -282,26 +777,19 @@ def controll_user_login(spotify_id, display_name):
         user_id : int
             The ID of the user in the database.
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    with get_cursor() as cur:
+        cur.execute("SELECT id FROM users WHERE spotify_id = %s", (spotify_id,))
+        user_id = cur.fetchone()
 
-    cur.execute("SELECT id FROM users WHERE spotify_id = %s", (spotify_id,))
-    user_id = cur.fetchone()
-
-    if len(user_id) == 0:
-        cur.execute(
-            "INSERT INTO users(spotify_id, username) VALUES (%s, %s) RETURNING id;",
-            (spotify_id, display_name),
-        )
-        user_id = cur.fetchone()[0]
-        conn.commit()
-        cur.close()
-        conn.close()
-        return user_id
-    else:
-        cur.close()
-        conn.close()
-        return user_id[0]
+        if len(user_id) == 0:
+            cur.execute(
+                "INSERT INTO users(spotify_id, username) VALUES (%s, %s) RETURNING id;",
+                (spotify_id, display_name),
+            )
+            user_id = cur.fetchone()[0]
+            return user_id
+        else:
+            return user_id[0]
 
 
 def create_subforum_in_db(name, description, creator_id):
@@ -321,22 +809,23 @@ def create_subforum_in_db(name, description, creator_id):
         bool
             True if the subforum was created successfully, False if it already exists.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         cur.execute("SELECT 1 FROM forums WHERE name = %s", (name,))
 
         if cur.fetchone():
             return False
         cur.execute(
-            "INSERT INTO forums(name, description, creator_id) VALUES (%s, %s, %s)",
+            """
+            INSERT INTO forums(name, description, creator_id)
+            VALUES (%s, %s, %s)
+            RETURNING id
+            """,
             (name, description, creator_id),
         )
-        conn.commit()
-        return True
-    finally:
-        cur.close()
-        conn.close()
+        forum_id = cur.fetchone()[0]
+
+    _forum_name_index.add({"id": forum_id, "name": name, "description": description})
+    return True
 
 
 def update_user_bio(bio, song, creator_id):
@@ -355,26 +844,22 @@ def update_user_bio(bio, song, creator_id):
     -------
         None
     """
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute(
-        "UPDATE users SET bio = %s, spotify_url = %s WHERE id = %s",
-        (bio, song, creator_id),
-    )
-    conn.commit()
-
-    cur.close()
-    conn.close()
+    with get_cursor() as cur:
+        cur.execute(
+            "UPDATE users SET bio = %s, spotify_url = %s WHERE id = %s",
+            (bio, song, creator_id),
+        )
 
 
-def get_subforum_data(name):
+def get_subforum_data(name, before=None):
     """Fetches subforum data by the subforum name.
 
     Args
     -------
         name : str
             The name of the subforum.
+        before : tuple
+            A (created_at, id) cursor; only threads older than it are fetched.
 
     Returns
     -------
@@ -388,7 +873,7 @@ def get_subforum_data(name):
     if subforum_dict is None:
         return None
 
-    threads = get_threads_by_forum(subforum_dict["id"])
+    threads = get_threads_by_forum(subforum_dict["id"], before=before)
 
     return {"subforum": subforum_dict, "threads": threads}
 
@@ -411,29 +896,45 @@ def subscribe_to_forum(user_id, forum_id):
             False if the user was already subscribed or an error occurred.
 
     """
-    conn = get_connection()
-    cur = conn.cursor()
     try:
-        cur.execute(
-            """
-            INSERT INTO subforum_subscriptions (user_id, forum_id)
-            VALUES (%s, %s)
-            ON CONFLICT DO NOTHING
-            """,
-            (user_id, forum_id),
-        )
-        conn.commit()
+        with get_cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO subforum_subscriptions (user_id, forum_id)
+                VALUES (%s, %s)
+                ON CONFLICT DO NOTHING
+                """,
+                (user_id, forum_id),
+            )
+            is_subscribed = cur.rowcount > 0
+            if is_subscribed:
+                cur.execute(
+                    """
+                    INSERT INTO home_feed (user_id, thread_id, forum_id, created_at)
+                    SELECT %(user_id)s, threads.id, threads.forum_id, threads.created_at
+                    FROM threads
+                    JOIN forums ON forums.id = threads.forum_id
+                    WHERE threads.forum_id = %(forum_id)s
+                        AND NOT forums.fanout_on_read
+                    ORDER BY threads.created_at DESC, threads.id DESC
+                    LIMIT %(limit)s
+                    ON CONFLICT DO NOTHING
+                    """,
+                    {
+                        "user_id": user_id,
+                        "forum_id": forum_id,
+                        "limit": FEED_BACKFILL_LIMIT,
+                    },
+                )
+    except Exception:
+        logger.exception("Error subscribing to forum")
+        return False
 
-        if cur.rowcount > 0:
-            return True
-        else:
-            return False
-    except Exception as e:
-        print(f"Error subscribing to forum: {e}")
+    if is_subscribed:
+        invalidate_sidebar_cache(user_id)
+        return True
+    else:
         return False
-    finally:
-        cur.close()
-        conn.close()
 
 
 def unsubscribe_from_forum(user_id, forum_id):
@@ -453,32 +954,57 @@ def unsubscribe_from_forum(user_id, forum_id):
             True if the user was successfully subscribed
             False if the user was already subscribed
     """
-    conn = get_connection()
-    cur = conn.cursor()
     try:
-        cur.execute(
-            """
-            DELETE FROM subforum_subscriptions
-            WHERE user_id = %s AND forum_id = %s
-            """,
-            (user_id, forum_id),
-        )
-        conn.commit()
-        if cur.rowcount > 0:
-            return True
-        else:
-            return False
-    except Exception as e:
-        print(f"Error unsubscribing from forum: {e}")
-        return False
-    finally:
-        cur.close()
-        conn.close()
+        with get_cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM subforum_subscriptions
+                WHERE user_id = %s AND forum_id = %s
+                """,
+                (user_id, forum_id),
+            )
+            is_unsubscribed = cur.rowcount > 0
+            cur.execute(
+                "DELETE FROM home_feed WHERE user_id = %s AND forum_id = %s",
+                (user_id, forum_id),
+            )
+    except Exception:
+        logger.exception("Error unsubscribing from forum")
+        return False
+
+    if is_unsubscribed:
+        invalidate_sidebar_cache(user_id)
+        return True
+    else:
+        return False
+
+
+def get_all_subforums():
+    """Fetches every subforum from the database.
+
+    Returns
+    -------
+        list of dict
+            A list of dictionaries containing the subforums' id, name and
+            description.
+    """
+    with get_cursor() as cur:
+        cur.execute("SELECT id, name, description FROM forums")
+        rows = cur.fetchall()
+        return [{"id": row[0], "name": row[1], "description": row[2]} for row in rows]
+
+
+_forum_name_index = ForumNameIndex(
+    get_all_subforums, ttl=int(os.getenv("FORUM_INDEX_TTL", "60"))
+)
 
 
 def search_subforums_by_name(query):
     """Searches for subforums by its name
 
+    Answered from an in-memory index of the forum names, so autocomplete
+    does not query the database.
+
     Args
     ------
         query : str
@@ -489,24 +1015,158 @@ def search_subforums_by_name(query):
         list : [dict]
             A list of dictionaries containing the subforum names.
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    return _forum_name_index.search(query, limit=10)
+
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+
+
+def encode_search_cursor(result):
+    """Encodes the position of a search result as an opaque pagination cursor.
+
+    Args
+    -------
+        result : dict
+            A result from search_threads_and_comments, usually the last one
+            of a page.
+
+    Returns
+    -------
+        str
+            A URL-safe cursor to pass back as the "after" parameter.
+    """
+    raw = f"{result['rank']!r}|{result['kind']}|{result['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor):
+    """Decodes a cursor made by encode_search_cursor.
+
+    Args
+    -------
+        cursor : str
+            The cursor, or None.
+
+    Returns
+    -------
+        tuple
+            A (rank, kind, id) tuple.
+        None
+            If no cursor was given or it is malformed.
+    """
+    if not cursor:
+        return None
+
     try:
-        cur.execute(
-            """
-            SELECT id, name, description
-            FROM forums
-            WHERE LOWER (name) LIKE LOWER (%s)
-            ORDER BY name ASC
-            LIMIT 10
-            """,
-            (f"%{query}%",),
-        )
-        rows = cur.fetchall()
-        return [{"id": row[0], "name": row[1], "description": row[2]} for row in rows]
-    finally:
-        cur.close()
-        conn.close()
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        rank, kind, result_id = raw.split("|")
+        if kind not in ("thread", "comment"):
+            return None
+        return float(rank), kind, int(result_id)
+    except ValueError:
+        return None
+
+
+def search_threads_and_comments(query, limit=SEARCH_PAGE_SIZE, after=None):
+    """Searches thread titles, thread descriptions and comments, best match first.
+
+    Uses the GIN indexed search_vector columns, so only matching rows are
+    read. Thread titles weigh more than descriptions and comments. Results
+    are paginated by (rank, kind, id) so that later pages continue exactly
+    where the previous one stopped.
+
+    Args
+    ------
+        query : str
+            The search terms. Supports "quoted phrases", OR and -exclusions.
+        limit : int
+            The maximum number of results to return.
+        after : tuple
+            A (rank, kind, id) cursor from decode_search_cursor; only results
+            after it are returned.
+
+    Returns
+    -------
+        list of dict
+            Results with kind ("thread" or "comment"), id, thread_id, title,
+            description, username, created_at and rank.
+    """
+    after_rank, after_kind, after_id = after if after is not None else (None,) * 3
+    try:
+        with get_cursor() as cur:
+            cur.execute(
+                """
+                WITH search AS (
+                    SELECT websearch_to_tsquery('simple', %(query)s) AS tsquery
+                ),
+                matches AS (
+                    SELECT
+                        'thread' AS kind,
+                        threads.id,
+                        threads.id AS thread_id,
+                        ts_rank(threads.search_vector, search.tsquery) AS rank
+                    FROM threads, search
+                    WHERE threads.search_vector @@ search.tsquery
+                    UNION ALL
+                    SELECT
+                        'comment' AS kind,
+                        t_comments.id,
+                        t_comments.thread_id,
+                        ts_rank(t_comments.search_vector, search.tsquery) AS rank
+                    FROM t_comments, search
+                    WHERE t_comments.search_vector @@ search.tsquery
+                ),
+                page AS (
+                    SELECT *
+                    FROM matches
+                    WHERE %(after_rank)s IS NULL
+                        OR (rank, kind, id)
+                            < (%(after_rank)s::real, %(after_kind)s, %(after_id)s)
+                    ORDER BY rank DESC, kind DESC, id DESC
+                    LIMIT %(limit)s
+                )
+                SELECT
+                    page.kind,
+                    page.id,
+                    page.thread_id,
+                    threads.title,
+                    COALESCE(t_comments.description, threads.description),
+                    users.username,
+                    COALESCE(t_comments.created_at, threads.created_at),
+                    page.rank
+                FROM page
+                JOIN threads ON threads.id = page.thread_id
+                LEFT JOIN t_comments
+                    ON page.kind = 'comment' AND t_comments.id = page.id
+                JOIN users
+                    ON users.id = COALESCE(t_comments.user_id, threads.creator_id)
+                ORDER BY page.rank DESC, page.kind DESC, page.id DESC
+                """,
+                {
+                    "query": query,
+                    "after_rank": after_rank,
+                    "after_kind": after_kind,
+                    "after_id": after_id,
+                    "limit": limit,
+                },
+            )
+            rows = cur.fetchall()
+            return [
+                {
+                    "kind": row[0],
+                    "id": row[1],
+                    "thread_id": row[2],
+                    "title": row[3],
+                    "description": row[4],
+                    "username": row[5],
+                    "created_at": row[6],
+                    "rank": row[7],
+                }
+                for row in rows
+            ]
+    except Exception:
+        logger.exception("Error searching threads and comments")
+        return []
 
 
 def get_user_subforum_subscriptions(user_id):
@@ -524,26 +1184,22 @@ def get_user_subforum_subscriptions(user_id):
             A list of dictionaries containing the subforum's id (int) and name (str)
 
     """
-    conn = get_connection()
-    cur = conn.cursor()
     try:
-        cur.execute(
-            """
-            SELECT forums.id, forums.name
-            FROM forums
-            JOIN subforum_subscriptions ON forums.id = subforum_subscriptions.forum_id
-            WHERE subforum_subscriptions.user_id = %s
-            """,
-            (user_id,),
-        )
-        rows = cur.fetchall()
-        return [{"id": row[0], "name": row[1]} for row in rows]
-    except Exception as e:
-        print(f"Error fetching user subforum subscriptions: {e}")
+        with get_cursor() as cur:
+            cur.execute(
+                """
+                SELECT forums.id, forums.name
+                FROM forums
+                JOIN subforum_subscriptions ON forums.id = subforum_subscriptions.forum_id
+                WHERE subforum_subscriptions.user_id = %s
+                """,
+                (user_id,),
+            )
+            rows = cur.fetchall()
+            return [{"id": row[0], "name": row[1]} for row in rows]
+    except Exception:
+        logger.exception("Error fetching user subforum subscriptions")
         return []
-    finally:
-        cur.close()
-        conn.close()
 
 
 def get_subforum_by_name(name):
@@ -559,18 +1215,18 @@ def get_subforum_by_name(name):
     Returns
     -------
         dict
-            a dictionary containing the subforum's id(int) and name (str)
+            a dictionary containing the subforum's id(int), name (str),
+            description (str) and updated_at (datetime), which changes
+            whenever a thread in the subforum is added, edited or removed.
 
         None
             if no subforum with the given name exists.
 
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         cur.execute(
             """
-            SELECT id, name, description
+            SELECT id, name, description, updated_at
             FROM forums
             WHERE name = %s
             """,
@@ -579,94 +1235,284 @@ def get_subforum_by_name(name):
         row = cur.fetchone()
 
         if row is not None:
-            return {"id": row[0], "name": row[1], "description": row[2]}
+            return {
+                "id": row[0],
+                "name": row[1],
+                "description": row[2],
+                "updated_at": row[3],
+            }
         return None
-    finally:
-        cur.close()
-        conn.close()
 
 
-def get_thread_by_id(thread_id):
-    """Fetches a thread by its id from the DB
+def get_forums_version(forum_ids=None):
+    """Fetches a version token for the thread lists of several subforums.
+
+    The token changes whenever a thread in one of the subforums is added,
+    edited or removed, or a subforum is created or deleted.
 
     Args
     -------
-        thread_id : int
-            The id of the thread.
+        forum_ids : list of int
+            The subforums to cover, or None for every subforum.
 
     Returns
     -------
-        dict
-            A dict containing the threads id, name and description
-
-        None
-            If the thread does not exist.
+        tuple
+            The latest updated_at of the subforums and their number.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         cur.execute(
             """
-            SELECT
-                threads.id,
-                threads.title,
-                threads.description,
-                threads.spotify_url,
-                threads.created_at,
-                users.username,
-                forums.name as subforum_name,
-                forums.id as subforum_id,
-                threads.creator_id
-            FROM threads
-            JOIN users ON threads.creator_id = users.id
-            JOIN forums ON threads.forum_id = forums.id
-            WHERE threads.id = %s
+            SELECT MAX(updated_at), COUNT(*)
+            FROM forums
+            WHERE %(forum_ids)s IS NULL OR id = ANY(%(forum_ids)s)
             """,
-            (thread_id,),
+            {"forum_ids": forum_ids},
         )
+        return cur.fetchone()
+
+
+def get_thread_version(thread_id):
+    """Fetches when a thread page's data last changed.
+
+    Lets the thread page answer a conditional GET without loading the
+    thread and its comments.
+
+    Args
+    -------
+        thread_id : int
+            The ID of the thread.
+
+    Returns
+    -------
+        datetime
+            The thread's updated_at, which changes whenever the thread is
+            edited, voted on or commented on.
+        None
+            If the thread does not exist.
+    """
+    with get_cursor() as cur:
+        cur.execute("SELECT updated_at FROM threads WHERE id = %s", (thread_id,))
         row = cur.fetchone()
-        if row is not None:
-            return {
-                "id": row[0],
-                "title": row[1],
-                "description": row[2],
-                "spotify_url": row[3],
-                "created_at": row[4],
-                "username": row[5],
-                "subforum_name": row[6],
-                "subforum_id": row[7],
-                "creator_id": row[8],
-            }
+    return row[0] if row is not None else None
+
+
+def get_thread_page(thread_id, user_id=None, limit=COMMENTS_PAGE_SIZE, after=None):
+    """Fetches everything a thread page shows in a single query.
+
+    The thread with its author, forum and vote totals, the user's own vote
+    and one page of comments with their authors are read in one round trip
+    on one connection. Comments are paginated oldest first by
+    (created_at, id).
+
+    Args
+    -------
+        thread_id : int
+            The ID of the thread.
+        user_id : int
+            The ID of the logged in user, or None.
+        limit : int
+            The number of comments per page.
+        after : tuple
+            A (created_at, id) cursor; only comments newer than it are fetched.
+
+    Returns
+    -------
+        dict
+            The thread, with "likes" and "dislikes", "user_vote" (1, -1 or
+            0 if the user has not voted), "comments" (at most limit) and
+            "has_more_comments".
+        None
+            If the thread does not exist or an error occurs.
+    """
+    after_created_at, after_id = after if after is not None else (None, None)
+    try:
+        with get_cursor() as cur:
+            cur.execute(
+                """
+                WITH thread AS (
+                    SELECT
+                        threads.id,
+                        threads.title,
+                        threads.description,
+                        threads.spotify_url,
+                        threads.created_at,
+                        users.username,
+                        forums.name AS subforum_name,
+                        forums.id AS subforum_id,
+                        threads.creator_id,
+                        threads.album_image,
+                        threads.like_count,
+                        threads.dislike_count,
+                        threads.updated_at,
+                        COALESCE(
+                            (
+                                SELECT vote
+                                FROM likes
+                                WHERE likes.thread_id = threads.id
+                                    AND likes.user_id = %(user_id)s
+                            ),
+                            0
+                        ) AS user_vote
+                    FROM threads
+                    JOIN users ON threads.creator_id = users.id
+                    JOIN forums ON threads.forum_id = forums.id
+                    WHERE threads.id = %(thread_id)s
+                )
+                SELECT
+                    thread.*,
+                    comments.description,
+                    comments.created_at,
+                    comments.username,
+                    comments.spotify_url,
+                    comments.album_image,
+                    comments.id
+                FROM thread
+                LEFT JOIN LATERAL (
+                    SELECT
+                        t_comments.description,
+                        t_comments.created_at,
+                        users.username,
+                        t_comments.spotify_url,
+                        t_comments.album_image,
+                        t_comments.id
+                    FROM t_comments
+                    JOIN users ON t_comments.user_id = users.id
+                    WHERE t_comments.thread_id = thread.id
+                        AND (
+                            %(after_created_at)s IS NULL
+                            OR (t_comments.created_at, t_comments.id)
+                                > (%(after_created_at)s, %(after_id)s)
+                        )
+                    ORDER BY t_comments.created_at, t_comments.id
+                    LIMIT %(limit)s + 1
+                ) AS comments ON TRUE
+                ORDER BY comments.created_at, comments.id
+                """,
+                {
+                    "thread_id": thread_id,
+                    "user_id": user_id,
+                    "after_created_at": after_created_at,
+                    "after_id": after_id,
+                    "limit": limit,
+                },
+            )
+            rows = cur.fetchall()
+    except Exception:
+        logger.exception("Error fetching thread page")
         return None
-    except Exception as e:
-        print(f"Error fetching thread by id: {e}")
+
+    if not rows:
         return None
-    finally:
-        cur.close()
-        conn.close()
 
+    row = rows[0]
+    comments = [
+        {
+            "description": row[14],
+            "created_at": row[15],
+            "username": row[16],
+            "spotify_url": row[17],
+            "album_image": row[18],
+            "id": row[19],
+        }
+        for row in rows
+        if row[19] is not None
+    ]
+    return {
+        "id": row[0],
+        "title": row[1],
+        "description": row[2],
+        "spotify_url": row[3],
+        "created_at": row[4],
+        "username": row[5],
+        "subforum_name": row[6],
+        "subforum_id": row[7],
+        "creator_id": row[8],
+        "album_image": row[9],
+        "likes": row[10],
+        "dislikes": row[11],
+        "updated_at": row[12],
+        "user_vote": row[13],
+        "comments": comments[:limit],
+        "has_more_comments": len(comments) > limit,
+    }
+
+
+def remove_thread_from_db(thread_id, user_id):
+    """Deletes a thread if the user created it, in a single statement.
+
+    Its votes and comments are deleted explicitly in the same statement,
+    so databases created before the foreign keys had ON DELETE CASCADE are
+    cleaned up too. Feed entries are removed by the cascade of home_feed.
 
-def remove_thread_from_db(thread_id):
-    conn = get_connection()
-    cur = conn.cursor()
+    Args
+    -------
+        thread_id : int
+            The ID of the thread.
+        user_id : int
+            The ID of the user removing it.
+
+    Returns
+    -------
+        dict
+            The thread's "creator_id" and "subforum_name", and "removed",
+            which is False if the user is not the thread's creator.
+        None
+            If the thread does not exist.
+        False
+            If an error occurred.
+    """
     try:
-        cur.execute("DELETE FROM likes WHERE thread_id = %s", (thread_id,))
-        cur.execute("DELETE FROM threads WHERE id = %s", (thread_id,))
-        conn.commit()
-        return cur.rowcount > 0
-    except Exception as e:
-        print(f"Error deleting thread: {e}")
+        with get_cursor() as cur:
+            cur.execute(
+                """
+                WITH target AS (
+                    SELECT threads.id, threads.creator_id, forums.name
+                    FROM threads
+                    JOIN forums ON threads.forum_id = forums.id
+                    WHERE threads.id = %(thread_id)s
+                ),
+                removed_likes AS (
+                    DELETE FROM likes
+                    USING target
+                    WHERE likes.thread_id = target.id
+                        AND target.creator_id = %(user_id)s
+                ),
+                removed_comments AS (
+                    DELETE FROM t_comments
+                    USING target
+                    WHERE t_comments.thread_id = target.id
+                        AND target.creator_id = %(user_id)s
+                ),
+                removed AS (
+                    DELETE FROM threads
+                    USING target
+                    WHERE threads.id = target.id
+                        AND target.creator_id = %(user_id)s
+                    RETURNING threads.id
+                )
+                SELECT target.creator_id, target.name, EXISTS (SELECT 1 FROM removed)
+                FROM target
+                """,
+                {"thread_id": thread_id, "user_id": user_id},
+            )
+            row = cur.fetchone()
+    except Exception:
+        logger.exception("Error deleting thread")
         return False
-    finally:
-        cur.close()
-        conn.close()
+
+    if row is None:
+        return None
+    return {"creator_id": row[0], "subforum_name": row[1], "removed": row[2]}
 
 
 def register_thread_like_or_dislike(user_id, thread_id, vote):
     """Registers, updates or removes a like or dislike for a thread by a user.
 
     If the user clicks the same vote (like or dislike) twice, the vote is removed.
-    If the user changes their vote, the new vote is registered.
+    If the user changes their vote, the new vote is registered. The vote and
+    the thread's new totals are handled by the toggle_thread_vote database
+    function in a single round trip.
 
     Args
     -----
@@ -679,32 +1525,25 @@ def register_thread_like_or_dislike(user_id, thread_id, vote):
 
     Returns
     -----
-        None
+        dict
+            The thread's total likes and dislikes after the vote.
+            Example: {"likes": 10, "dislikes": 2}
+
+        If an error occurs, returns None.
     """
-    conn = get_connection()
-    cur = conn.cursor()
     try:
-
-        cur.execute(
-            "DELETE FROM likes WHERE user_id = %s AND thread_id = %s AND vote = %s",
-            (user_id, thread_id, vote),
-        )
-        if cur.rowcount == 0:
+        with get_cursor() as cur:
             cur.execute(
-                """
-                INSERT INTO likes (user_id, thread_id, vote)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (user_id, thread_id)
-                DO UPDATE SET vote = EXCLUDED.vote
-                """,
+                "SELECT likes, dislikes FROM toggle_thread_vote(%s, %s, %s::smallint)",
                 (user_id, thread_id, vote),
             )
-        conn.commit()
-    except Exception as e:
-        print(f"Error registering thread like/dislike: {e}")
-    finally:
-        cur.close()
-        conn.close()
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return {"likes": row[0], "dislikes": row[1]}
+    except Exception:
+        logger.exception("Error registering thread like/dislike")
+        return None
 
 
 def get_thread_likes_and_dislikes(thread_id):
@@ -723,63 +1562,123 @@ def get_thread_likes_and_dislikes(thread_id):
 
         If an error occurs, returns {"likes": 0, "dislikes": 0}.
     """
-    conn = get_connection()
-    cur = conn.cursor()
     try:
-        cur.execute(
-            """
-            SELECT
-                SUM(CASE WHEN vote = 1 THEN 1 ELSE 0 END) AS likes,
-                SUM(CASE WHEN vote = -1 THEN 1 ELSE 0 END) AS dislikes
-            FROM likes
-            WHERE thread_id = %s
-            """,
-            (thread_id,),
-        )
-        row = cur.fetchone()
-        return {"likes": row[0] or 0, "dislikes": row[1] or 0}
-    except Exception as e:
-        print(f"Error fetching thread likes and dislikes: {e}")
+        with get_cursor() as cur:
+            cur.execute(
+                "SELECT like_count, dislike_count FROM threads WHERE id = %s",
+                (thread_id,),
+            )
+            row = cur.fetchone()
+            if row is None:
+                return {"likes": 0, "dislikes": 0}
+            return {"likes": row[0], "dislikes": row[1]}
+    except Exception:
+        logger.exception("Error fetching thread likes and dislikes")
         return {"likes": 0, "dislikes": 0}
-    finally:
-        cur.close()
-        conn.close()
 
 
-def get_comments_for_thread(thread_id):
-    conn = get_connection()
-    cur = conn.cursor()
+def get_vote_state(thread_id, user_id):
+    """Fetches a thread's vote totals together with a user's own vote.
+
+    Args
+    -------
+        thread_id : int
+            The ID of the thread.
+        user_id : int
+            The ID of the user.
+
+    Returns
+    -------
+        dict
+            The thread's totals and the user's vote, 0 if they have not voted.
+            Example: {"likes": 10, "dislikes": 2, "vote": 1}
+        None
+            If the thread does not exist or an error occurs.
+    """
     try:
-        cur.execute(
-            """
-            SELECT
-                t_comments.description,
-                t_comments.created_at,
-                users.username,
-                t_comments.spotify_url
-            FROM t_comments
-            JOIN users ON t_comments.user_id = users.id
-            WHERE t_comments.thread_id = %s
-            ORDER BY t_comments.created_at ASC
-            """,
-            (thread_id,),
-        )
-        rows = cur.fetchall()
-        return [
-            {
-                "description": row[0],
-                "created_at": row[1],
-                "username": row[2],
-                "spotify_url": row[3],
-            }
-            for row in rows
-        ]
-    except Exception as e:
-        print(f"Error fetching comments for thread {thread_id}: {e}")
-        return []
-    finally:
-        cur.close()
-        conn.close()
+        with get_cursor() as cur:
+            cur.execute(
+                """
+                SELECT
+                    threads.like_count,
+                    threads.dislike_count,
+                    COALESCE(likes.vote, 0)
+                FROM threads
+                LEFT JOIN likes
+                    ON likes.thread_id = threads.id AND likes.user_id = %s
+                WHERE threads.id = %s
+                """,
+                (user_id, thread_id),
+            )
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return {"likes": row[0], "dislikes": row[1], "vote": row[2]}
+    except Exception:
+        logger.exception("Error fetching vote state")
+        return None
+
+
+def apply_votes(votes):
+    """Writes a batch of votes in one transaction.
+
+    Every vote is the user's final vote on the thread: 1 or -1 replaces any
+    earlier vote and 0 removes it. All removals and all upserts are one
+    statement each, so the statement level triggers from migration 0004
+    update each thread's counters once per batch. Votes on threads or by
+    users that have been deleted meanwhile are skipped.
+
+    Args
+    -------
+        votes : list of tuple
+            (user_id, thread_id, vote) tuples, at most one per user and thread.
+
+    Returns
+    -------
+        bool
+            True if the batch was written, False if an error occurred.
+    """
+    removed = [(user_id, thread_id) for user_id, thread_id, vote in votes if not vote]
+    cast = sorted(vote for vote in votes if vote[2])
+
+    try:
+        with get_cursor() as cur:
+            if removed:
+                execute_values(
+                    cur,
+                    """
+                    DELETE FROM likes
+                    USING (VALUES %s) AS removed (user_id, thread_id)
+                    WHERE likes.user_id = removed.user_id
+                        AND likes.thread_id = removed.thread_id
+                    """,
+                    removed,
+                    page_size=len(removed),
+                )
+            if cast:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO likes (user_id, thread_id, vote)
+                    SELECT cast_votes.user_id, cast_votes.thread_id, cast_votes.vote
+                    FROM (VALUES %s) AS cast_votes (user_id, thread_id, vote)
+                    WHERE EXISTS (
+                        SELECT 1 FROM threads WHERE threads.id = cast_votes.thread_id
+                    ) AND EXISTS (
+                        SELECT 1 FROM users WHERE users.id = cast_votes.user_id
+                    )
+                    ON CONFLICT (user_id, thread_id) DO UPDATE
+                    SET vote = EXCLUDED.vote
+                    WHERE likes.vote <> EXCLUDED.vote
+                    """,
+                    cast,
+                    template="(%s, %s, %s::smallint)",
+                    page_size=len(cast),
+                )
+        return True
+    except Exception:
+        logger.exception("Error writing %s buffered votes", len(votes))
+        return False
 
 
 def delete_subforum_from_db(name, user_id):
@@ -798,19 +1697,28 @@ def delete_subforum_from_db(name, user_id):
         bool
             True if the subforum was deleted, False otherwise.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT role FROM users WHERE id = %s", (user_id,))
-    result = cur.fetchone()
-    if not result or result[0] != "admin":
-        cur.close()
-        conn.close()
-        return False
+    with get_cursor() as cur:
+        cur.execute("SELECT role FROM users WHERE id = %s", (user_id,))
+        result = cur.fetchone()
+        if not result or result[0] != "admin":
+            return False
 
-    cur.execute("DELETE FROM forums WHERE name = %s", (name,))
-    conn.commit()
-    cur.close()
-    conn.close()
+        cur.execute(
+            """
+            DELETE FROM subforum_subscriptions
+            WHERE forum_id = (SELECT id FROM forums WHERE name = %s)
+            RETURNING user_id
+            """,
+            (name,),
+        )
+        subscriber_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("DELETE FROM forums WHERE name = %s RETURNING id", (name,))
+        deleted = cur.fetchone()
+
+    if deleted is not None:
+        _forum_name_index.remove(deleted[0])
+    for subscriber_id in subscriber_ids:
+        invalidate_sidebar_cache(subscriber_id)
     return True
 
 
@@ -828,37 +1736,148 @@ def get_user_role(user_id):
         str
             The role of the user, or None if not found.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT role FROM users WHERE id = %s", (user_id,))
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
+    with get_cursor() as cur:
+        cur.execute("SELECT role FROM users WHERE id = %s", (user_id,))
+        result = cur.fetchone()
     return result[0] if result else None
 
 
-def add_comment_to_thread(thread_id, user_id, description, spotify_url=None):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO t_comments (thread_id, user_id, description, spotify_url)
-        VALUES (%s, %s, %s, %s)
-        """,
-        (thread_id, user_id, description, spotify_url),
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+def update_user_role(user_id, role):
+    """
+    Changes the role of a user, e.g. to or from "admin".
+
+    Args
+    ------
+        user_id : int
+            The ID of the user.
+        role : str
+            The new role of the user.
+
+    Returns
+    -------
+        bool
+            True if the user exists and was updated, False otherwise.
+    """
+    with get_cursor() as cur:
+        cur.execute("UPDATE users SET role = %s WHERE id = %s", (role, user_id))
+        is_updated = cur.rowcount > 0
+
+    invalidate_sidebar_cache(user_id)
+    return is_updated
+
+
+def get_user_sidebar_data(user_id):
+    """
+    Fetches the role and subscribed subforums of a user in a single query.
+
+    The result is cached per user until subscribe_to_forum,
+    unsubscribe_from_forum, delete_subforum_from_db or update_user_role
+    invalidates it, or SIDEBAR_CACHE_TTL seconds (300 by default) pass.
+
+    Args
+    ------
+        user_id : int
+            The ID of the user.
+
+    Returns
+    -------
+        dict
+            A dictionary with the user's role (str or None) and
+            subscribed_forums, a list of dictionaries containing each
+            subforum's id (int) and name (str).
+    """
+    sidebar = _sidebar_cache.get(user_id)
+    if sidebar is not None:
+        return sidebar
+
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            SELECT users.role, forums.id, forums.name
+            FROM users
+            LEFT JOIN subforum_subscriptions
+                ON subforum_subscriptions.user_id = users.id
+            LEFT JOIN forums ON forums.id = subforum_subscriptions.forum_id
+            WHERE users.id = %s
+            ORDER BY forums.name
+            """,
+            (user_id,),
+        )
+        rows = cur.fetchall()
 
+    sidebar = {
+        "role": rows[0][0] if rows else None,
+        "subscribed_forums": [
+            {"id": row[1], "name": row[2]} for row in rows if row[1] is not None
+        ],
+    }
+    _sidebar_cache.set(user_id, sidebar)
+    return sidebar
 
-def get_threads_by_user_subscriptions(user_id):
-    """Retrives all threads the user is subscribed to.
+
+def invalidate_sidebar_cache(user_id):
+    """
+    Drops the cached sidebar data of a user so the next page load refetches it.
+
+    Args
+    ------
+        user_id : int
+            The ID of the user.
+    """
+    _sidebar_cache.delete(user_id)
+
+
+def add_comment_to_thread(
+    thread_id,
+    user_id,
+    description,
+    spotify_url=None,
+    spotify_type=None,
+    spotify_id=None,
+    album_image=None,
+):
+    with get_cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO t_comments (
+                thread_id,
+                user_id,
+                description,
+                spotify_url,
+                spotify_type,
+                spotify_id,
+                album_image
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """,
+            (
+                thread_id,
+                user_id,
+                description,
+                spotify_url,
+                spotify_type,
+                spotify_id,
+                album_image,
+            ),
+        )
+
+
+def get_threads_by_user_subscriptions(user_id, limit=THREADS_PAGE_SIZE, before=None):
+    """Retrives one page of threads from the subforums the user is subscribed to.
+
+    Reads the user's home feed, which holds the threads of their subscribed
+    forums in feed order, and merges in the threads of subscribed forums that
+    use fan-out on read. Both parts are bounded index range scans.
 
     Args
     ------
         user_id : int
             The ID of the user in the database
+        limit : int
+            The maximum number of threads to return.
+        before : tuple
+            A (created_at, id) cursor from decode_thread_cursor. Only threads
+            older than the cursor are returned.
 
     Returns
     -------
@@ -870,44 +1889,192 @@ def get_threads_by_user_subscriptions(user_id):
             - spotify_url : str
             -created_at : datetime
             - username : str
+            - album_image : str or None
 
         Returns an empty list if no threads are found or an error occurs.
     """
-    conn = get_connection()
-    cur = conn.cursor()
     try:
+        with get_cursor() as cur:
+            cur.execute(
+                """
+                WITH feed AS (
+                    (
+                        SELECT thread_id AS id, created_at
+                        FROM home_feed
+                        WHERE user_id = %(user_id)s
+                            AND (
+                                %(before_created_at)s IS NULL
+                                OR (created_at, thread_id)
+                                    < (%(before_created_at)s, %(before_id)s)
+                            )
+                        ORDER BY created_at DESC, thread_id DESC
+                        LIMIT %(limit)s
+                    )
+                    UNION
+                    (
+                        SELECT threads.id, threads.created_at
+                        FROM subforum_subscriptions ss
+                        JOIN forums
+                            ON forums.id = ss.forum_id AND forums.fanout_on_read
+                        JOIN threads ON threads.forum_id = ss.forum_id
+                        WHERE ss.user_id = %(user_id)s
+                            AND """
+                + KEYSET_CONDITION
+                + """
+                        ORDER BY threads.created_at DESC, threads.id DESC
+                        LIMIT %(limit)s
+                    )
+                )
+                SELECT
+                    threads.id,
+                    threads.title,
+                    threads.description,
+                    threads.spotify_url,
+                    threads.created_at,
+                    users.username,
+                    threads.album_image,
+                    threads.updated_at
+                FROM feed
+                JOIN threads ON threads.id = feed.id
+                JOIN users ON threads.creator_id = users.id
+                ORDER BY feed.created_at DESC, feed.id DESC
+                LIMIT %(limit)s
+                """,
+                {"user_id": user_id, **keyset_params(before, limit)},
+            )
+            subscriptions = cur.fetchall()
+            return [
+                {
+                    "id": row[0],
+                    "title": row[1],
+                    "description": row[2],
+                    "spotify_url": row[3],
+                    "created_at": row[4],
+                    "username": row[5],
+                    "album_image": row[6],
+                    "updated_at": row[7],
+                }
+                for row in subscriptions
+            ]
+    except Exception:
+        logger.exception("Error fetching threads by user subscriptions")
+        return []
+
+
+ARTWORK_TABLES = ("threads", "t_comments")
+
+
+def get_rows_missing_artwork(table, after_id, limit):
+    """Fetches a batch of threads or comments that have no stored artwork yet.
+
+    Args
+    ------
+        table : str
+            "threads" or "t_comments".
+        after_id : int
+            Only rows with a higher ID are returned, which lets a backfill
+            walk the table in batches and resume where it stopped.
+        limit : int
+            The maximum number of rows to return.
+
+    Returns
+    -------
+        list of dict
+            A list of dictionaries with the row's id and spotify_url,
+            ordered by id.
+    """
+    if table not in ARTWORK_TABLES:
+        raise ValueError(f"Unknown artwork table: {table}")
+
+    with get_cursor() as cur:
         cur.execute(
-            """
-            SELECT
-                threads.id,
-                threads.title,
-                threads.description,
-                threads.spotify_url,
-                threads.created_at,
-                users.username
-            FROM threads
-            JOIN users ON threads.creator_id = users.id
-            JOIN subforum_subscriptions ss ON ss.forum_id = threads.forum_id
-            WHERE ss.user_id = %s
-            ORDER BY threads.created_at DESC
+            f"""
+            SELECT id, spotify_url
+            FROM {table}
+            WHERE album_image IS NULL
+                AND spotify_url IS NOT NULL
+                AND id > %s
+            ORDER BY id
+            LIMIT %s
             """,
-            (user_id,),
+            (after_id, limit),
         )
-        subscriptions = cur.fetchall()
+        rows = cur.fetchall()
+        return [{"id": row[0], "spotify_url": row[1]} for row in rows]
+
+
+def get_artwork_rows(table, ids):
+    """Fetches the Spotify URL and stored artwork of several threads or comments.
+
+    Args
+    ------
+        table : str
+            "threads" or "t_comments".
+        ids : list of int
+            The IDs of the rows.
+
+    Returns
+    -------
+        list of dict
+            A list of dictionaries with the row's id, spotify_url and
+            album_image, for the IDs that exist.
+    """
+    if table not in ARTWORK_TABLES:
+        raise ValueError(f"Unknown artwork table: {table}")
+    if not ids:
+        return []
+
+    with get_cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT id, spotify_url, album_image
+            FROM {table}
+            WHERE id = ANY(%s)
+            """,
+            (list(ids),),
+        )
+        rows = cur.fetchall()
         return [
-            {
-                "id": row[0],
-                "title": row[1],
-                "description": row[2],
-                "spotify_url": row[3],
-                "created_at": row[4],
-                "username": row[5],
-            }
-            for row in subscriptions
+            {"id": row[0], "spotify_url": row[1], "album_image": row[2]} for row in rows
         ]
-    except Exception as e:
-        print(f"Error fetching threads by user subscriptions: {e}")
-        return []
-    finally:
-        cur.close()
-        conn.close()
+
+
+def update_artwork(table, rows):
+    """Stores resolved artwork for several threads or comments in one statement.
+
+    Args
+    ------
+        table : str
+            "threads" or "t_comments".
+        rows : list of dict
+            Dictionaries with id, spotify_type, spotify_id and album_image.
+
+    Returns
+    -------
+        int
+            The number of rows updated.
+    """
+    if table not in ARTWORK_TABLES:
+        raise ValueError(f"Unknown artwork table: {table}")
+    if not rows:
+        return 0
+
+    with get_cursor() as cur:
+        execute_values(
+            cur,
+            f"""
+            UPDATE {table}
+            SET
+                spotify_type = v.spotify_type,
+                spotify_id = v.spotify_id,
+                album_image = v.album_image
+            FROM (VALUES %s) AS v (id, spotify_type, spotify_id, album_image)
+            WHERE {table}.id = v.id
+            """,
+            [
+                (row["id"], row["spotify_type"], row["spotify_id"], row["album_image"])
+                for row in rows
+            ],
+            page_size=len(rows),
+        )
+        return cur.rowcount
@@ -0,0 +1,129 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+from flask import has_request_context, request
+
+# Default share of high-frequency events that is logged. Pass
+# extra={"sample_rate": ...} to log an event at a different rate.
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# Attributes every LogRecord has; anything else was passed through extra
+# and ends up as a field of the JSON line.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener = None
+_queue_handler = None
+_configure_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as single-line JSON objects."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread without ever blocking the caller.
+
+    Records are sampled and enriched with the current request on the
+    calling thread. When the queue is full because the output cannot keep
+    up, records are dropped and counted instead of stalling the request.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def filter(self, record):
+        sample_rate = getattr(record, "sample_rate", None)
+        if sample_rate is not None and random.random() >= sample_rate:
+            return False
+        return super().filter(record)
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if has_request_context() and not hasattr(record, "path"):
+            record.method = request.method
+            record.path = request.path
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _start_listener():
+    global _listener
+
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def configure_logging():
+    """Sends all logging through a background thread as JSON lines on stdout.
+
+    Modules log through their own logging.getLogger(__name__). Writing to
+    stdout happens on a separate thread, so a slow log pipeline never holds
+    up a request. Safe to call more than once; after a fork the child
+    starts its own writer thread.
+
+    Enivronment variables:
+        LOG_LEVEL: Lowest level that is logged (default INFO).
+        LOG_SAMPLE_RATE: Share of sampled high-frequency events that is
+            logged (default 0.01).
+        LOG_QUEUE_SIZE: Records buffered before new ones are dropped
+            (default 10000).
+    """
+    global _queue_handler
+
+    with _configure_lock:
+        if _queue_handler is not None:
+            return
+
+        _queue_handler = _NonBlockingQueueHandler(None)
+        _start_listener()
+
+        root = logging.getLogger()
+        root.handlers = [_queue_handler]
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+        atexit.register(_stop_listener)
+        os.register_at_fork(after_in_child=_start_listener)
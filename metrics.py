@@ -0,0 +1,264 @@
+import contextvars
+import hmac
+import os
+import sys
+import threading
+import time
+
+import psycopg2.extensions
+from flask import Response, abort, g, request
+
+import db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    """Thread-safe Prometheus histogram with labels.
+
+    Args
+    -------
+        name : str
+            The metric name.
+        help_text : str
+            The metric description shown by Prometheus.
+        labels : tuple of str
+            The label names, in the order values are passed to observe.
+        buckets : tuple of float
+            Upper bounds of the buckets, in increasing order.
+    """
+
+    def __init__(self, name, help_text, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Records one observation for the given label values."""
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        """Returns the histogram in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = sorted(
+                (label_values, list(counts), total, count)
+                for label_values, (counts, total, count) in self._series.items()
+            )
+
+        for label_values, counts, total, count in series:
+            labels = ",".join(
+                f'{name}="{_escape(value)}"'
+                for name, value in zip(self.labels, label_values)
+            )
+            prefix = f"{labels}," if labels else ""
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(
+                    f'{self.name}_bucket{{{prefix}le="{bound}"}} {bucket_count}'
+                )
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_DURATION = Histogram(
+    "tunelink_http_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    ("endpoint", "method", "status"),
+)
+DB_QUERY_DURATION = Histogram(
+    "tunelink_db_query_duration_seconds",
+    "Time spent executing database statements, by db.py function.",
+    ("function",),
+)
+SPOTIFY_REQUEST_DURATION = Histogram(
+    "tunelink_spotify_request_duration_seconds",
+    "Time spent on Spotify API requests, rate limiter waits included.",
+    ("endpoint", "status"),
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "tunelink_db_queries_per_request",
+    "Database statements executed per HTTP request.",
+    ("endpoint",),
+    buckets=COUNT_BUCKETS,
+)
+SPOTIFY_CALLS_PER_REQUEST = Histogram(
+    "tunelink_spotify_calls_per_request",
+    "Spotify API requests made per HTTP request.",
+    ("endpoint",),
+    buckets=COUNT_BUCKETS,
+)
+
+HISTOGRAMS = (
+    REQUEST_DURATION,
+    DB_QUERY_DURATION,
+    SPOTIFY_REQUEST_DURATION,
+    DB_QUERIES_PER_REQUEST,
+    SPOTIFY_CALLS_PER_REQUEST,
+)
+
+
+class RequestStats:
+    """Database and Spotify work done on behalf of one HTTP request."""
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.spotify_calls = 0
+        self.spotify_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.db_queries += 1
+            self.db_seconds += seconds
+
+    def add_spotify_call(self, seconds):
+        with self._lock:
+            self.spotify_calls += 1
+            self.spotify_seconds += seconds
+
+
+def propagate_context(fn):
+    """Wraps fn so it runs with the caller's request stats on another thread.
+
+    Work submitted to a thread pool is otherwise not counted towards the
+    request that submitted it.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+
+    return run
+
+
+def _db_caller():
+    # Walks up past this module, psycopg2 and cursor methods (such as the
+    # observed cursor's execute) to the function that ran the statement.
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if (
+            module == __name__
+            or module.startswith("psycopg2")
+            or isinstance(frame.f_locals.get("self"), psycopg2.extensions.cursor)
+        ):
+            frame = frame.f_back
+            continue
+        if module == "db":
+            return frame.f_code.co_name
+        return f"{module}.{frame.f_code.co_name}"
+    return "other"
+
+
+def observe_query(query, seconds):
+    """Query listener that records every executed statement."""
+    DB_QUERY_DURATION.observe(seconds, _db_caller())
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.add_query(seconds)
+
+
+def observe_spotify_call(endpoint, status, seconds):
+    """Records one Spotify API request.
+
+    Args
+    -------
+        endpoint : str
+            The API path with IDs replaced, e.g. "tracks" or "albums/{id}".
+        status : int
+            The response status, or 0 if no response was received.
+        seconds : float
+            How long the request took.
+    """
+    SPOTIFY_REQUEST_DURATION.observe(seconds, endpoint, status)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.add_spotify_call(seconds)
+
+
+def _start_request():
+    g.metrics_started_at = time.perf_counter()
+    _request_stats.set(RequestStats())
+
+
+def _finish_request(response):
+    stats = _request_stats.get()
+    started_at = g.pop("metrics_started_at", None)
+    if stats is None or started_at is None:
+        return response
+
+    elapsed = time.perf_counter() - started_at
+    endpoint = request.endpoint or "unmatched"
+    REQUEST_DURATION.observe(elapsed, endpoint, request.method, response.status_code)
+    DB_QUERIES_PER_REQUEST.observe(stats.db_queries, endpoint)
+    SPOTIFY_CALLS_PER_REQUEST.observe(stats.spotify_calls, endpoint)
+
+    response.headers["Server-Timing"] = (
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.db_queries} queries", '
+        f"spotify;dur={stats.spotify_seconds * 1000:.1f};"
+        f'desc="{stats.spotify_calls} calls", '
+        f"total;dur={elapsed * 1000:.1f}"
+    )
+    return response
+
+
+def _reset_request(exc):
+    _request_stats.set(None)
+
+
+def render_metrics():
+    """Returns every metric in the Prometheus text exposition format."""
+    return "\n".join(histogram.render() for histogram in HISTOGRAMS) + "\n"
+
+
+def init_app(app):
+    """Instruments a Flask app and adds the /metrics endpoint.
+
+    Every response gets a Server-Timing header with the time spent in the
+    database, at Spotify and in total. /metrics serves this process's
+    counters and histograms to Prometheus; when METRICS_TOKEN is set it
+    must be sent as a bearer token.
+
+    Args
+    -------
+        app : flask.Flask
+            The app to instrument.
+    """
+    db.add_query_listener(observe_query)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_reset_request)
+
+    @app.route("/metrics")
+    def metrics():
+        token = os.getenv("METRICS_TOKEN")
+        if token and not hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            abort(401)
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,157 @@
+import os
+import re
+
+import click
+from dotenv import load_dotenv
+
+from db import get_connection
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Arbitrary key for pg_advisory_xact_lock, so that two processes starting at
+# the same time never apply the same migration twice.
+MIGRATIONS_LOCK_KEY = 4_151_712
+
+_MIGRATION_FILENAME = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+
+def get_migrations():
+    """Lists the migration files checked into the migrations directory.
+
+    Migration files are named NNNN_description.sql and are applied in the
+    order of their number.
+
+    Returns
+    -------
+        list of tuple
+            (version, name, path) for every migration, ordered by version.
+    """
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = _MIGRATION_FILENAME.match(filename)
+        if match is None:
+            continue
+        migrations.append(
+            (
+                int(match.group(1)),
+                match.group(2),
+                os.path.join(MIGRATIONS_DIR, filename),
+            )
+        )
+    return sorted(migrations)
+
+
+def _ensure_migrations_table(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+
+
+def get_applied_versions():
+    """Fetches the versions of the migrations already applied to the database.
+
+    Returns
+    -------
+        set of int
+            The applied migration versions.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            _ensure_migrations_table(cur)
+            cur.execute("SELECT version FROM schema_migrations")
+            return {row[0] for row in cur.fetchall()}
+
+
+def apply_migration(version, name, path):
+    """Applies a single migration and records it, in one transaction.
+
+    Args
+    -------
+        version : int
+            The migration number.
+        name : str
+            The migration description from its filename.
+        path : str
+            Path to the migration's SQL file.
+
+    Returns
+    -------
+        bool
+            True if the migration was applied, False if another process
+            applied it first.
+    """
+    with open(path, encoding="utf-8") as f:
+        sql = f.read()
+
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+            _ensure_migrations_table(cur)
+            cur.execute(
+                "SELECT 1 FROM schema_migrations WHERE version = %s", (version,)
+            )
+            if cur.fetchone() is not None:
+                return False
+
+            cur.execute(sql)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (version, name),
+            )
+            return True
+
+
+def run_migrations(on_applied=None):
+    """Applies every pending migration in order.
+
+    Each migration runs in its own transaction, so a failing migration
+    leaves the ones before it applied and can be fixed and re-run.
+
+    Args
+    -------
+        on_applied : callable
+            Called with the filename of each migration once it is applied.
+
+    Returns
+    -------
+        list of str
+            The filenames of the migrations that were applied.
+    """
+    applied = get_applied_versions()
+    newly_applied = []
+    for version, name, path in get_migrations():
+        if version in applied:
+            continue
+        if apply_migration(version, name, path):
+            filename = os.path.basename(path)
+            newly_applied.append(filename)
+            if on_applied is not None:
+                on_applied(filename)
+    return newly_applied
+
+
+@click.command("migrate")
+@click.option("--status", is_flag=True, help="List migrations without applying.")
+def migrate_command(status):
+    """Brings the database schema up to date."""
+    if status:
+        applied = get_applied_versions()
+        for version, _, path in get_migrations():
+            state = "applied" if version in applied else "pending"
+            click.echo(f"{state:8} {os.path.basename(path)}")
+        return
+
+    newly_applied = run_migrations(on_applied=lambda f: click.echo(f"Applied {f}"))
+    if not newly_applied:
+        click.echo("Database schema is up to date.")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    migrate_command()
@@ -0,0 +1,54 @@
+-- Base schema. Every statement is guarded with IF NOT EXISTS so this
+-- migration can be recorded against databases that were created by hand.
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    spotify_id TEXT NOT NULL UNIQUE,
+    username TEXT,
+    bio TEXT,
+    spotify_url TEXT,
+    role TEXT NOT NULL DEFAULT 'user',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS forums (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    description TEXT,
+    creator_id INTEGER REFERENCES users (id),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS threads (
+    id SERIAL PRIMARY KEY,
+    forum_id INTEGER NOT NULL REFERENCES forums (id) ON DELETE CASCADE,
+    creator_id INTEGER NOT NULL REFERENCES users (id),
+    title TEXT NOT NULL,
+    spotify_url TEXT,
+    description TEXT,
+    is_pinned BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS t_comments (
+    id SERIAL PRIMARY KEY,
+    thread_id INTEGER NOT NULL REFERENCES threads (id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    description TEXT,
+    spotify_url TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS likes (
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    thread_id INTEGER NOT NULL REFERENCES threads (id) ON DELETE CASCADE,
+    vote SMALLINT NOT NULL CHECK (vote IN (-1, 1)),
+    PRIMARY KEY (user_id, thread_id)
+);
+
+CREATE TABLE IF NOT EXISTS subforum_subscriptions (
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    forum_id INTEGER NOT NULL REFERENCES forums (id) ON DELETE CASCADE,
+    PRIMARY KEY (user_id, forum_id)
+);
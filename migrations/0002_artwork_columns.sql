@@ -0,0 +1,12 @@
+-- Resolved Spotify artwork stored with threads and comments, filled in on
+-- write and by `flask backfill-artwork` for older rows.
+
+ALTER TABLE threads
+    ADD COLUMN IF NOT EXISTS spotify_type TEXT,
+    ADD COLUMN IF NOT EXISTS spotify_id TEXT,
+    ADD COLUMN IF NOT EXISTS album_image TEXT;
+
+ALTER TABLE t_comments
+    ADD COLUMN IF NOT EXISTS spotify_type TEXT,
+    ADD COLUMN IF NOT EXISTS spotify_id TEXT,
+    ADD COLUMN IF NOT EXISTS album_image TEXT;
@@ -0,0 +1,30 @@
+-- Indexes backing the queries in db.py.
+
+-- Thread lists are paginated by (created_at, id), newest first, either for
+-- one forum, for the forums a user subscribes to or across the whole site.
+CREATE INDEX IF NOT EXISTS threads_forum_id_created_at_idx
+    ON threads (forum_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS threads_created_at_idx
+    ON threads (created_at DESC, id DESC);
+
+-- Vote totals per thread. The primary key starts with user_id, so it does
+-- not help lookups by thread.
+CREATE INDEX IF NOT EXISTS likes_thread_id_idx
+    ON likes (thread_id);
+
+-- Comments of a thread in the order they were posted, paginated by
+-- (created_at, id).
+CREATE INDEX IF NOT EXISTS t_comments_thread_id_created_at_idx
+    ON t_comments (thread_id, created_at, id);
+
+-- The primary key (user_id, forum_id) covers a user's subscriptions; this
+-- covers the subscribers of a forum, used when a forum is deleted and when
+-- joining subscriptions to threads.
+CREATE INDEX IF NOT EXISTS subforum_subscriptions_forum_id_idx
+    ON subforum_subscriptions (forum_id, user_id);
+
+-- Backfill of rows without artwork walks the table by id.
+CREATE INDEX IF NOT EXISTS threads_missing_artwork_idx
+    ON threads (id) WHERE album_image IS NULL;
+CREATE INDEX IF NOT EXISTS t_comments_missing_artwork_idx
+    ON t_comments (id) WHERE album_image IS NULL;
@@ -0,0 +1,119 @@
+-- Like and dislike totals kept on the thread row, so reading them no longer
+-- scans every vote of the thread.
+
+ALTER TABLE threads
+    ADD COLUMN IF NOT EXISTS like_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS dislike_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE threads
+SET
+    like_count = totals.likes,
+    dislike_count = totals.dislikes
+FROM (
+    SELECT
+        thread_id,
+        COUNT(*) FILTER (WHERE vote = 1) AS likes,
+        COUNT(*) FILTER (WHERE vote = -1) AS dislikes
+    FROM likes
+    GROUP BY thread_id
+) AS totals
+WHERE threads.id = totals.thread_id;
+
+-- Statement level triggers apply the net change of a whole statement with
+-- one UPDATE per affected thread, which keeps bulk vote writes cheap.
+CREATE OR REPLACE FUNCTION likes_update_thread_counts() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE threads
+        SET
+            like_count = like_count + delta.likes,
+            dislike_count = dislike_count + delta.dislikes
+        FROM (
+            SELECT
+                thread_id,
+                COUNT(*) FILTER (WHERE vote = 1) AS likes,
+                COUNT(*) FILTER (WHERE vote = -1) AS dislikes
+            FROM new_votes
+            GROUP BY thread_id
+        ) AS delta
+        WHERE threads.id = delta.thread_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE threads
+        SET
+            like_count = like_count - delta.likes,
+            dislike_count = dislike_count - delta.dislikes
+        FROM (
+            SELECT
+                thread_id,
+                COUNT(*) FILTER (WHERE vote = 1) AS likes,
+                COUNT(*) FILTER (WHERE vote = -1) AS dislikes
+            FROM old_votes
+            GROUP BY thread_id
+        ) AS delta
+        WHERE threads.id = delta.thread_id;
+    ELSE
+        UPDATE threads
+        SET
+            like_count = like_count + delta.likes,
+            dislike_count = dislike_count + delta.dislikes
+        FROM (
+            SELECT
+                thread_id,
+                COALESCE(SUM(sign) FILTER (WHERE vote = 1), 0) AS likes,
+                COALESCE(SUM(sign) FILTER (WHERE vote = -1), 0) AS dislikes
+            FROM (
+                SELECT thread_id, vote, 1 AS sign FROM new_votes
+                UNION ALL
+                SELECT thread_id, vote, -1 AS sign FROM old_votes
+            ) AS changes
+            GROUP BY thread_id
+        ) AS delta
+        WHERE threads.id = delta.thread_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS likes_counts_insert ON likes;
+CREATE TRIGGER likes_counts_insert
+    AFTER INSERT ON likes
+    REFERENCING NEW TABLE AS new_votes
+    FOR EACH STATEMENT EXECUTE FUNCTION likes_update_thread_counts();
+
+DROP TRIGGER IF EXISTS likes_counts_update ON likes;
+CREATE TRIGGER likes_counts_update
+    AFTER UPDATE ON likes
+    REFERENCING OLD TABLE AS old_votes NEW TABLE AS new_votes
+    FOR EACH STATEMENT EXECUTE FUNCTION likes_update_thread_counts();
+
+DROP TRIGGER IF EXISTS likes_counts_delete ON likes;
+CREATE TRIGGER likes_counts_delete
+    AFTER DELETE ON likes
+    REFERENCING OLD TABLE AS old_votes
+    FOR EACH STATEMENT EXECUTE FUNCTION likes_update_thread_counts();
+
+-- Toggles a user's vote and returns the thread's new totals, so voting is a
+-- single round trip. Voting the same way twice removes the vote; voting the
+-- other way replaces it.
+CREATE OR REPLACE FUNCTION toggle_thread_vote(
+    p_user_id INTEGER,
+    p_thread_id INTEGER,
+    p_vote SMALLINT
+) RETURNS TABLE (likes INTEGER, dislikes INTEGER) AS $$
+BEGIN
+    DELETE FROM likes
+    WHERE user_id = p_user_id AND thread_id = p_thread_id AND vote = p_vote;
+
+    IF NOT FOUND THEN
+        INSERT INTO likes (user_id, thread_id, vote)
+        VALUES (p_user_id, p_thread_id, p_vote)
+        ON CONFLICT (user_id, thread_id)
+        DO UPDATE SET vote = EXCLUDED.vote;
+    END IF;
+
+    RETURN QUERY
+        SELECT threads.like_count, threads.dislike_count
+        FROM threads
+        WHERE threads.id = p_thread_id;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,22 @@
+-- Full-text search over threads and comments. The search vectors are
+-- generated columns, so Postgres keeps them current on every write. The
+-- 'simple' configuration does no stemming, which suits the mix of Swedish,
+-- English and artist names posted on the site.
+
+ALTER TABLE threads
+    ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', COALESCE(title, '')), 'A')
+        || setweight(to_tsvector('simple', COALESCE(description, '')), 'B')
+    ) STORED;
+
+ALTER TABLE t_comments
+    ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (
+        to_tsvector('simple', COALESCE(description, ''))
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS threads_search_vector_idx
+    ON threads USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS t_comments_search_vector_idx
+    ON t_comments USING GIN (search_vector);
@@ -0,0 +1,29 @@
+-- Materialized dashboard feed. New threads are copied into the feed of every
+-- subscriber when they are posted (fan-out on write), so the dashboard reads
+-- a pre-sorted index range instead of joining subscriptions to threads.
+
+CREATE TABLE IF NOT EXISTS home_feed (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    thread_id INTEGER NOT NULL REFERENCES threads (id) ON DELETE CASCADE,
+    forum_id INTEGER NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (user_id, thread_id)
+);
+
+CREATE INDEX IF NOT EXISTS home_feed_user_id_created_at_idx
+    ON home_feed (user_id, created_at DESC, thread_id DESC);
+CREATE INDEX IF NOT EXISTS home_feed_thread_id_idx
+    ON home_feed (thread_id);
+
+-- Forums with too many subscribers to copy every thread to are read from
+-- threads directly instead (fan-out on read). The flag is set by the app
+-- when a thread is posted and never cleared, so a feed never misses threads
+-- that were written while the forum was in either mode.
+ALTER TABLE forums
+    ADD COLUMN IF NOT EXISTS fanout_on_read BOOLEAN NOT NULL DEFAULT FALSE;
+
+INSERT INTO home_feed (user_id, thread_id, forum_id, created_at)
+SELECT ss.user_id, threads.id, threads.forum_id, threads.created_at
+FROM subforum_subscriptions ss
+JOIN threads ON threads.forum_id = ss.forum_id
+ON CONFLICT DO NOTHING;
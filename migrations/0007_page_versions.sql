@@ -0,0 +1,58 @@
+-- Version timestamps used as HTTP validators (ETag / Last-Modified), so an
+-- unchanged page can be answered with 304 Not Modified before it is built.
+-- clock_timestamp() rather than NOW() so that changes made later in a long
+-- transaction still move the version forward.
+
+ALTER TABLE forums
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at = clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Any change to a thread row, including the vote counters kept current by
+-- the likes triggers, bumps the thread.
+DROP TRIGGER IF EXISTS threads_touch_updated_at ON threads;
+CREATE TRIGGER threads_touch_updated_at
+    BEFORE UPDATE ON threads
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+DROP TRIGGER IF EXISTS forums_touch_updated_at ON forums;
+CREATE TRIGGER forums_touch_updated_at
+    BEFORE UPDATE ON forums
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+-- Comments are part of the thread page.
+CREATE OR REPLACE FUNCTION t_comments_touch_thread() RETURNS trigger AS $$
+BEGIN
+    UPDATE threads
+    SET updated_at = clock_timestamp()
+    WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.thread_id ELSE NEW.thread_id END;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS t_comments_touch_thread ON t_comments;
+CREATE TRIGGER t_comments_touch_thread
+    AFTER INSERT OR UPDATE OR DELETE ON t_comments
+    FOR EACH ROW EXECUTE FUNCTION t_comments_touch_thread();
+
+-- Thread cards are part of the forum's lists. Only the columns shown on a
+-- card count, so votes do not contend on the forum row.
+CREATE OR REPLACE FUNCTION threads_touch_forum() RETURNS trigger AS $$
+BEGIN
+    UPDATE forums
+    SET updated_at = clock_timestamp()
+    WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.forum_id ELSE NEW.forum_id END;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS threads_touch_forum ON threads;
+CREATE TRIGGER threads_touch_forum
+    AFTER INSERT OR DELETE OR UPDATE OF title, description, spotify_url, album_image
+    ON threads
+    FOR EACH ROW EXECUTE FUNCTION threads_touch_forum();
@@ -0,0 +1,15 @@
+-- Last known Spotify profile of every user. Top tracks and artists change
+-- over weeks, so /profile is served from here and refreshed in the
+-- background once the snapshot is older than PROFILE_SNAPSHOT_MAX_AGE.
+-- Storing them also lets anyone view a profile without the owner's token.
+
+CREATE TABLE IF NOT EXISTS profile_snapshots (
+    user_id INTEGER PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+    -- display_name and images from the Spotify user object
+    spotify_user JSONB NOT NULL,
+    top_tracks JSONB NOT NULL,
+    top_artists JSONB NOT NULL,
+    -- genre -> weight, higher ranked artists counting more
+    genre_histogram JSONB NOT NULL,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
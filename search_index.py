@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _trigrams(text):
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class ForumNameIndex:
+    """In-memory substring index over forum names, used for autocomplete.
+
+    Every lowercased name is split into trigrams, and each trigram maps to
+    the forums whose name contains it. A query is answered by intersecting
+    the forums of its trigrams and checking the few candidates left, so no
+    database round trip is needed.
+
+    The index is loaded on first use and reloaded once it is older than ttl,
+    which picks up forums created or deleted by other processes. Changes made
+    by this process are applied right away with add and remove.
+
+    Args
+    -------
+        loader : callable
+            Returns every forum as a dict with id, name and description.
+        ttl : float
+            Number of seconds before the index is reloaded.
+    """
+
+    def __init__(self, loader, ttl=60):
+        self.loader = loader
+        self.ttl = ttl
+        self._forums = {}
+        self._postings = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def _reload_if_stale(self):
+        if self._loaded_at is not None and (
+            time.monotonic() - self._loaded_at < self.ttl
+        ):
+            return
+
+        # Only one thread reloads; the others keep answering from the
+        # current index unless there is none yet.
+        blocking = self._loaded_at is None
+        if not self._reload_lock.acquire(blocking=blocking):
+            return
+        try:
+            if self._loaded_at is not None and (
+                time.monotonic() - self._loaded_at < self.ttl
+            ):
+                return
+            try:
+                forums = self.loader()
+            except Exception:
+                if self._loaded_at is None:
+                    raise
+                logger.exception(
+                    "Error reloading forum name index, keeping the old one"
+                )
+                self._loaded_at = time.monotonic()
+                return
+
+            by_id = {}
+            postings = {}
+            for forum in forums:
+                by_id[forum["id"]] = forum
+                for trigram in _trigrams(forum["name"].lower()):
+                    postings.setdefault(trigram, set()).add(forum["id"])
+
+            with self._lock:
+                self._forums = by_id
+                self._postings = postings
+                self._loaded_at = time.monotonic()
+        finally:
+            self._reload_lock.release()
+
+    def search(self, query, limit=10):
+        """Finds forums whose name contains query, ignoring case.
+
+        Args
+        -------
+            query : str
+                The text to look for.
+            limit : int
+                The maximum number of forums to return.
+
+        Returns
+        -------
+            list of dict
+                Matching forums with id, name and description. Names that
+                start with the query come first, then by name.
+        """
+        self._reload_if_stale()
+        needle = query.lower()
+
+        with self._lock:
+            if len(needle) < 3:
+                candidates = self._forums.values()
+            else:
+                postings = [self._postings.get(t) for t in _trigrams(needle)]
+                if not all(postings):
+                    return []
+                ids = set.intersection(*sorted(postings, key=len))
+                candidates = [self._forums[forum_id] for forum_id in ids]
+
+            matches = [forum for forum in candidates if needle in forum["name"].lower()]
+
+        matches.sort(
+            key=lambda forum: (
+                not forum["name"].lower().startswith(needle),
+                forum["name"],
+            )
+        )
+        return [dict(forum) for forum in matches[:limit]]
+
+    def add(self, forum):
+        """Adds or replaces a forum in the index.
+
+        Args
+        -------
+            forum : dict
+                The forum's id, name and description.
+        """
+        with self._lock:
+            self._remove(forum["id"])
+            self._forums[forum["id"]] = forum
+            for trigram in _trigrams(forum["name"].lower()):
+                self._postings.setdefault(trigram, set()).add(forum["id"])
+
+    def remove(self, forum_id):
+        """Removes a forum from the index if present.
+
+        Args
+        -------
+            forum_id : int
+                The ID of the forum.
+        """
+        with self._lock:
+            self._remove(forum_id)
+
+    def _remove(self, forum_id):
+        forum = self._forums.pop(forum_id, None)
+        if forum is None:
+            return
+        for trigram in _trigrams(forum["name"].lower()):
+            ids = self._postings.get(trigram)
+            if ids is not None:
+                ids.discard(forum_id)
+                if not ids:
+                    del self._postings[trigram]
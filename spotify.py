@@ -1,48 +1,559 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import redis
+import requests
 from spotipy import Spotify
+from spotipy.exceptions import SpotifyException
+
+import metrics
+from cache import TwoTierCache, get_redis, mark_redis_down
+from db import (
+    get_profile_snapshot,
+    get_threads_by_user_subscriptions,
+    get_user_profile_db,
+    save_profile_snapshot,
+)
+from logs import LOG_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_IMAGE = "/static/tunelink.png"
+
+ALBUM_IMAGE_NEGATIVE_TTL = int(os.getenv("ALBUM_IMAGE_NEGATIVE_TTL", "3600"))
+
+TRACKS_BATCH_SIZE = 50
+ALBUMS_BATCH_SIZE = 20
+
+SPOTIFY_HTTP_POOL_SIZE = int(os.getenv("SPOTIFY_HTTP_POOL_SIZE", "20"))
+
+# Seconds a profile snapshot is served before it is refreshed from Spotify.
+PROFILE_SNAPSHOT_MAX_AGE = int(os.getenv("PROFILE_SNAPSHOT_MAX_AGE", "86400"))
+
+# Base URL of the Web API; point it at a fake server to test against 429s.
+SPOTIFY_API_PREFIX = os.getenv("SPOTIFY_API_PREFIX", "https://api.spotify.com/v1/")
 
-from db import get_threads_by_user_subscriptions, get_user_profile_db
+# Outbound requests per second (and burst size) allowed per process.
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", "10"))
+SPOTIFY_RATE_BURST = int(os.getenv("SPOTIFY_RATE_BURST", "20"))
+# Longest a request waits for the rate limiter or a Retry-After before the
+# caller gets a 429 and falls back to its default.
+SPOTIFY_MAX_WAIT = float(os.getenv("SPOTIFY_MAX_WAIT", "5"))
+# Longest a profile page waits for Spotify when the user has no snapshot yet.
+PROFILE_REFRESH_TIMEOUT = float(os.getenv("PROFILE_REFRESH_TIMEOUT", "10"))
 
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
 
-def get_user_profile(access_token: str, user_id: str):
-    """Fetches the user profile, top tracks, top artists and top genres from Spotify.
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SPOTIFY_WORKERS", "8")),
+    thread_name_prefix="spotify",
+)
+
+_user_cache = TwoTierCache(
+    "spotify_user",
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=int(os.getenv("USER_CACHE_TTL", "60")),
+)
+
+_album_image_cache = TwoTierCache(
+    "album_image",
+    maxsize=int(os.getenv("ALBUM_IMAGE_CACHE_SIZE", "10000")),
+    ttl=int(os.getenv("ALBUM_IMAGE_CACHE_TTL", str(7 * 24 * 3600))),
+)
+
+
+class RateLimiter:
+    """Token bucket that paces outbound Spotify requests.
+
+    Tokens refill at rate per second up to burst. When Spotify answers 429
+    the bucket is emptied and closed for the Retry-After period. With
+    REDIS_URL set the bucket and the closure live in Redis, so rate and
+    burst are the budget of all workers together; without Redis, or while
+    it is unavailable, every process has a bucket of its own.
+
+    Args
+    -------
+        rate : float
+            Requests per second. Must be positive.
+        burst : int
+            The most requests that can be made at once after a quiet period.
+            Must be at least 1.
+    """
+
+    REDIS_KEY = "tunelink:spotify:retry_after"
+    BUCKET_KEY = "tunelink:spotify:bucket"
+
+    # Takes a token from the shared bucket. Returns 0 if one was taken,
+    # otherwise the milliseconds until the next one or until a Retry-After
+    # closure ends.
+    _TAKE_SCRIPT = """
+local blocked_ms = redis.call("PTTL", KEYS[2])
+if blocked_ms > 0 then
+    return blocked_ms
+end
+
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - updated_at, 0) * rate / 1000)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+    def __init__(self, rate, burst):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+        if burst < 1:
+            raise ValueError(f"Burst must be at least 1, got {burst}")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._take_script = None
+        self._lock = threading.Lock()
+
+    def _take_shared(self):
+        # Seconds to wait before trying again, 0 if a token was taken, or
+        # None if Redis is not available.
+        client = get_redis()
+        if client is None:
+            return None
+        if self._take_script is None:
+            self._take_script = client.register_script(self._TAKE_SCRIPT)
+        try:
+            wait_ms = self._take_script(
+                keys=[self.BUCKET_KEY, self.REDIS_KEY],
+                args=[self.rate, self.burst],
+                client=client,
+            )
+        except redis.RedisError as e:
+            mark_redis_down(e)
+            return None
+        return wait_ms / 1000
+
+    def _take_local(self, now):
+        with self._lock:
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout):
+        """Takes one request slot, waiting for it up to timeout seconds.
+
+        Returns
+        -------
+            bool
+                True if a slot was taken, False if none was free in time.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                wait = self._blocked_until - now
+            if wait <= 0:
+                wait = self._take_shared()
+                if wait is None:
+                    wait = self._take_local(now)
+                if wait == 0:
+                    return True
+
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def block(self, seconds):
+        """Stops handing out slots for the given number of seconds."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, now + seconds)
+
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            client.set(self.REDIS_KEY, 1, px=max(int(seconds * 1000), 1))
+        except redis.RedisError as e:
+            mark_redis_down(e)
+
+
+_rate_limiter = RateLimiter(SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_BURST)
+
+
+def _parse_retry_after(value):
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def _endpoint_label(url):
+    """Turns a Web API URL into a metrics label, e.g. "tracks" or "albums/{id}"."""
+    path = url[len(SPOTIFY_API_PREFIX) :].split("?", 1)[0].strip("/")
+    return "/".join(
+        "{id}" if len(part) == 22 and part.isalnum() else part
+        for part in path.split("/")
+    )
+
+
+class _SharedSession(requests.Session):
+    """HTTP session shared by every Spotify client in the process.
+
+    Every Web API request is scheduled through the rate limiter. A 429 closes
+    the limiter for its Retry-After period and the request is retried once it
+    reopens, as long as that happens within SPOTIFY_MAX_WAIT seconds;
+    otherwise the 429 is returned and spotipy raises it as usual.
+
+    spotipy closes a client's session when the client is garbage collected.
+    For the shared session that would drop the pooled keep-alive connections
+    after every request, so closing it is a no-op.
+    """
+
+    def request(self, method, url, *args, **kwargs):
+        if not url.startswith(SPOTIFY_API_PREFIX):
+            return super().request(method, url, *args, **kwargs)
+
+        started_at = time.perf_counter()
+        status = 0
+        try:
+            response = self._scheduled_request(method, url, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            metrics.observe_spotify_call(
+                _endpoint_label(url), status, time.perf_counter() - started_at
+            )
+
+    def _scheduled_request(self, method, url, *args, **kwargs):
+        deadline = time.monotonic() + SPOTIFY_MAX_WAIT
+        while True:
+            if not _rate_limiter.acquire(deadline - time.monotonic()):
+                raise requests.exceptions.RetryError(
+                    f"No Spotify request slot within {SPOTIFY_MAX_WAIT}s",
+                    request=requests.Request(method, url).prepare(),
+                )
+
+            response = super().request(method, url, *args, **kwargs)
+            if response.status_code != 429:
+                return response
+
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            # Every in-flight request sees the same 429, so sample the warning.
+            logger.warning(
+                "Spotify rate limited us, backing off %ss",
+                retry_after,
+                extra={"sample_rate": 0.1},
+            )
+            _rate_limiter.block(retry_after)
+            if time.monotonic() + retry_after > deadline:
+                return response
+
+    def close(self):
+        pass
+
+
+class SingleFlight:
+    """Lets concurrent callers that need the same keys share one lookup.
+
+    The first caller to claim a key fetches it; later callers get a Future
+    that completes when the first caller resolves the key.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def claim(self, keys):
+        """Claims the keys nobody is fetching yet.
+
+        Returns
+        -------
+            tuple
+                The keys this caller must fetch and then resolve, and a dict
+                of the other keys mapped to the Futures of their owners.
+        """
+        own = []
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                future = self._futures.get(key)
+                if future is None:
+                    self._futures[key] = Future()
+                    own.append(key)
+                else:
+                    waiting[key] = future
+        return own, waiting
+
+    def resolve(self, keys, results):
+        """Completes claimed keys, with None for keys missing from results."""
+        with self._lock:
+            futures = [self._futures.pop(key) for key in keys]
+        for key, future in zip(keys, futures):
+            future.set_result(results.get(key))
+
+
+_album_image_flight = SingleFlight()
+
+
+def get_http_session():
+    """Returns the process-wide keep-alive HTTP session for Spotify calls.
+
+    Connections (and their TLS handshakes) are reused across requests and
+    users instead of being set up for every new client. The session is
+    recreated after a fork so worker processes never share sockets.
+
+    Enivronment variables:
+        SPOTIFY_HTTP_POOL_SIZE: Connections kept open per host (default 20).
+
+    Returns
+    -------
+        requests.Session
+            The shared session, retrying like spotipy's own sessions do.
+    """
+    global _http_session, _http_session_pid
+
+    if _http_session is not None and _http_session_pid == os.getpid():
+        return _http_session
+
+    with _http_session_lock:
+        if _http_session is None or _http_session_pid != os.getpid():
+            retry = requests.adapters.Retry(
+                total=Spotify.max_retries,
+                connect=None,
+                read=False,
+                allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+                status=Spotify.max_retries,
+                backoff_factor=0.3,
+                # 429s are handled by _SharedSession and the rate limiter.
+                status_forcelist=[
+                    code for code in Spotify.default_retry_codes if code != 429
+                ],
+                respect_retry_after_header=False,
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=SPOTIFY_HTTP_POOL_SIZE,
+                max_retries=retry,
+            )
+            session = _SharedSession()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+            _http_session_pid = os.getpid()
+        return _http_session
+
+
+def get_spotify_client(access_token):
+    """Returns a Spotify client for a user's access token.
+
+    Clients are cheap to create because they all share one HTTP session.
 
     Args
     -------
         access_token : str
             The access token for Spotify API.
-        user_id : str
-            The ID of the user.
 
     Returns
     -------
-        dict
-            A dictionary containing the user profile, top tracks, top artists, top genres, user bio and Spotify URL.
+        spotipy.Spotify
+            A client authenticated as the user.
     """
+    client = Spotify(auth=access_token, requests_session=get_http_session())
+    client.prefix = SPOTIFY_API_PREFIX
+    return client
 
-    sp = Spotify(auth=access_token)
 
-    user = sp.current_user()
+_profile_refreshes = set()
+_profile_refreshes_lock = threading.Lock()
 
-    top_tracks = get_user_top_tracks(sp)
 
-    top_artists = get_user_top_artists(sp)
+def get_user_profile(access_token, user_id):
+    """Fetches a user's profile, top tracks, top artists and top genres.
 
-    top_genres = get_user_top_genres(sp)
+    The Spotify data is served from the user's stored profile snapshot. A
+    snapshot older than PROFILE_SNAPSHOT_MAX_AGE seconds is still served,
+    but refreshed in the background when an access token is given, so the
+    next view is up to date. Only a user without any snapshot waits for
+    Spotify.
 
-    user_profile_db_dict = get_user_profile_db(user_id)
+    Args
+    -------
+        access_token : str
+            The user's access token for Spotify API, or None when viewing
+            someone else's profile.
+        user_id : int
+            The ID of the user.
+
+    Returns
+    -------
+        dict
+            A dictionary containing the user profile, top tracks, top artists, top genres, genre histogram, user bio and Spotify URL.
+        None
+            If the user has no snapshot and none could be fetched from
+            Spotify, or no access token was given.
+    """
+    user_profile_db_future = _executor.submit(
+        metrics.propagate_context(get_user_profile_db), user_id
+    )
+
+    snapshot = get_profile_snapshot(user_id)
+    if snapshot is None:
+        if access_token is None:
+            return None
+        snapshot = refresh_profile_snapshot(access_token, user_id)
+        if snapshot is None:
+            return None
+    elif snapshot["age"] > PROFILE_SNAPSHOT_MAX_AGE and access_token is not None:
+        _refresh_profile_snapshot_in_background(access_token, user_id)
+
+    # Not bounded by the Spotify timeouts; the pool limits how long it waits.
+    user_profile_db_dict = user_profile_db_future.result()
     bio = user_profile_db_dict["bio"]
     spotify_url = user_profile_db_dict["spotify_url"]
 
+    histogram = snapshot["genre_histogram"]
     return {
-        "user": user,
-        "top_tracks": top_tracks,
-        "top_artists": top_artists,
-        "top_genres": top_genres,
+        "user": snapshot["spotify_user"],
+        "top_tracks": snapshot["top_tracks"],
+        "top_artists": snapshot["top_artists"],
+        "top_genres": get_user_top_genres(histogram),
+        "genre_histogram": histogram,
         "bio": bio,
         "spotify_url": spotify_url,
     }
 
 
+def refresh_profile_snapshot(access_token, user_id, concurrent=True):
+    """Fetches a user's profile from Spotify and stores it as their snapshot.
+
+    Args
+    -------
+        access_token : str
+            The user's access token for Spotify API.
+        user_id : int
+            The ID of the user.
+        concurrent : bool
+            Whether the three Spotify calls run concurrently on the executor.
+            Must be False when called from an executor thread, which would
+            otherwise wait on tasks queued behind itself.
+
+    Returns
+    -------
+        dict
+            The new snapshot, as returned by get_profile_snapshot.
+        None
+            If Spotify could not be reached within PROFILE_REFRESH_TIMEOUT
+            seconds or answered with an error.
+    """
+    sp = get_spotify_client(access_token)
+
+    try:
+        if concurrent:
+            user_future = _executor.submit(
+                metrics.propagate_context(get_cached_user), access_token, user_id
+            )
+            top_tracks_future = _executor.submit(
+                metrics.propagate_context(get_user_top_tracks), sp
+            )
+            top_artists_future = _executor.submit(
+                metrics.propagate_context(get_user_top_artists), sp
+            )
+            deadline = time.monotonic() + PROFILE_REFRESH_TIMEOUT
+            user = _wait_or_run(
+                user_future, deadline, get_cached_user, access_token, user_id
+            )
+            top_tracks = _wait_or_run(
+                top_tracks_future, deadline, get_user_top_tracks, sp
+            )
+            top_artists = _wait_or_run(
+                top_artists_future, deadline, get_user_top_artists, sp
+            )
+        else:
+            user = get_cached_user(access_token, user_id)
+            top_tracks = get_user_top_tracks(sp)
+            top_artists = get_user_top_artists(sp)
+    except FutureTimeoutError:
+        logger.warning("Timed out fetching the profile of user %s", user_id)
+        return None
+    except (SpotifyException, requests.RequestException) as e:
+        logger.warning("Error fetching the profile of user %s: %s", user_id, e)
+        return None
+
+    if not user:
+        return None
+
+    spotify_user = {
+        "display_name": user.get("display_name"),
+        "images": user.get("images") or [],
+    }
+    histogram = get_user_genre_histogram(top_artists)
+
+    save_profile_snapshot(user_id, spotify_user, top_tracks, top_artists, histogram)
+    return {
+        "spotify_user": spotify_user,
+        "top_tracks": top_tracks,
+        "top_artists": top_artists,
+        "genre_histogram": histogram,
+        "age": 0.0,
+    }
+
+
+def _wait_or_run(future, deadline, fn, *args):
+    # Waits for an executor task until the deadline. If every worker is busy
+    # and the task has not started yet, it is taken back and run on the
+    # calling thread instead of leaving the request hanging in the queue.
+    # A task still running at the deadline raises FutureTimeoutError.
+    try:
+        return future.result(timeout=max(deadline - time.monotonic(), 0))
+    except FutureTimeoutError:
+        if not future.cancel():
+            raise
+    return fn(*args)
+
+
+def _refresh_profile_snapshot_in_background(access_token, user_id):
+    # At most one refresh per user is queued in this process at a time.
+    with _profile_refreshes_lock:
+        if user_id in _profile_refreshes:
+            return
+        _profile_refreshes.add(user_id)
+
+    def refresh():
+        try:
+            refresh_profile_snapshot(access_token, user_id, concurrent=False)
+        except Exception:
+            logger.exception("Error refreshing profile snapshot of user %s", user_id)
+        finally:
+            with _profile_refreshes_lock:
+                _profile_refreshes.discard(user_id)
+
+    _executor.submit(refresh)
+
+
 def get_user_top_tracks(sp: Spotify):
     """Fetches the top tracks of the user from Spotify.
 
@@ -103,29 +614,49 @@ def get_user_top_artists(sp: Spotify):
     return top_artists
 
 
-def get_user_top_genres(sp: Spotify):
-    """Fetches the top genres of the user from Spotify.
+def get_user_genre_histogram(top_artists: list):
+    """Weighs the genres of the user's top artists.
+
+    Every genre of an artist gets the artist's weight, which is 5 for the
+    first of five top artists down to 1 for the last, and genres shared by
+    several artists add up.
 
     Args
     -------
-        sp : Spotify
-            The Spotify object to interact with the API.
+        top_artists : list
+            The top artists as returned by get_user_top_artists.
 
     Returns
     -------
-        top_genres : list
-            A list of the top genres of the user.
+        histogram : dict
+            The genres mapped to their total weight.
     """
-    top_artists_raw = sp.current_user_top_artists(limit=5, time_range="medium_term")[
-        "items"
-    ]
-    genre_list = []
+    histogram = {}
 
-    for artist in top_artists_raw:
-        genre_list.extend(artist["genres"])
+    for rank, artist in enumerate(top_artists):
+        if not isinstance(artist["genres"], list):
+            continue
+        weight = len(top_artists) - rank
+        for genre in artist["genres"]:
+            histogram[genre] = histogram.get(genre, 0) + weight
+
+    return histogram
 
-    top_genres = sorted(set(genre_list))[:5]
-    return top_genres
+
+def get_user_top_genres(histogram: dict):
+    """Picks the user's top genres from their genre histogram.
+
+    Args
+    -------
+        histogram : dict
+            The genres mapped to their weight, from get_user_genre_histogram.
+
+    Returns
+    -------
+        top_genres : list
+            The five heaviest genres, heaviest first.
+    """
+    return sorted(histogram, key=lambda genre: (-histogram[genre], genre))[:5]
 
 
 def get_user_profile_id_and_display_name(access_token):
@@ -139,7 +670,7 @@ def get_user_profile_id_and_display_name(access_token):
         dict
             A dictionary containing the Spotify ID and display name of the user.
     """
-    sp = Spotify(auth=access_token)
+    sp = get_spotify_client(access_token)
     profile = sp.current_user()
 
     spotify_id = profile["id"]
@@ -161,16 +692,74 @@ def get_user(access_token: str):
         user : dict
             A dictionary containing the user profile information.
     """
-    sp = Spotify(auth=access_token)
+    sp = get_spotify_client(access_token)
     user = sp.current_user()
 
     return user
 
 
+def get_cached_user(access_token: str, user_id):
+    """Fetches the user profile from Spotify, reusing recent lookups.
+
+    The profile is cached per user for USER_CACHE_TTL seconds (60 by
+    default), so a user clicking around the site costs one Spotify call per
+    minute instead of one per page.
+
+    Args
+    -------
+        access_token : str
+            The access token for Spotify API.
+        user_id : int
+            The ID of the user in the database, used as the cache key.
+
+    Returns
+    -------
+        user : dict
+            A dictionary containing the user profile information.
+    """
+    user = _user_cache.get(user_id)
+    if user is None:
+        user = get_user(access_token)
+        _user_cache.set(user_id, user)
+    return user
+
+
+def parse_spotify_url(spotify_url):
+    """Extracts the item type and ID from a Spotify track or album URL.
+
+    Args
+    -----
+        spotify_url : str
+            The Spotify URL (track or album).
+
+    Returns
+    ------
+        tuple
+            A (type, id) tuple where type is "track" or "album".
+        None
+            If the URL is not a track or album URL.
+    """
+    if not spotify_url:
+        return None
+
+    parts = spotify_url.split("/")
+    for spotify_type in ("track", "album"):
+        if spotify_type in parts:
+            spotify_id = parts[-1].split("?")[0]
+            if spotify_id:
+                return spotify_type, spotify_id
+    return None
+
+
 def get_album_image_url(spotify_url, sp):
     """
     Fetches the album image from a Spotify track or album URL.
 
+    Results are cached per track/album ID, first in process and then in Redis
+    when REDIS_URL is set. IDs that Spotify rejects are cached as the
+    placeholder for a shorter time so they are not looked up on every render.
+    Concurrent lookups of the same ID share one Spotify call.
+
     Args
     -----
         spotify_url : str
@@ -183,28 +772,318 @@ def get_album_image_url(spotify_url, sp):
         str
             Album image URL or placeholder if not found.
     """
+    parsed = parse_spotify_url(spotify_url)
+    if parsed is None:
+        logger.debug(
+            "URL is not a track or album",
+            extra={"spotify_url": spotify_url, "sample_rate": LOG_SAMPLE_RATE},
+        )
+        return PLACEHOLDER_IMAGE
+
+    spotify_type, spotify_id = parsed
+    cache_key = f"{spotify_type}:{spotify_id}"
+    cached = _album_image_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    own, waiting = _album_image_flight.claim([cache_key])
+    if waiting:
+        try:
+            image_url = waiting[cache_key].result(timeout=SPOTIFY_MAX_WAIT)
+        except FutureTimeoutError:
+            image_url = None
+        return image_url or PLACEHOLDER_IMAGE
+
+    image_url = None
+    try:
+        image_url = _fetch_album_image(spotify_type, spotify_id, sp)
+    finally:
+        _album_image_flight.resolve(own, {cache_key: image_url})
+    return image_url or PLACEHOLDER_IMAGE
+
+
+def _fetch_album_image(spotify_type, spotify_id, sp):
+    """Looks up the album image of one track or album ID and caches it.
+
+    Returns
+    ------
+        str
+            Album image URL, or the placeholder if Spotify rejects the ID.
+        None
+            If Spotify could not be reached or rate limited the call.
+    """
+    cache_key = f"{spotify_type}:{spotify_id}"
+    try:
+        logger.debug(
+            "Fetching album image",
+            extra={
+                "spotify_type": spotify_type,
+                "spotify_id": spotify_id,
+                "sample_rate": LOG_SAMPLE_RATE,
+            },
+        )
+        if spotify_type == "track":
+            track = sp.track(spotify_id)
+            image_url = track["album"]["images"][0]["url"]
+        else:
+            album = sp.album(spotify_id)
+            image_url = album["images"][0]["url"]
+    except SpotifyException as e:
+        logger.warning("Error fetching album image: %s", e)
+        if e.http_status in (400, 404):
+            _album_image_cache.set(
+                cache_key, PLACEHOLDER_IMAGE, ALBUM_IMAGE_NEGATIVE_TTL
+            )
+            return PLACEHOLDER_IMAGE
+        return None
+    except (IndexError, KeyError, TypeError) as e:
+        logger.warning("Error fetching album image: %s", e)
+        _album_image_cache.set(cache_key, PLACEHOLDER_IMAGE, ALBUM_IMAGE_NEGATIVE_TTL)
+        return PLACEHOLDER_IMAGE
+    except Exception:
+        logger.exception("Error fetching album image")
+        return None
+
+    _album_image_cache.set(cache_key, image_url)
+    return image_url
+
+
+def _image_from_item(item):
+    """Returns the first album image of a track or album object, or None."""
+    if item is None:
+        return None
+    images = item["album"]["images"] if "album" in item else item.get("images")
+    return images[0]["url"] if images else None
+
+
+def _album_image_cache_keys(spotify_urls):
+    """Maps Spotify URLs to their album image cache keys.
+
+    Returns
+    ------
+        tuple
+            The URLs that are not track or album URLs, mapped to the
+            placeholder, and the other URLs mapped to their cache keys.
+    """
+    images = {}
+    keys_by_url = {}
+    for spotify_url in spotify_urls:
+        if not spotify_url or spotify_url in images or spotify_url in keys_by_url:
+            continue
+        parsed = parse_spotify_url(spotify_url)
+        if parsed is None:
+            images[spotify_url] = PLACEHOLDER_IMAGE
+        else:
+            keys_by_url[spotify_url] = f"{parsed[0]}:{parsed[1]}"
+    return images, keys_by_url
+
+
+def get_cached_album_image_urls(spotify_urls):
+    """Looks up album images for many Spotify URLs without calling Spotify.
+
+    Args
+    -----
+        spotify_urls : iterable of str
+            The Spotify URLs (track or album). Empty values are ignored.
+
+    Returns
+    ------
+        dict
+            The URLs whose album image is cached, mapped to it. URLs that
+            are not track or album URLs map to the placeholder.
+    """
+    images, keys_by_url = _album_image_cache_keys(spotify_urls)
+    cached = _album_image_cache.get_many(set(keys_by_url.values()))
+    for spotify_url, cache_key in keys_by_url.items():
+        if cache_key in cached:
+            images[spotify_url] = cached[cache_key]
+    return images
+
+
+def get_album_image_urls(spotify_urls, sp, default=PLACEHOLDER_IMAGE):
+    """Fetches album images for many Spotify track or album URLs at once.
+
+    Cached images are used where possible. The remaining IDs are resolved
+    with the multi-ID endpoints, 50 tracks or 20 albums per call, so a page
+    of 200 threads needs about four Spotify calls on a cold cache.
+
+    Args
+    -----
+        spotify_urls : iterable of str
+            The Spotify URLs (track or album). Empty values are ignored.
+        sp: Spotify
+            Spotipy client object.
+        default : str
+            Returned for IDs that could not be resolved because of a
+            temporary error, such as a timeout or rate limiting.
+
+    Returns
+    ------
+        dict
+            Every non-empty URL mapped to its album image URL. URLs that are
+            not track or album URLs, or that Spotify rejects, map to the
+            placeholder.
+    """
+    images, keys_by_url = _album_image_cache_keys(spotify_urls)
+    resolved = _album_image_cache.get_many(set(keys_by_url.values()))
+
+    # IDs another request is already fetching are waited for, not refetched.
+    own, waiting = _album_image_flight.claim(
+        set(keys_by_url.values()) - resolved.keys()
+    )
+
+    fetched = {}
     try:
-        print(f"DEBUG - Spotify URL received: {spotify_url}")
-        parts = spotify_url.split("/")
-        if "track" in parts:
-            track_id = parts[-1].split("?")[0]
-            print(f"DEBUG - Detected track ID: {track_id}")
-            track = sp.track(track_id)
-            return track["album"]["images"][0]["url"]
-        elif "album" in parts:
-            album_id = parts[-1].split("?")[0]
-            print(f"DEBUG - Detected album ID: {album_id}")
-            album = sp.album(album_id)
-            return album["images"][0]["url"]
+        missing = {"track": [], "album": []}
+        for cache_key in own:
+            spotify_type, spotify_id = cache_key.split(":", 1)
+            missing[spotify_type].append(spotify_id)
+
+        for spotify_type, batch_size in (
+            ("track", TRACKS_BATCH_SIZE),
+            ("album", ALBUMS_BATCH_SIZE),
+        ):
+            ids = missing[spotify_type]
+            for start in range(0, len(ids), batch_size):
+                batch = ids[start : start + batch_size]
+                fetched.update(_fetch_album_image_batch(spotify_type, batch, sp))
+    finally:
+        _album_image_flight.resolve(own, fetched)
+    resolved.update(fetched)
+
+    deadline = time.monotonic() + SPOTIFY_MAX_WAIT
+    for cache_key, future in waiting.items():
+        try:
+            image_url = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            continue
+        if image_url is not None:
+            resolved[cache_key] = image_url
+
+    for spotify_url, cache_key in keys_by_url.items():
+        images[spotify_url] = resolved.get(cache_key, default)
+    return images
+
+
+def _fetch_album_image_batch(spotify_type, ids, sp):
+    """Resolves one batch of track or album IDs and caches the results.
+
+    Spotify rejects a whole batch if one of the IDs is malformed, in which
+    case the IDs are looked up one by one so the bad ones can be cached as
+    misses without losing the rest.
+
+    Returns
+    ------
+        dict
+            Cache keys ("track:<id>" or "album:<id>") mapped to image URLs.
+    """
+    try:
+        if spotify_type == "track":
+            items = sp.tracks(ids)["tracks"]
+        else:
+            items = sp.albums(ids)["albums"]
+    except SpotifyException as e:
+        if e.http_status != 400:
+            logger.warning("Error fetching album images: %s", e)
+            return {}
+        # The keys are already claimed by this caller, so they are fetched
+        # directly rather than through get_album_image_url.
+        resolved = {}
+        for spotify_id in ids:
+            image_url = _fetch_album_image(spotify_type, spotify_id, sp)
+            if image_url is not None:
+                resolved[f"{spotify_type}:{spotify_id}"] = image_url
+        return resolved
+    except Exception:
+        logger.exception("Error fetching album images")
+        return {}
+
+    resolved = {}
+    for spotify_id, item in zip(ids, items):
+        cache_key = f"{spotify_type}:{spotify_id}"
+        image_url = _image_from_item(item)
+        if image_url is None:
+            _album_image_cache.set(
+                cache_key, PLACEHOLDER_IMAGE, ALBUM_IMAGE_NEGATIVE_TTL
+            )
+            resolved[cache_key] = PLACEHOLDER_IMAGE
         else:
-            print("DEBUG - URL is not a track or album.")
-            return "/static/tunelink.png"
-    except Exception as e:
-        print(f"Error fetching album image: {e}")
-        return "/static/tunelink.png"
+            _album_image_cache.set(cache_key, image_url)
+            resolved[cache_key] = image_url
+    return resolved
+
+
+def resolve_spotify_artwork(spotify_url, sp):
+    """Resolves the artwork that is stored with a new thread or comment.
+
+    Args
+    -----
+        spotify_url : str
+            The Spotify URL (track or album), or None.
+        sp: Spotify
+            Spotipy client object.
+
+    Returns
+    ------
+        dict
+            A dictionary with spotify_type, spotify_id and album_image.
+            album_image is None if Spotify could not be reached, so the
+            backfill command can fill it in later.
+    """
+    if not spotify_url:
+        return {"spotify_type": None, "spotify_id": None, "album_image": None}
+
+    parsed = parse_spotify_url(spotify_url)
+    spotify_type, spotify_id = parsed if parsed is not None else (None, None)
+    album_image = get_album_image_urls([spotify_url], sp, default=None)[spotify_url]
+
+    return {
+        "spotify_type": spotify_type,
+        "spotify_id": spotify_id,
+        "album_image": album_image,
+    }
+
+
+def attach_album_images(items, key="album_image", mark_pending=True):
+    """Adds an album image to every thread or comment dict in a list.
+
+    Pages are never held up by Spotify: artwork stored with the thread or
+    comment is used as is, and items without any get their cached artwork
+    or the placeholder. Those items are marked with artwork_pending so the
+    page can fetch and store their artwork through /ajax/artwork once it
+    has loaded. Artwork is only looked up and stored on such a first view;
+    `flask backfill-artwork` fills in the rows nobody has viewed.
+
+    Args
+    -----
+        items : list of dict
+            Threads or comments with an optional "spotify_url".
+        key : str
+            The key the image URL is stored under.
+        mark_pending : bool
+            Whether items without stored artwork are marked as pending. Pass
+            False for visitors who are not logged in, since /ajax/artwork
+            only serves logged in users.
+
+    Returns
+    ------
+        list of dict
+            The same list, with key and artwork_pending set on every item.
+    """
+    missing = [item.get("spotify_url") for item in items if not item.get("album_image")]
+    images = get_cached_album_image_urls(missing) if missing else {}
+    for item in items:
+        stored = item.get("album_image")
+        item["artwork_pending"] = (
+            mark_pending
+            and not stored
+            and parse_spotify_url(item.get("spotify_url")) is not None
+        )
+        item[key] = stored or images.get(item.get("spotify_url"), PLACEHOLDER_IMAGE)
+    return items
 
 
-def get_dashboard_data(token_info, user_id):
+def get_dashboard_data(token_info, user_id, before=None):
     """Retrives user information and subscribed forum threads including assosiacted Spotify album images.
 
     Args
@@ -213,6 +1092,8 @@ def get_dashboard_data(token_info, user_id):
             A dictionary containing the access token for Spotify API.
         user_id : int
             The ID of the user in the database.
+        before : tuple
+            A (created_at, id) cursor; only threads older than it are fetched.
 
     Returns
     -------
@@ -221,18 +1102,12 @@ def get_dashboard_data(token_info, user_id):
 
     """
     try:
-        sp = Spotify(auth=token_info["access_token"])
-        user = get_user(token_info["access_token"])
+        user = get_cached_user(token_info["access_token"], user_id)
 
-        threads = get_threads_by_user_subscriptions(user_id)
-        for thread in threads:
-            spotify_url = thread.get("spotify_url")
-            if spotify_url is not None:
-                thread["album_image"] = get_album_image_url(spotify_url, sp)
-            else:
-                thread["album_image"] = "/static/tunelink.png"
+        threads = get_threads_by_user_subscriptions(user_id, before=before)
+        attach_album_images(threads)
 
         return user, threads
-    except Exception as e:
-        print(f"[error] Failed to fetch dashboard data: {e}")
+    except Exception:
+        logger.exception("Failed to fetch dashboard data")
         return None, []
@@ -4,17 +4,37 @@ document.addEventListener("DOMContentLoaded", () => {
 
   if (!searchInput || !resultsContainer) return;
 
+  let debounceTimer = null;
+  let inFlight = null;
+
   searchInput.addEventListener("input", () => {
+    clearTimeout(debounceTimer);
+    debounceTimer = setTimeout(searchSubforums, 200);
+  });
+
+  function searchSubforums() {
     const query = searchInput.value.trim();
-    resultsContainer.innerHTML = "";
+
+    // Only the latest request matters; drop answers to earlier keystrokes.
+    if (inFlight) inFlight.abort();
+    inFlight = null;
 
     if (query.length < 3) {
+      resultsContainer.innerHTML = "";
       resultsContainer.classList.add("d-none");
       return;
     }
-    fetch(`/ajax/search_subforums?q=${encodeURIComponent(query)}`)
+
+    const controller = new AbortController();
+    inFlight = controller;
+
+    fetch(`/ajax/search_subforums?q=${encodeURIComponent(query)}`, {
+      signal: controller.signal,
+    })
       .then((res) => res.json())
       .then((data) => {
+        resultsContainer.innerHTML = "";
+
         if (data.length === 0) {
           resultsContainer.classList.remove("d-none");
           resultsContainer.innerHTML =
@@ -36,8 +56,14 @@ document.addEventListener("DOMContentLoaded", () => {
           item.innerHTML = `<a href="/subforum/${forum.name}"class="text-decoration-none">${forum.name}</a>`;
           resultsContainer.appendChild(item);
         });
+      })
+      .catch((err) => {
+        if (err.name !== "AbortError") throw err;
+      })
+      .finally(() => {
+        if (inFlight === controller) inFlight = null;
       });
-  });
+  }
   document.addEventListener("click", (event) => {
     if (
       !searchInput.contains(event.target) &&
@@ -54,6 +80,90 @@ document.addEventListener("DOMContentLoaded", () => {
   });
 });
 
+// Cards rendered without stored artwork show the cached image or the
+// placeholder; fetch the real artwork once the page is up.
+const ARTWORK_BATCH_SIZE = 100;
+
+function loadPendingArtwork(root) {
+  const pending = Array.from(
+    root.querySelectorAll("img[data-artwork-thread], img[data-artwork-comment]")
+  ).map((img) => {
+    const entry = {
+      img,
+      kind: img.dataset.artworkThread ? "threads" : "comments",
+      id: img.dataset.artworkThread || img.dataset.artworkComment,
+    };
+    // Claimed; a later call for newly added cards must not fetch it again.
+    delete img.dataset.artworkThread;
+    delete img.dataset.artworkComment;
+    return entry;
+  });
+
+  for (let start = 0; start < pending.length; start += ARTWORK_BATCH_SIZE) {
+    const batch = pending.slice(start, start + ARTWORK_BATCH_SIZE);
+    const params = new URLSearchParams({
+      threads: batch.filter((e) => e.kind === "threads").map((e) => e.id).join(","),
+      comments: batch.filter((e) => e.kind === "comments").map((e) => e.id).join(","),
+    });
+
+    fetch(`/ajax/artwork?${params}`)
+      .then((res) => res.json())
+      .then((data) => {
+        batch.forEach(({ img, kind, id }) => {
+          const url = data[kind] && data[kind][id];
+          if (url && img.getAttribute("src") !== url) img.src = url;
+        });
+      })
+      .catch(() => {});
+  }
+}
+
+document.addEventListener("DOMContentLoaded", () => loadPendingArtwork(document));
+
+document.addEventListener("DOMContentLoaded", () => {
+  const threadList = document.getElementById("thread-list");
+  const loadMore = document.getElementById("load-more-threads");
+
+  if (!threadList || !loadMore) return;
+
+  let loading = false;
+
+  const loadNextPage = () => {
+    const nextUrl = loadMore.dataset.nextUrl;
+    if (loading || !nextUrl) return;
+    loading = true;
+
+    fetch(nextUrl)
+      .then((res) => res.json())
+      .then((data) => {
+        threadList.insertAdjacentHTML("beforeend", data.html);
+        loadPendingArtwork(threadList);
+        if (data.next_url) {
+          loadMore.dataset.nextUrl = data.next_url;
+        } else {
+          observer.disconnect();
+          loadMore.remove();
+        }
+      })
+      .finally(() => {
+        loading = false;
+      });
+  };
+
+  const observer = new IntersectionObserver(
+    (entries) => {
+      if (entries.some((entry) => entry.isIntersecting)) loadNextPage();
+    },
+    { rootMargin: "400px" }
+  );
+  observer.observe(loadMore);
+
+  loadMore.addEventListener("click", (event) => {
+    event.preventDefault();
+    loadNextPage();
+  });
+});
+
 const threadIdMatch = window.location.pathname.match(/\/thread\/(\d+)/);
 console.log("threadIdMatch: ", threadIdMatch);
 const threadId = threadIdMatch ? threadIdMatch[1] : null;
@@ -67,6 +177,14 @@ function updateVoteCounts(data) {
   }
 }
 
+// Voting the same way twice removes the vote; the other way replaces it.
+function updateVoteButtons(clicked, other) {
+  const wasActive = clicked.classList.contains("btn-primary");
+  clicked.classList.toggle("btn-primary", !wasActive);
+  clicked.classList.toggle("btn-secondary", wasActive);
+  other.classList.replace("btn-primary", "btn-secondary");
+}
+
 if (threadId) {
   document.getElementById("like-button").addEventListener("click", () => {
     fetch(`/thread/${threadId}/vote`, {
@@ -78,7 +196,12 @@ if (threadId) {
     })
       .then((response) => response.json())
       .then((data) => {
+        if (data.error) return;
         updateVoteCounts(data);
+        updateVoteButtons(
+          document.getElementById("like-button"),
+          document.getElementById("dislike-button")
+        );
       });
   });
 
@@ -92,7 +215,12 @@ if (threadId) {
     })
       .then((response) => response.json())
       .then((data) => {
+        if (data.error) return;
         updateVoteCounts(data);
+        updateVoteButtons(
+          document.getElementById("dislike-button"),
+          document.getElementById("like-button")
+        );
       });
   });
 
@@ -0,0 +1,372 @@
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+
+import redis
+
+import db
+from cache import get_redis, mark_redis_down
+
+logger = logging.getLogger(__name__)
+
+# Seconds between bulk writes of buffered votes to the likes table.
+VOTE_FLUSH_INTERVAL = float(os.getenv("VOTE_FLUSH_INTERVAL", "0.25"))
+# Seconds a thread's vote state stays in Redis after its last vote.
+VOTE_STATE_TTL = int(os.getenv("VOTE_STATE_TTL", "3600"))
+
+# Votes not yet written to Postgres, "<thread_id>:<user_id>" -> final vote.
+PENDING_KEY = "tunelink:votes:pending"
+# The batch being written. It is only removed once its transaction has
+# committed, so a flusher that dies mid-write leaves it for the next one.
+FLUSHING_KEY = "tunelink:votes:flushing"
+# Held while flushing, so batches are written one at a time and in order.
+FLUSH_LOCK_KEY = "tunelink:votes:flush_lock"
+FLUSH_LOCK_TTL_MS = 30000
+
+# Toggles a vote against the thread's state in Redis and queues the result.
+# The state is seeded from Postgres with the optional ARGV[5..7]; HSETNX
+# keeps whatever a concurrent vote stored first. Returns nil when the state
+# still has to be seeded, and -1 when the thread has no state but votes on it
+# are still queued: Postgres does not count those yet, so the thread may only
+# be seeded once they are flushed.
+_TOGGLE_SCRIPT = """
+local field = "u:" .. ARGV[1]
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    local prefix = ARGV[2] .. ":"
+    for _, queue in ipairs({KEYS[2], KEYS[3]}) do
+        for _, queued in ipairs(redis.call("HKEYS", queue)) do
+            if string.sub(queued, 1, #prefix) == prefix then
+                return -1
+            end
+        end
+    end
+end
+
+if ARGV[5] then
+    redis.call("HSETNX", KEYS[1], "likes", ARGV[5])
+    redis.call("HSETNX", KEYS[1], "dislikes", ARGV[6])
+    redis.call("HSETNX", KEYS[1], field, ARGV[7])
+end
+
+local state = redis.call("HMGET", KEYS[1], "likes", "dislikes", field)
+if not state[1] or not state[3] then
+    return nil
+end
+
+local likes = tonumber(state[1])
+local dislikes = tonumber(state[2])
+local old = tonumber(state[3])
+local vote = tonumber(ARGV[3])
+local new = vote
+if old == vote then
+    new = 0
+end
+
+if old == 1 then likes = likes - 1 elseif old == -1 then dislikes = dislikes - 1 end
+if new == 1 then likes = likes + 1 elseif new == -1 then dislikes = dislikes + 1 end
+
+redis.call("HSET", KEYS[1], "likes", likes, "dislikes", dislikes, field, new)
+redis.call("EXPIRE", KEYS[1], ARGV[4])
+redis.call("HSET", KEYS[2], ARGV[2] .. ":" .. ARGV[1], new)
+return {likes, dislikes}
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# Times a vote waits for a thread's queued votes to be flushed before it is
+# written straight to Postgres instead.
+SEED_ATTEMPTS = 5
+
+# Returned by _toggle while the thread cannot be seeded yet.
+_UNFLUSHED = object()
+
+# Loaded into Redis once and then called by their SHA1.
+_toggle_script = None
+_release_script = None
+
+_flusher = None
+_flusher_lock = threading.Lock()
+_stop_flusher = threading.Event()
+
+# (thread_id, user_id) of votes written straight to Postgres while Redis was
+# unavailable. Their state in Redis is dropped once it is reachable again.
+_fallback_votes = set()
+_fallback_votes_lock = threading.Lock()
+
+
+def _thread_key(thread_id):
+    return f"tunelink:votes:thread:{thread_id}"
+
+
+def _load_scripts(client):
+    global _toggle_script, _release_script
+
+    if _toggle_script is None:
+        _toggle_script = client.register_script(_TOGGLE_SCRIPT)
+        _release_script = client.register_script(_RELEASE_SCRIPT)
+
+
+def _toggle(client, user_id, thread_id, vote, seed=None):
+    _load_scripts(client)
+    args = [user_id, thread_id, vote, VOTE_STATE_TTL]
+    if seed is not None:
+        args += [seed["likes"], seed["dislikes"], seed["vote"]]
+    result = _toggle_script(
+        keys=[_thread_key(thread_id), PENDING_KEY, FLUSHING_KEY],
+        args=args,
+        client=client,
+    )
+    if result is None:
+        return None
+    if result == -1:
+        return _UNFLUSHED
+    return {"likes": int(result[0]), "dislikes": int(result[1])}
+
+
+def _register_vote_in_db(user_id, thread_id, vote):
+    if os.getenv("REDIS_URL"):
+        with _fallback_votes_lock:
+            _fallback_votes.add((thread_id, user_id))
+    return db.register_thread_like_or_dislike(user_id, thread_id, vote)
+
+
+def _forget_fallback_votes(client):
+    # The thread's totals in Redis no longer match Postgres, and a vote still
+    # queued from before the outage would overwrite the newer one, so both
+    # are dropped. The thread is seeded from Postgres again once the other
+    # users' queued votes on it have been flushed.
+    with _fallback_votes_lock:
+        if not _fallback_votes:
+            return
+        fallback_votes = set(_fallback_votes)
+
+    pipe = client.pipeline(transaction=False)
+    for thread_id, user_id in fallback_votes:
+        pipe.hdel(PENDING_KEY, f"{thread_id}:{user_id}")
+        pipe.hdel(FLUSHING_KEY, f"{thread_id}:{user_id}")
+        pipe.delete(_thread_key(thread_id))
+    pipe.execute()
+
+    with _fallback_votes_lock:
+        _fallback_votes.difference_update(fallback_votes)
+
+
+def register_vote(user_id, thread_id, vote):
+    """Registers, changes or removes a user's vote on a thread.
+
+    Voting the same way twice removes the vote, like
+    db.register_thread_like_or_dislike. With Redis configured, the vote is
+    applied to the thread's totals in Redis and queued, and the flusher
+    thread writes queued votes to Postgres in bulk every
+    VOTE_FLUSH_INTERVAL seconds, so a burst of votes costs a few write
+    transactions instead of one per click. Postgres is only read the first
+    time a user votes on a thread within VOTE_STATE_TTL, and a thread is
+    only seeded from it once no votes on the thread are queued, since
+    Postgres does not count those yet. Without Redis the vote is written
+    directly, and if Redis was only unavailable the thread's state in Redis
+    is dropped once it is back.
+
+    Args
+    -------
+        user_id : int
+            The ID of the user.
+        thread_id : int
+            The ID of the thread.
+        vote : int
+            The vote value, 1 for like and -1 for dislike.
+
+    Returns
+    -------
+        dict
+            The thread's total likes and dislikes after the vote.
+            Example: {"likes": 10, "dislikes": 2}
+        None
+            If the thread does not exist or an error occurs.
+    """
+    client = get_redis()
+    if client is None:
+        return _register_vote_in_db(user_id, thread_id, vote)
+
+    try:
+        _forget_fallback_votes(client)
+        for _ in range(SEED_ATTEMPTS):
+            totals = _toggle(client, user_id, thread_id, vote)
+            if totals is None:
+                seed = db.get_vote_state(thread_id, user_id)
+                if seed is None:
+                    return None
+                totals = _toggle(client, user_id, thread_id, vote, seed)
+            if totals is not _UNFLUSHED:
+                return totals
+            if not flush_votes():
+                time.sleep(VOTE_FLUSH_INTERVAL)
+    except redis.RedisError as e:
+        mark_redis_down(e)
+    return _register_vote_in_db(user_id, thread_id, vote)
+
+
+def get_buffered_votes(thread_id, user_id):
+    """Fetches a thread's vote totals and a user's vote as held in Redis.
+
+    They include votes not yet written to Postgres, so pages showing a
+    thread's votes should prefer them over the likes table.
+
+    Args
+    -------
+        thread_id : int
+            The ID of the thread.
+        user_id : int
+            The ID of the user viewing the thread.
+
+    Returns
+    -------
+        dict
+            The thread's "likes" and "dislikes", and the user's "vote" (1,
+            -1 or 0), which is None if the user has not voted since the
+            state was seeded.
+        None
+            If Redis holds no vote state for the thread or is unavailable.
+    """
+    client = get_redis()
+    if client is None:
+        return None
+
+    try:
+        _forget_fallback_votes(client)
+        likes, dislikes, vote = client.hmget(
+            _thread_key(thread_id), "likes", "dislikes", f"u:{user_id}"
+        )
+    except redis.RedisError as e:
+        mark_redis_down(e)
+        return None
+
+    if likes is None:
+        return None
+    return {
+        "likes": int(likes),
+        "dislikes": int(dislikes),
+        "vote": int(vote) if vote is not None else None,
+    }
+
+
+def forget_thread(thread_id):
+    """Drops a deleted thread's vote state from Redis.
+
+    Votes on it that are still queued are skipped when they are written.
+    """
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.delete(_thread_key(thread_id))
+    except redis.RedisError as e:
+        mark_redis_down(e)
+
+
+def _parse_votes(raw_votes):
+    votes = []
+    for field, vote in raw_votes.items():
+        thread_id, user_id = field.split(b":")
+        votes.append((int(user_id), int(thread_id), int(vote)))
+    return votes
+
+
+def flush_votes():
+    """Writes the votes queued in Redis to Postgres in a single transaction.
+
+    Only one process flushes at a time. A batch left behind by a flusher
+    that died is written before newer votes are taken, so the latest vote
+    of every user always ends up in the likes table.
+
+    Returns
+    -------
+        int
+            The number of votes written.
+    """
+    client = get_redis()
+    if client is None:
+        return 0
+
+    token = uuid.uuid4().hex
+    try:
+        _forget_fallback_votes(client)
+        if not client.set(FLUSH_LOCK_KEY, token, nx=True, px=FLUSH_LOCK_TTL_MS):
+            return 0
+        try:
+            if not client.exists(FLUSHING_KEY):
+                try:
+                    client.rename(PENDING_KEY, FLUSHING_KEY)
+                except redis.ResponseError:
+                    # Nothing is queued.
+                    return 0
+
+            votes = _parse_votes(client.hgetall(FLUSHING_KEY))
+            if votes and not db.apply_votes(votes):
+                # Kept in Redis and retried on the next flush.
+                return 0
+            client.delete(FLUSHING_KEY)
+        finally:
+            _load_scripts(client)
+            _release_script(keys=[FLUSH_LOCK_KEY], args=[token], client=client)
+    except redis.RedisError as e:
+        mark_redis_down(e)
+        return 0
+
+    if votes:
+        logger.debug("Flushed buffered votes", extra={"votes": len(votes)})
+    return len(votes)
+
+
+def _run_flusher():
+    while not _stop_flusher.wait(VOTE_FLUSH_INTERVAL):
+        try:
+            flush_votes()
+        except Exception:
+            logger.exception("Error flushing buffered votes")
+
+
+def _start_flusher_thread():
+    global _flusher
+
+    _stop_flusher.clear()
+    _flusher = threading.Thread(target=_run_flusher, name="vote-flusher", daemon=True)
+    _flusher.start()
+
+
+def _shutdown():
+    _stop_flusher.set()
+    try:
+        flush_votes()
+    except Exception:
+        logger.exception("Error flushing buffered votes at exit")
+
+
+def start_flusher():
+    """Starts the thread that writes buffered votes to Postgres.
+
+    Does nothing without REDIS_URL, since votes are then written directly.
+    Safe to call more than once; after a fork the child starts its own
+    flusher, and the queue is flushed once more when the process exits.
+
+    Enivronment variables:
+        VOTE_FLUSH_INTERVAL: Seconds between bulk writes (default 0.25).
+        VOTE_STATE_TTL: Seconds a thread's vote state is kept in Redis
+            after its last vote (default 3600).
+    """
+    if not os.getenv("REDIS_URL"):
+        return
+
+    with _flusher_lock:
+        if _flusher is not None:
+            return
+        _start_flusher_thread()
+        atexit.register(_shutdown)
+        os.register_at_fork(after_in_child=_start_flusher_thread)